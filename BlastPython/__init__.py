@@ -21,9 +21,22 @@
 
 from fasta_stream_from_stream import fasta_stream_from_stream
 from blast_seq_stream         import blast_seq_stream
+from kmer_prefilter           import kmer_prefilter
 from blaster                  import blaster
+from query_cache              import query_cache, default_query_cache
+from parallel_blaster         import parallel_blaster
 from blast_result_stream      import blast_result_stream
+from top_k_sink               import top_k_sink
+from cross_search             import cross_search, plan_cross_search
+from all_vs_all               import all_vs_all
+from process_blast_result_stream import process_blast_result_stream
+from process_blast_result_stream import query_spec
+from hsp_records              import hsp_records, HSP_FIELDS
+from match_endpoints          import match_endpoints
+from tabular_writer           import tabular_writer
+from interval_index           import interval_index
 from blast_filter             import base_blast_filter, blast_filter
+from blast_filter             import predicate_filter
 from blast_seq_factory        import seq_factory_from_fasta
 from blast_seq_factory        import seq_factory_from_str
 from IO_interface             import FS_IO
@@ -0,0 +1,232 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+All-vs-all comparison of a set of sequences, tiled into blocks that are
+each run as a single multi-query, multi-subject search.
+"""
+
+import os, struct
+
+import ncbi_toolkit
+from blaster import blaster
+from hsp_records import hsp_records
+
+
+FILE_MAGIC = 'BPAVA003'
+FILE_HEADER = struct.Struct('<8siiii')  # magic, n, block_size, sym, skip
+TILE_HEADER = struct.Struct('<iii')     # block row, block column, n records
+RECORD = struct.Struct('<iiiddi' + 'i'*12 + 'd')  # one hsp_records tuple
+
+_QUERY_FRAME, _SUBJECT_FRAME, _CONTEXT = 6, 10, 14
+
+EProgram = ncbi_toolkit.EProgram
+
+# number of contexts (strands or frames) per query
+QUERY_CONTEXTS = {
+  EProgram.eBlastn: 2,
+  EProgram.eMegablast: 2,
+  EProgram.eDiscMegablast: 2,
+  EProgram.eBlastp: 1,
+  EProgram.eBlastx: 6,
+  EProgram.eTblastn: 1,
+  EProgram.eTblastx: 6,
+  }
+
+# programs that search the same kind of sequence on both sides
+SYMMETRIC_PROGRAMS = (EProgram.eBlastn, EProgram.eMegablast,
+                      EProgram.eDiscMegablast, EProgram.eBlastp,
+                      EProgram.eTblastx)
+
+
+def get_context(program, query_index, query_frame):
+  """
+  The engine's context number for a match on frame query_frame of
+  query number query_index.
+  """
+  n = QUERY_CONTEXTS[program]
+  if n == 1:
+    return query_index
+  if n == 2:
+    return 2 * query_index + (query_frame < 0)
+  return 6 * query_index + (query_frame - 1 if query_frame > 0
+                            else 2 - query_frame)
+
+
+def reverse_segment(frame, offset, end, gapped_start, length):
+  """
+  Move a segment of a nucleotide sequence to the other strand.
+  """
+  return (frame, length - end, length - offset, length - 1 - gapped_start)
+
+
+def mirror_record(r, query_length, subject_length,
+                  program=EProgram.eBlastn):
+  """
+  Swap the query and subject roles in an hsp_records tuple, where
+  query_length and subject_length are the lengths of the query and
+  subject of r. The result is laid out as the engine would report it:
+  for blastn, the strand of a match is carried by the query, and
+  minus strand coordinates are on the reverse complement, so both
+  segments move to the other strand; frames (for tblastx) and context
+  follow the new query. Alignment statistics are symmetric; the score,
+  bit score and evalue are copied from r, although the evalue (and,
+  with composition based statistics, the scores) would in general
+  differ slightly if the search were run the other way round.
+  """
+  query = r[_QUERY_FRAME:_SUBJECT_FRAME]
+  subject = r[_SUBJECT_FRAME:_CONTEXT]
+  if QUERY_CONTEXTS[program] == 2 and query[0] < 0:
+    query = reverse_segment(*(query + (query_length,)))
+    subject = reverse_segment(*(subject + (subject_length,)))
+    query, subject = (subject[0],) + query[1:], (query[0],) + subject[1:]
+  return ((r[1], r[0]) + r[2:_QUERY_FRAME] + subject + query +
+          (get_context(program, r[1], subject[0]),) + r[_CONTEXT+1:])
+
+
+class all_vs_all(object):
+
+  def __init__(self, seqs, symmetric=True, skip_diagonal=True,
+               block_size=64, result_file=None, **kw):
+    """
+    Blast every sequence in seqs against every other one. Iterating
+    over this object yields hsp_records tuples whose query_index and
+    subject_oid fields are indices into seqs.
+
+    If symmetric is True, only the upper triangle of the comparison
+    matrix is computed and its results are mirrored to the lower one
+    (see mirror_record); this needs a program that searches the same
+    kind of sequence on both sides (see SYMMETRIC_PROGRAMS). If
+    skip_diagonal is True, sequences are not compared with
+    themselves. If result_file is given, the (unmirrored) records of
+    each completed tile are appended to it, and tiles already found
+    there are read back instead of being computed again, so an
+    interrupted run can be resumed. Blast options are given as
+    keywords, as for blaster. Each block of rows is searched by a
+    single engine, whose query set-up is reused for all the blocks of
+    columns. The context field of the records refers to query_index,
+    i.e., it is numbered as if all of seqs were the query.
+    """
+    self.program = kw.get('Program', EProgram.eBlastn)
+    if self.program not in QUERY_CONTEXTS:
+      raise ValueError("unsupported program: %s" % self.program)
+    if symmetric and self.program not in SYMMETRIC_PROGRAMS:
+      raise ValueError("symmetric runs need one of %s" %
+                       (SYMMETRIC_PROGRAMS,))
+    self.seqs = list(seqs)
+    self.symmetric = symmetric
+    self.skip_diagonal = skip_diagonal
+    self.block_size = block_size
+    self.result_file = result_file
+    self.options = kw
+    self.n_blocks = (len(self.seqs) + block_size - 1) // block_size
+    self.computed_tiles = 0
+
+  def tiles(self):
+    for bi in xrange(self.n_blocks):
+      for bj in xrange(bi if self.symmetric else 0, self.n_blocks):
+        yield bi, bj
+
+  def __iter__(self):
+    done, fp = {}, None
+    if self.result_file is not None:
+      done, fp = self.__open_result_file()
+    engine, engine_row = None, None
+    try:
+      for tile in self.tiles():
+        if tile in done:
+          records = self.__read_tile(fp, *done[tile])
+        else:
+          if engine_row != tile[0]:
+            if engine is not None:
+              engine.close()
+            engine, engine_row = self.__make_engine(tile[0]), tile[0]
+          records = self.__run_tile(engine, *tile)
+          self.computed_tiles += 1
+          if fp is not None:
+            self.__write_tile(fp, tile, records)
+        for r in records:
+          yield r
+          if self.symmetric and r[0] != r[1]:
+            yield mirror_record(r, self.seqs[r[0]].length,
+                                self.seqs[r[1]].length, self.program)
+    finally:
+      if engine is not None:
+        engine.close()
+      if fp is not None:
+        fp.close()
+
+  def __make_engine(self, bi):
+    B = self.block_size
+    return blaster(self.seqs[bi*B:(bi+1)*B], cache=False, **self.options)
+
+  def __run_tile(self, engine, bi, bj):
+    B = self.block_size
+    _, results = engine.blast(self.seqs[bj*B:(bj+1)*B])
+    records = []
+    for r in hsp_records(results):
+      i, j = bi*B + r[0], bj*B + r[1]
+      if (self.symmetric and i > j) or (self.skip_diagonal and i == j):
+        continue
+      context = get_context(self.program, i, r[_QUERY_FRAME])
+      records.append((i, j) + r[2:_CONTEXT] + (context,) + r[_CONTEXT+1:])
+    return records
+
+  def __read_tile(self, fp, offset, n):
+    fp.seek(offset)
+    data = fp.read(n * RECORD.size)
+    fp.seek(0, os.SEEK_END)
+    return [RECORD.unpack_from(data, k * RECORD.size) for k in xrange(n)]
+
+  def __write_tile(self, fp, tile, records):
+    data = [TILE_HEADER.pack(tile[0], tile[1], len(records))]
+    data.extend([RECORD.pack(*r) for r in records])
+    fp.write(''.join(data))
+    fp.flush()
+
+  def __open_result_file(self):
+    header = FILE_HEADER.pack(FILE_MAGIC, len(self.seqs), self.block_size,
+                              self.symmetric, self.skip_diagonal)
+    if not os.path.exists(self.result_file):
+      fp = open(self.result_file, 'wb')
+      fp.write(header)
+      fp.flush()
+      return {}, fp
+    fp = open(self.result_file, 'r+b')
+    if fp.read(FILE_HEADER.size) != header:
+      fp.close()
+      raise ValueError("%s: result file does not match this run" %
+                       self.result_file)
+    size = os.fstat(fp.fileno()).st_size
+    done, end = {}, fp.tell()
+    while True:
+      h = fp.read(TILE_HEADER.size)
+      if len(h) < TILE_HEADER.size:
+        break
+      bi, bj, n = TILE_HEADER.unpack(h)
+      fp.seek(n * RECORD.size, os.SEEK_CUR)
+      if fp.tell() > size:
+        break
+      done[(bi, bj)] = (end + TILE_HEADER.size, n)
+      end = fp.tell()
+    fp.seek(end)
+    fp.truncate()  # drop a partially written tile, if any
+    return done, fp
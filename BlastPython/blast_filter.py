@@ -18,9 +18,12 @@
 # blast-python.  If not, see <http://www.gnu.org/licenses/>.
 # 
 # END_COPYRIGHT
+import re
 import time
 import logging
 
+import ncbi_toolkit
+
 
 class base_blast_filter(object):
 
@@ -64,3 +67,61 @@ class blast_filter(base_blast_filter):
     self.logger.debug("delta t: %g" % delta_t)
     self.start_time = time.time()
     return True
+
+
+# tabular output column names accepted as field names
+FIELD_ALIASES = {
+  'bitscore': 'bit_score',
+  'length': 'align_len',
+  'mismatch': 'mismatches',
+  'gapopen': 'gap_opens',
+  'nident': 'num_ident',
+  }
+
+TERM_RE = re.compile(r"^\s*(\w+)\s*(<=|>=|==|!=|<|>|=)\s*(\S+)\s*$")
+
+CONJUNCTION_RE = re.compile(r"\s+and\s+", re.IGNORECASE)
+
+
+def parse_predicate(spec):
+  """
+  Parse a conjunction of comparisons, such as 'evalue < 1e-5 and
+  bit_score > 50 and pident >= 90', into a list of (field, op, value)
+  terms. Fields are those in HSP_FIELDS (or tabular output column
+  names such as bitscore and length); '=' is the same as '=='.
+  """
+  terms = []
+  for t in CONJUNCTION_RE.split(spec.strip()):
+    m = TERM_RE.match(t)
+    if m is None:
+      raise ValueError("invalid filter term: %r" % t)
+    field, op, value = m.groups()
+    try:
+      value = float(value)
+    except ValueError:
+      raise ValueError("invalid value in filter term: %r" % t)
+    terms.append((FIELD_ALIASES.get(field, field), op == '=' and '==' or op,
+                  value))
+  return terms
+
+
+class predicate_filter(base_blast_filter):
+  """
+  Keeps only the HSPs that satisfy spec (see parse_predicate) from a
+  stream of (subject, results) tuples, such as a blast_result_stream.
+  The predicate runs in C++ over the raw engine results; records are
+  yielded as (subject, snapshot), where snapshot is a
+  BlastResultsSnapshot of the selected HSPs, and records with no such
+  HSPs are dropped. Wrap it in a blast_filter to count records or
+  stop after max_count of them.
+  """
+  def __init__(self, in_stream, spec):
+    base_blast_filter.__init__(self, in_stream)
+    self.predicate = ncbi_toolkit.hsp_predicate(parse_predicate(spec))
+
+  def next(self):
+    while True:
+      subject, results = self.in_stream.next()
+      selected = self.predicate.select(results)
+      if selected is not None:
+        return subject, selected
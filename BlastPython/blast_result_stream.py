@@ -22,17 +22,59 @@ import time
 
 class blast_result_stream(object):
 
-  def __init__(self, blaster, seq_stream):
+  def __init__(self, blaster, seq_stream, batch_size=1, max_residues=0):
+    """
+    Creates a stream of (subject, results) tuples by blasting the
+    subjects from seq_stream. If batch_size > 1 or max_residues > 0,
+    subjects are collected into chunks of at most batch_size sequences
+    (0: no limit) and max_residues total length (0: no limit), and each
+    chunk is run as a single multi-subject search (see
+    blaster.blast_batch). Results of a chunk are valid until the stream
+    moves on to the next chunk.
+    """
     self.blaster = blaster
     self.in_stream  = seq_stream
+    self.batch_size = batch_size
+    self.max_residues = max_residues
     self.total_time = 0
+    self.__buffer = []
+    self.__lookahead = None
 
   def __iter__(self) :
     return self
 
+  def __next_seq(self):
+    if self.__lookahead is not None:
+      seq, self.__lookahead = self.__lookahead, None
+      return seq
+    return self.in_stream.next()
+
+  def __next_batch(self):
+    batch = [self.__next_seq()]
+    residues = len(batch[0])
+    while len(batch) != self.batch_size:
+      try:
+        seq = self.__next_seq()
+      except StopIteration:
+        break
+      residues += len(seq)
+      if 0 < self.max_residues < residues:
+        self.__lookahead = seq
+        break
+      batch.append(seq)
+    return batch
+
   def next(self):
-    seq = self.in_stream.next()
-    start = time.time()
-    r = self.blaster.blast(seq)
-    self.total_time += time.time() - start
-    return r
+    if self.batch_size == 1 and self.max_residues <= 0:
+      seq = self.in_stream.next()
+      start = time.time()
+      r = self.blaster.blast(seq)
+      self.total_time += time.time() - start
+      return r
+    if not self.__buffer:
+      batch = self.__next_batch()
+      start = time.time()
+      self.__buffer = self.blaster.blast_batch(batch)
+      self.__buffer.reverse()
+      self.total_time += time.time() - start
+    return self.__buffer.pop()
@@ -21,26 +21,71 @@
 import ncbi_toolkit
 
 
+# default (max_entries, max_residues) limits for pooled scopes
+DEFAULT_SCOPE_POOL = (1000, 50000000)
+
+
 class seq_factory_from_fasta(ncbi_toolkit.blast_sseq_loc_from_fasta):
+  """
+  Makes SSeqLoc objects from fasta strings. If scope_pool is a
+  (max_entries, max_residues) pair, such as DEFAULT_SCOPE_POOL, the
+  sequences share a pool of scopes (see set_scope_pool) rather than
+  getting a new scope each. If use_data_loaders is not None, it
+  overrides the module-wide default (see
+  ncbi_toolkit.set_default_data_loaders): with False, scopes only hold
+  the sequences made here and never look ids up over the network.
+  """
 
-  def __init__(self, strand) :
+  def __init__(self, strand, scope_pool=None, use_data_loaders=None) :
     ncbi_toolkit.blast_sseq_loc_from_fasta.__init__(self)
     self.strand   = strand
+    if use_data_loaders is not None:
+      self.use_data_loaders = use_data_loaders
+    if scope_pool:
+      self.set_scope_pool(*scope_pool)
 
   def make(self, fasta):
     return super(seq_factory_from_fasta, self).make(
       fasta, self.strand, 0, 0, False
       )
 
+  def make_many(self, records):
+    return super(seq_factory_from_fasta, self).make_many(
+      records, self.strand, 0, 0, False
+      )
+
+  def make_all(self, fasta):
+    return super(seq_factory_from_fasta, self).make_all(
+      fasta, self.strand, False
+      )
+
+  def iter_all(self, fasta):
+    return super(seq_factory_from_fasta, self).iter_all(
+      fasta, self.strand, False
+      )
+
 
 class seq_factory_from_str(ncbi_toolkit.blast_sseq_loc_from_str) :
+  """
+  Makes SSeqLoc objects from 'gi sequence' strings. scope_pool and
+  use_data_loaders are as in seq_factory_from_fasta.
+  """
 
-  def __init__(self, strand) :
+  def __init__(self, strand, scope_pool=None, use_data_loaders=None) :
     ncbi_toolkit.blast_sseq_loc_from_str.__init__(self)
     self.strand   = strand
+    if use_data_loaders is not None:
+      self.use_data_loaders = use_data_loaders
+    if scope_pool:
+      self.set_scope_pool(*scope_pool)
 
   def make(self, s):
     i, seq_data = s.split()[:2]
     return super(seq_factory_from_str, self).make(
       seq_data, False, int(i), 'fake title', self.strand, 0, 0
       )
+
+  def make_many(self, records):
+    return super(seq_factory_from_str, self).make_many(
+      records, False, 'fake title', self.strand
+      )
@@ -18,21 +18,34 @@
 # blast-python.  If not, see <http://www.gnu.org/licenses/>.
 # 
 # END_COPYRIGHT
+import itertools
 
 
 class blast_seq_stream(object):
 
-  def __init__(self, seq_factory, string_stream) :
+  def __init__(self, seq_factory, string_stream, batch_size=1) :
     """
     Creates a stream of seq objects obtained using seq_factory on the
-    the objects returned from string_stream
+    the objects returned from string_stream. With batch_size > 1,
+    objects are read batch_size at a time and converted with a single
+    seq_factory.make_many call.
     """
     self.seq_factory = seq_factory
     self.stream = string_stream
+    self.batch_size = batch_size
+    self.batch = []
 
   def __iter__(self) :
     return self
 
   def next(self):
-    obj = self.stream.next()
-    return self.seq_factory.make(obj)
+    if self.batch_size <= 1:
+      obj = self.stream.next()
+      return self.seq_factory.make(obj)
+    if not self.batch:
+      objs = list(itertools.islice(self.stream, self.batch_size))
+      if not objs:
+        raise StopIteration
+      self.batch = self.seq_factory.make_many(objs)
+      self.batch.reverse()
+    return self.batch.pop()
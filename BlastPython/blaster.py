@@ -19,15 +19,42 @@
 # 
 # END_COPYRIGHT
 import ncbi_toolkit
+import query_cache
+
+
+def get_options_state(blast_engine):
+    opts = blast_engine.GetOptions()
+    return tuple([(k, opts[k]) for k in sorted(opts.keys())])
 
 
 class blaster(object):
 
-    def __init__(self, query, **kw):
+    def __init__(self, query, cache=None, **kw):
+        """
+        Blast engine for query (an SSeqLoc or a list of SSeqLoc), with
+        blast options given as keywords. An engine whose query has
+        already been set up is taken from cache (a query_cache; None
+        means query_cache.default_query_cache, False disables caching),
+        and given back to it by close() with only the query set-up
+        retained.
+        """
         # program type must be passed to the constructor to ensure correct
         # default settings for all other options
         program = kw.pop('Program', ncbi_toolkit.EProgram.eBlastn)
+        self.blast_engine = None
         self.query = query
+        if cache is None:
+            cache = query_cache.default_query_cache
+        elif cache is False:
+            cache = None
+        self.cache = cache
+        if self.cache is not None:
+            self.cache_key = query_cache.query_key(query, program, kw)
+            cached = self.cache.checkout(self.cache_key)
+            if cached is not None:
+                self.blast_engine, self.__options_state = cached
+                self.query_already_setup = True
+                return
         self.blast_engine = ncbi_toolkit.CBl2Seq(
             ncbi_toolkit.SSeqLoc(),
             ncbi_toolkit.SSeqLoc(),
@@ -38,6 +65,27 @@ class blaster(object):
         opts = self.blast_engine.SetOptions()
         for k in kw:
             opts[k] = kw[k]
+        if self.cache is not None:
+            self.__options_state = get_options_state(self.blast_engine)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Release the engine, handing it over to the cache if its query
+        has been set up and its options have not been changed since
+        construction. Subjects and results are dropped first, so that
+        the cache only holds on to the query set-up.
+        """
+        engine, self.blast_engine = self.blast_engine, None
+        if (engine is None or self.cache is None or
+            not self.query_already_setup):
+            return
+        if get_options_state(engine) == self.__options_state:
+            engine.ResetSubjects()
+            self.cache.checkin(self.cache_key, (engine, self.__options_state),
+                               query_cache.engine_size(self.query))
 
     def get_options(self):
         return self.blast_engine.GetOptions()
@@ -54,3 +102,29 @@ class blaster(object):
         self.query_already_setup = True
         self.blast_engine.ScanDB()
         return subject, self.blast_engine.GetResults()
+
+    def blast_batch(self, subjects):
+        """
+        Blast on all subjects with a single multi-subject search, then
+        split the results by subject. Returns a list of (subject,
+        results) tuples, where results has the same layout as the one
+        returned by blast: one item per query, either None or a list
+        holding the HSP list for that subject. All results are valid
+        until the next search.
+        """
+        subjects = list(subjects)
+        _, results = self.blast(subjects)
+        split = [[None] * len(results) for _ in subjects]
+        for i, hit_list in results.iter_nonempty():
+            for hsp_list in hit_list:
+                split[hsp_list.ordinal_id_subject_sequence][i] = [hsp_list]
+        return zip(subjects, split)
+
+    def blast_many(self, subjects):
+        """
+        Blast on each subject from the given iterable, yielding
+        (subject, results) tuples. Each result is only valid until the
+        next one is requested.
+        """
+        for subject in subjects:
+            yield self.blast(subject)
@@ -0,0 +1,178 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+Many queries against many subjects as a blocked nested-loop join: one
+side (the outer one) is read in blocks that are held in memory while
+the other side is streamed past them in chunks, each (block, chunk)
+pair being run as a single multi-query, multi-subject search.
+"""
+
+import math
+
+from blaster import blaster
+from query_cache import ENGINE_BYTES_PER_RESIDUE
+
+
+QUERY_BYTES_PER_RESIDUE = ENGINE_BYTES_PER_RESIDUE
+SUBJECT_BYTES_PER_RESIDUE = 8
+# fraction of the memory budget given to the outer block
+OUTER_FRACTION = 0.75
+# fixed costs, in residues read: setting up a query (contexts, score
+# blocks), reading a subject (sequence source, per-subject set-up) and
+# running a search (engine set-up, result collection)
+QUERY_SETUP_RESIDUES = 256
+SUBJECT_SETUP_RESIDUES = 32
+SEARCH_SETUP_RESIDUES = 4096
+
+
+def get_source(side):
+  """
+  Return a function that gives a fresh iterator over the sequences of
+  side, which must be either a callable that does so or a sequence.
+  """
+  if callable(side):
+    return side
+  return lambda: iter(side)
+
+
+def get_stats(source):
+  """
+  Return (number of sequences, total residues) for source (scans it).
+  """
+  n = residues = 0
+  for s in source():
+    n += 1
+    residues += len(s)
+  return n, residues
+
+
+def plan_cross_search(query_stats, subject_stats, memory_budget):
+  """
+  Choose the outer side and block sizes, given (count, residues)
+  statistics for the queries and the subjects. Returns a dict with
+  keys 'outer' ('query' or 'subject'), 'outer_residues' and
+  'inner_residues' (block residue caps) and 'passes' (number of outer
+  blocks, i.e., of scans of the inner side).
+
+  The cost of a plan is the number of residues read plus, for query
+  chunks, set up, and fixed costs per query set up, per subject read
+  and per search, so that both the counts and the lengths of the
+  sequences matter. With queries outer each query block is set up once
+  and reused for all subject chunks, while all subjects are read again
+  for each block; with subjects outer, query chunks are set up again
+  for each subject block.
+  """
+  (n_q, res_q), (n_s, res_s) = query_stats, subject_stats
+  outer_budget = OUTER_FRACTION * memory_budget
+  inner_budget = memory_budget - outer_budget
+  plans = []
+  for outer, res_o, bpr_o, res_i, bpr_i in (
+    ('query', res_q, QUERY_BYTES_PER_RESIDUE,
+     res_s, SUBJECT_BYTES_PER_RESIDUE),
+    ('subject', res_s, SUBJECT_BYTES_PER_RESIDUE,
+     res_q, QUERY_BYTES_PER_RESIDUE),
+    ):
+    outer_residues = max(1, int(outer_budget / bpr_o))
+    inner_residues = max(1, int(inner_budget / bpr_i))
+    passes = max(1, int(math.ceil(float(res_o) / outer_residues)))
+    chunks = max(1, int(math.ceil(float(res_i) / inner_residues)))
+    if outer == 'query':
+      cost = (2 * res_q + n_q * QUERY_SETUP_RESIDUES +
+              passes * (res_s + n_s * SUBJECT_SETUP_RESIDUES))
+    else:
+      cost = (res_s + n_s * SUBJECT_SETUP_RESIDUES +
+              passes * (2 * res_q + n_q * QUERY_SETUP_RESIDUES))
+    cost += passes * chunks * SEARCH_SETUP_RESIDUES
+    plans.append((cost, {
+      'outer': outer,
+      'outer_residues': min(outer_residues, max(res_o, 1)),
+      'inner_residues': min(inner_residues, max(res_i, 1)),
+      'passes': passes,
+      }))
+  # on ties, prefer queries outer (listed first)
+  plans.sort(key=lambda p: p[0])
+  return plans[0][1]
+
+
+def get_blocks(seqs, max_residues):
+  """
+  Group seqs into lists of at most max_residues total length (a longer
+  sequence gets a block of its own).
+  """
+  block, residues = [], 0
+  for s in seqs:
+    if block and residues + len(s) > max_residues:
+      yield block
+      block, residues = [], 0
+    block.append(s)
+    residues += len(s)
+  if block:
+    yield block
+
+
+def split_results(queries, subjects, results):
+  for _, hit_list in results.iter_nonempty():
+    for hsp_list in hit_list:
+      yield (queries[hsp_list.query_index],
+             subjects[hsp_list.ordinal_id_subject_sequence],
+             hsp_list)
+
+
+def cross_search(queries, subjects, memory_budget=512*1024*1024,
+                 query_stats=None, subject_stats=None, **kw):
+  """
+  Blast all queries against all subjects, yielding a (query, subject,
+  hsp_list) tuple for each pair with hits. Each of queries and subjects
+  is either a sequence of SSeqLoc or a callable returning a fresh
+  iterator over them (e.g., a blast_seq_stream over a file), so that
+  the inner side can be streamed again for each outer block. Blast
+  options are given as keywords, as for blaster.
+
+  memory_budget is the approximate number of bytes to use for
+  sequences and query setup. Sequence statistics are computed with an
+  extra scan of each side unless given as (count, residues) tuples.
+
+  hsp_list objects are only valid until the next tuple is requested.
+  """
+  queries, subjects = get_source(queries), get_source(subjects)
+  if query_stats is None:
+    query_stats = get_stats(queries)
+  if subject_stats is None:
+    subject_stats = get_stats(subjects)
+  plan = plan_cross_search(query_stats, subject_stats, memory_budget)
+  outer_res, inner_res = plan['outer_residues'], plan['inner_residues']
+  if plan['outer'] == 'query':
+    for q_block in get_blocks(queries(), outer_res):
+      b = blaster(q_block, cache=False, **kw)
+      for s_block in get_blocks(subjects(), inner_res):
+        _, results = b.blast(s_block)
+        for t in split_results(q_block, s_block, results):
+          yield t
+      b.close()
+  else:
+    for s_block in get_blocks(subjects(), outer_res):
+      for q_block in get_blocks(queries(), inner_res):
+        b = blaster(q_block, cache=False, **kw)
+        _, results = b.blast(s_block)
+        for t in split_results(q_block, s_block, results):
+          yield t
+        b.close()
@@ -0,0 +1,55 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+Flat, picklable HSP records.
+"""
+
+HSP_FIELDS = (
+  "query_index", "subject_oid", "score", "bit_score", "evalue", "num_ident",
+  "query_frame", "query_offset", "query_end", "query_gapped_start",
+  "subject_frame", "subject_offset", "subject_end", "subject_gapped_start",
+  "context", "align_len", "mismatches", "gap_opens", "pident",
+  )
+
+
+def hsp_records(results):
+  """
+  Copy engine results (as returned by CBl2Seq.GetResults) to a list of
+  tuples with one item per field in HSP_FIELDS. Unlike the engine
+  results, the records stay valid after the next search.
+
+  For large result sets, CBl2Seq.GetResultsArrays builds the same
+  records, as a numpy structured array, without going through the
+  per-HSP wrappers.
+  """
+  records = []
+  for hit_list in results:
+    if hit_list is None:
+      continue
+    for hsp_list in hit_list:
+      head = (hsp_list.query_index, hsp_list.ordinal_id_subject_sequence)
+      for hsp in hsp_list:
+        records.append(head + (hsp.score, hsp.bit_score, hsp.evalue,
+                               hsp.num_ident) +
+                       hsp.query + hsp.subject + (hsp.context,) +
+                       hsp.alignment_stats)
+  return records
@@ -0,0 +1,128 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+Overlap, containment and coverage queries over the HSPs of a result
+stream.
+"""
+
+import ncbi_toolkit
+from match_endpoints import get_lengths
+from seq_info import get_subject_id
+
+
+class interval_index(object):
+
+  def __init__(self, queries, program=ncbi_toolkit.EProgram.eBlastn,
+               side='query', get_metadata=get_subject_id):
+    """
+    Indexes the query (side='query') or subject (side='subject') ranges
+    of the HSPs in (subject, results) tuples, such as the ones yielded
+    by blast_result_stream, for searches of queries (the SSeqLoc
+    objects the blaster was set up with, or their lengths).
+
+    Ranges are 1-based and inclusive, on the plus strand of the
+    original sequences, and are looked up by key: the query index for
+    side='query', the position of the subject in the sequence of add()
+    calls for side='subject'. The index itself is native: lookups
+    (coverage included) take O((k + 1) log n) for n HSPs of a key and
+    k matches, and cull(), which makes one containment lookup per HSP,
+    is quadratic in the worst case of deeply nested HSPs. It allows
+    the CullingLimit rule of the engine to be applied to the hits
+    against a whole stream of subjects rather than per search.
+    """
+    self.index = ncbi_toolkit.hsp_interval_index(program, side)
+    self.query_lengths = get_lengths(queries)
+    self.get_metadata = get_metadata
+    self.metadata = []
+
+  def add(self, subject, results):
+    """
+    Add the results of the search on subject. Only results for a
+    single subject are supported.
+    """
+    self.index.add(results, self.query_lengths, get_lengths(subject),
+                   len(self.metadata))
+    self.metadata.append(self.get_metadata(subject))
+
+  def consume(self, stream):
+    """
+    Add all (subject, results) tuples from stream.
+    """
+    for subject, results in stream:
+      self.add(subject, results)
+    return self
+
+  def __len__(self):
+    return len(self.index)
+
+  def overlapping(self, key, start, end):
+    """
+    Numbers of the HSPs whose range overlaps [start, end].
+    """
+    return self.index.overlapping(key, start, end)
+
+  def within(self, key, start, end):
+    """
+    Numbers of the HSPs whose range lies within [start, end].
+    """
+    return self.index.within(key, start, end)
+
+  def containing(self, key, start, end):
+    """
+    Numbers of the HSPs whose range contains [start, end].
+    """
+    return self.index.containing(key, start, end)
+
+  def coverage(self, key, start=None, end=None):
+    """
+    Number of positions of [start, end] (by default, of the whole
+    sequence) covered by at least one HSP.
+    """
+    if start is None and end is None:
+      return self.index.coverage(key)
+    if start is None:
+      start = 1
+    if end is None:
+      end = 0x7fffffff
+    return self.index.coverage(key, start, end)
+
+  def cull(self, limit):
+    """
+    Numbers of the HSPs kept by the CullingLimit rule: an HSP is
+    dropped if its range is contained in the ranges of at least limit
+    kept HSPs with a higher score.
+    """
+    return self.index.cull(limit)
+
+  def get_interval(self, i):
+    """
+    The (key, start, end) range of HSP number i.
+    """
+    return self.index.get_interval(i)
+
+  def as_array(self):
+    """
+    All HSPs, in the order they were added, as a numpy structured
+    array. Its subject_oid field holds the position of the subject in
+    the sequence of add() calls.
+    """
+    return self.index.as_array()
@@ -0,0 +1,77 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+Cheap prefilter that drops subjects which cannot produce a blastn hit
+with the query, before they reach the blast engine.
+"""
+
+import ncbi_toolkit
+
+
+PREFILTER_PROGRAMS = (ncbi_toolkit.EProgram.eBlastn,
+                      ncbi_toolkit.EProgram.eMegablast)
+
+
+class kmer_prefilter(object):
+
+  def __init__(self, blaster, seq_stream, k=None):
+    """
+    Creates a stream of the subjects from seq_stream that share at
+    least one k-mer (on either strand) with blaster's query. k defaults
+    to (and must not exceed) the blaster's WordSize, so that every
+    subject that can seed an alignment is kept; it is capped to 32.
+    The numbers of subjects let through and dropped so far are
+    available as .passed and .skipped.
+
+    Only blastn and megablast are supported (other programs do not
+    seed on exact nucleotide words). Ambiguous bases never match, so
+    hits seeded on them (ambiguities are replaced by random bases in
+    the packed subject) can be lost.
+    """
+    opts = blaster.get_options()
+    if opts['Program'] not in PREFILTER_PROGRAMS:
+      raise ValueError("k-mer prefiltering is only supported for blastn")
+    word_size = opts['WordSize']
+    if k is None:
+      k = word_size
+    if not 0 < k <= word_size:
+      raise ValueError("k must be in [1, WordSize]")
+    self.filter = ncbi_toolkit.kmer_filter(min(k, 32))
+    queries = blaster.query
+    if not isinstance(queries, list):
+      queries = [queries]
+    for q in queries:
+      self.filter.add(q.get_sequence(), True)
+    self.in_stream = seq_stream
+    self.passed = 0
+    self.skipped = 0
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    while True:
+      seq = self.in_stream.next()
+      if self.filter.shares_word(seq.get_sequence()):
+        self.passed += 1
+        return seq
+      self.skipped += 1
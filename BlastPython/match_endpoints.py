@@ -0,0 +1,51 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+1-based alignment endpoints for whole result sets.
+"""
+
+import ncbi_toolkit
+
+
+def get_lengths(seqs):
+  if hasattr(seqs, "length"):
+    return [seqs.length]
+  return [getattr(s, "length", s) for s in seqs]
+
+
+def match_endpoints(hsps, program, queries, subjects):
+  """
+  Convert the coordinates of all HSPs in hsps (the results of a
+  search, a snapshot of them or an array returned by
+  CBl2Seq.GetResultsArrays) to 1-based (query_start, query_end,
+  subject_start, subject_end) endpoints on the original sequences, as
+  reported by the blast command line tools. All EProgram values are
+  supported: coordinates on translated sequences are mapped back to
+  nucleotides, and minus strand matches have start > end.
+
+  queries and subjects are the SSeqLoc objects (or just their lengths)
+  the search was run with, either single items or lists. The
+  conversion runs in C++ and returns a numpy structured array with one
+  record per HSP, in the same order as the HSPs in hsps.
+  """
+  return ncbi_toolkit.match_endpoints(hsps, program, get_lengths(queries),
+                                      get_lengths(subjects))
@@ -0,0 +1,126 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+A blaster that spreads subjects over a pool of engines run by worker
+threads. CBl2Seq releases the GIL while searching, so the engines
+actually run in parallel.
+"""
+
+import sys, threading, Queue
+
+from blaster import blaster
+
+
+class parallel_blaster(object):
+
+    def __init__(self, query, workers=2, **kw):
+        """
+        Keeps WORKERS blaster instances for QUERY, all built with the
+        same options. Each engine sets up the query (lookup table
+        included) on its first search and reuses it afterwards.
+        """
+        if workers < 1:
+            raise ValueError("workers must be a positive integer")
+        self.query = query
+        self.workers = workers
+        self.blasters = [blaster(query, **kw) for _ in xrange(workers)]
+        self.__free = Queue.Queue()
+        for b in self.blasters:
+            self.__free.put(b)
+
+    def get_options(self):
+        return self.blasters[0].get_options()
+
+    def blast(self, subject):
+        """
+        Blast on subject and return results, using the first free
+        engine. As with blaster, do not hold on to the results: the
+        engine that produced them will be reused.
+        """
+        b = self.__free.get()
+        try:
+            return b.blast(subject)
+        finally:
+            self.__free.put(b)
+
+    def blast_many(self, subjects):
+        """
+        Blast on each subject from the given iterable, yielding
+        (subject, results) tuples in input order. Up to self.workers
+        subjects are searched concurrently; each result is only valid
+        until the next one is requested (its engine is then put back to
+        work).
+        """
+        subjects = iter(subjects)
+        tasks, done = Queue.Queue(), Queue.Queue()
+        threads = [threading.Thread(target=self.__work, args=(tasks, done))
+                   for _ in xrange(self.workers)]
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+        pending = {}
+        n_in = n_out = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and n_in - n_out < self.workers:
+                    try:
+                        s = subjects.next()
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        tasks.put((n_in, s))
+                        n_in += 1
+                if n_out == n_in:
+                    break
+                while n_out not in pending:
+                    i, b, r, exc_info = done.get()
+                    pending[i] = (b, r, exc_info)
+                b, r, exc_info = pending.pop(n_out)
+                n_out += 1
+                try:
+                    if exc_info is not None:
+                        raise exc_info[0], exc_info[1], exc_info[2]
+                    yield r
+                finally:
+                    self.__free.put(b)
+        finally:
+            for t in threads:
+                tasks.put(None)
+            for _ in xrange(n_in - n_out - len(pending)):
+                self.__free.put(done.get()[1])
+            for b, _, _ in pending.itervalues():
+                self.__free.put(b)
+
+    def __work(self, tasks, done):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            i, subject = task
+            b = self.__free.get()
+            try:
+                r = b.blast(subject)
+            except Exception:
+                done.put((i, b, None, sys.exc_info()))
+            else:
+                done.put((i, b, r, None))
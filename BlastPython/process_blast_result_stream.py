@@ -0,0 +1,265 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+Multi-process variant of blast_result_stream.
+
+Worker processes build their own blaster from a picklable query_spec
+(nothing from the NCBI object manager crosses a process boundary).
+Subject FASTA strings are handed over in batches through shared memory
+slots, and results come back as compact records (see hsp_records).
+"""
+
+import ctypes, traceback, weakref, Queue
+import multiprocessing as mp
+
+import ncbi_toolkit
+from blaster import blaster
+from blast_seq_factory import seq_factory_from_fasta
+from hsp_records import hsp_records
+
+
+# seconds between checks that the workers are still alive
+POLL_INTERVAL = 1.0
+
+
+def _enum_to_state(v):
+  t = type(v)
+  if hasattr(t, 'values') and getattr(ncbi_toolkit, t.__name__, None) is t:
+    return ('__enum__', t.__name__, int(v))
+  return v
+
+
+def _enum_from_state(v):
+  if type(v) is tuple and len(v) == 3 and v[0] == '__enum__':
+    return getattr(ncbi_toolkit, v[1]).values[v[2]]
+  return v
+
+
+class query_spec(object):
+  """
+  Picklable description of a blaster: FASTA query string (or list of
+  FASTA strings for a multi-query search), strand and blast options.
+  """
+  def __init__(self, fasta, strand=ncbi_toolkit.strand.both, **kw):
+    self.fasta = fasta
+    self.strand = strand
+    self.options = kw
+
+  def __getstate__(self):
+    return {
+      'fasta': self.fasta,
+      'strand': _enum_to_state(self.strand),
+      'options': dict((k, _enum_to_state(v))
+                      for k, v in self.options.iteritems()),
+      }
+
+  def __setstate__(self, state):
+    self.fasta = state['fasta']
+    self.strand = _enum_from_state(state['strand'])
+    self.options = dict((k, _enum_from_state(v))
+                        for k, v in state['options'].iteritems())
+
+  def make_blaster(self):
+    factory = seq_factory_from_fasta(self.strand)
+    if isinstance(self.fasta, basestring):
+      query = factory.make(self.fasta)
+    else:
+      query = [factory.make(f) for f in self.fasta]
+    return blaster(query, **self.options)
+
+
+def _blast_worker(spec, slots, tasks, free_slots, results):
+  try:
+    b = spec.make_blaster()
+    factory = seq_factory_from_fasta(spec.strand)
+  except Exception:
+    results.put((None, False, traceback.format_exc()))
+    return
+  while True:
+    task = tasks.get()
+    if task is None:
+      return
+    batch_no, slot, payload = task
+    try:
+      if slot is None:
+        fastas = payload
+      else:
+        try:
+          data = ctypes.string_at(ctypes.addressof(slots[slot]), sum(payload))
+        finally:
+          free_slots.put(slot)
+        fastas, offset = [], 0
+        for l in payload:
+          fastas.append(data[offset:offset+l])
+          offset += l
+      out = []
+      for f in fastas:
+        subject, r = b.blast(factory.make(f))
+        out.append((subject.id, hsp_records(r)))
+    except Exception:
+      results.put((batch_no, False, traceback.format_exc()))
+    else:
+      results.put((batch_no, True, out))
+
+
+class process_blast_result_stream(object):
+
+  def __init__(self, spec, fasta_stream, workers=2, batch_size=64,
+               slot_size=4*1024*1024):
+    """
+    Creates a stream of (subject_id, records) tuples, in the order of
+    the FASTA strings returned by fasta_stream, where records is the
+    list of hsp_records of the blast of spec's query against the
+    subject. Subjects are sent to the WORKERS processes in batches of
+    at most BATCH_SIZE sequences and SLOT_SIZE bytes (a single sequence
+    larger than SLOT_SIZE is pickled instead).
+    """
+    self.spec = spec
+    self.in_stream = fasta_stream
+    self.batch_size = max(1, batch_size)
+    self.slot_size = slot_size
+    self.slots = [mp.RawArray(ctypes.c_char, slot_size)
+                  for _ in xrange(2*workers)]
+    self.free_slots = mp.Queue()
+    for i in xrange(len(self.slots)):
+      self.free_slots.put(i)
+    self.tasks = mp.Queue()
+    self.results = mp.Queue()
+    self.processes = [
+      mp.Process(target=_blast_worker, args=(
+        spec, self.slots, self.tasks, self.free_slots, self.results
+        ))
+      for _ in xrange(workers)
+      ]
+    for p in self.processes:
+      p.daemon = True
+      p.start()
+    self.__lookahead = None
+    # the generator only holds a proxy, so that a stream dropped before
+    # its end is collected (and its workers stopped) right away
+    self.__out = type(self).__run(weakref.proxy(self))
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    return self.__out.next()
+
+  def __del__(self):
+    if getattr(self, 'processes', None):
+      self.close(terminate=True)
+
+  def close(self, terminate=False):
+    """
+    Stop the worker processes (done automatically at end of stream,
+    and with terminate=True on errors or when the stream is discarded
+    before its end). Results that are still queued are discarded, so
+    that no worker is left blocked on sending them.
+    """
+    for p in self.processes:
+      if terminate:
+        p.terminate()
+      elif p.is_alive():
+        self.tasks.put(None)
+    for p in self.processes:
+      while p.is_alive():
+        self.__drain(self.results)
+        p.join(POLL_INTERVAL)
+    self.__drain(self.results)
+    self.processes = []
+
+  def __drain(self, queue):
+    try:
+      while True:
+        queue.get_nowait()
+    except Queue.Empty:
+      pass
+
+  def __get(self, queue):
+    """
+    Get an item from queue, raising RuntimeError if a worker dies in
+    the meantime (e.g., killed by a signal).
+    """
+    while True:
+      try:
+        return queue.get(timeout=POLL_INTERVAL)
+      except Queue.Empty:
+        pass
+      dead = [p for p in self.processes if not p.is_alive()]
+      if dead:
+        try:
+          return queue.get_nowait()
+        except Queue.Empty:
+          pass
+        self.close(terminate=True)
+        raise RuntimeError("blast worker %d died (exit code %s)" %
+                           (dead[0].pid, dead[0].exitcode))
+
+  def __next_batch(self):
+    batch, size = [], 0
+    while len(batch) < self.batch_size:
+      if self.__lookahead is not None:
+        f, self.__lookahead = self.__lookahead, None
+      else:
+        try:
+          f = self.in_stream.next()
+        except StopIteration:
+          break
+      if batch and size + len(f) > self.slot_size:
+        self.__lookahead = f
+        break
+      batch.append(f)
+      size += len(f)
+    return batch, size
+
+  def __submit(self, batch_no, batch, size):
+    if size > self.slot_size:
+      self.tasks.put((batch_no, None, batch))
+    else:
+      slot = self.__get(self.free_slots)
+      ctypes.memmove(self.slots[slot], ''.join(batch), size)
+      self.tasks.put((batch_no, slot, [len(f) for f in batch]))
+
+  def __run(self):
+    pending = {}
+    n_in = n_out = 0
+    exhausted = False
+    while True:
+      while not exhausted and n_in - n_out < len(self.slots):
+        batch, size = self.__next_batch()
+        if not batch:
+          exhausted = True
+        else:
+          self.__submit(n_in, batch, size)
+          n_in += 1
+      if n_out == n_in:
+        break
+      while n_out not in pending:
+        batch_no, ok, payload = self.__get(self.results)
+        if not ok:
+          self.close(terminate=True)
+          raise RuntimeError("blast worker failed:\n%s" % payload)
+        pending[batch_no] = payload
+      for r in pending.pop(n_out):
+        yield r
+      n_out += 1
+    self.close()
@@ -0,0 +1,134 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+Cache of CBl2Seq engines whose query has already been set up (lookup
+table included), so that building a blaster for a query that was seen
+before does not pay for the setup again. Blasters use
+default_query_cache unless they are given another cache, or
+cache=False.
+"""
+
+import threading, hashlib
+from collections import OrderedDict
+
+
+# rough memory footprint of a set up query: fixed part (lookup table
+# backbone, score blocks) plus a per-residue part
+ENGINE_BASE_BYTES = 1024 * 1024
+ENGINE_BYTES_PER_RESIDUE = 64
+
+
+def query_key(query, program, options):
+    """
+    Cache key for a blaster built on query (an SSeqLoc or a list of
+    SSeqLoc) with the given program and option overrides. Queries are
+    identified by id, strand, length, masking and a hash of their
+    sequence.
+    """
+    queries = query if isinstance(query, list) else [query]
+    h = hashlib.sha1()
+    for q in queries:
+        h.update("%s\0%d\0%d\0%d\0" % (q.id, int(q.strand), len(q),
+                                        q.is_masked))
+        h.update(q.get_sequence())
+    return (h.hexdigest(), int(program), tuple(sorted(options.iteritems())))
+
+
+def engine_size(query):
+    queries = query if isinstance(query, list) else [query]
+    return ENGINE_BASE_BYTES + ENGINE_BYTES_PER_RESIDUE * sum(
+        [len(q) for q in queries]
+        )
+
+
+class query_cache(object):
+
+    def __init__(self, max_entries=64, max_bytes=256*1024*1024):
+        """
+        LRU cache holding at most max_entries engines with a total
+        estimated size of at most max_bytes. Several engines can be
+        cached under the same key: each one is handed out to a single
+        blaster at a time.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__lru = OrderedDict()  # serial -> (key, item, size)
+        self.__by_key = {}          # key -> [serial, ...]
+        self.__serial = 0
+
+    def __len__(self):
+        return len(self.__lru)
+
+    def checkout(self, key):
+        """
+        Remove and return an item cached under key, or None.
+        """
+        with self.__lock:
+            serials = self.__by_key.get(key)
+            if not serials:
+                self.misses += 1
+                return None
+            serial = serials.pop()
+            if not serials:
+                del self.__by_key[key]
+            _, item, size = self.__lru.pop(serial)
+            self.size -= size
+            self.hits += 1
+            return item
+
+    def checkin(self, key, item, size):
+        """
+        Cache item under key, evicting least recently used items as
+        needed to stay within the limits.
+        """
+        if size > self.max_bytes or self.max_entries < 1:
+            return
+        with self.__lock:
+            serial = self.__serial
+            self.__serial += 1
+            self.__lru[serial] = (key, item, size)
+            self.__by_key.setdefault(key, []).append(serial)
+            self.size += size
+            while (len(self.__lru) > self.max_entries or
+                   self.size > self.max_bytes):
+                self.__evict()
+
+    def clear(self):
+        with self.__lock:
+            while self.__lru:
+                self.__evict()
+
+    def __evict(self):
+        serial, (key, _, size) = self.__lru.popitem(last=False)
+        serials = self.__by_key[key]
+        serials.remove(serial)
+        if not serials:
+            del self.__by_key[key]
+        self.size -= size
+
+
+# process-wide cache, used by blasters unless told otherwise
+default_query_cache = query_cache()
@@ -0,0 +1,319 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+Chunked, column-oriented binary files of HSP records.
+
+A file starts with a header listing its columns (name and numpy
+dtype), followed by any number of chunks. Each chunk holds n rows as
+one fixed-width array per column, then a table of the strings (query
+and subject ids) referenced by the query_id and subject_id columns,
+and ends with a trailer. A chunk without a valid trailer (e.g., left
+by an interrupted run) is ignored by readers and overwritten when the
+file is opened for appending.
+
+Readers memory-map the file and return numpy views on it, so nothing
+is parsed or copied. This module requires numpy.
+"""
+
+import os, struct, mmap
+import numpy
+
+import ncbi_toolkit
+
+
+FILE_MAGIC = 'BPRES001'
+FILE_HEADER = struct.Struct('<8sI4x')     # magic, number of columns
+COLUMN_DESC = struct.Struct('<24s8s')     # column name, dtype string
+CHUNK_MAGIC = 'CHNK'
+CHUNK_HEADER = struct.Struct('<4sIII')    # magic, rows, strings, string bytes
+CHUNK_TRAILER_MAGIC = 'DONE'
+CHUNK_TRAILER = struct.Struct('<4s4xQ')   # magic, chunk size
+
+ID_FIELDS = ('query_id', 'subject_id')
+OFFSET_DTYPE = numpy.dtype('<u4')
+
+
+def padded(size):
+  return (size + 7) & ~7
+
+
+def get_columns(rows_dtype):
+  columns = [(name, rows_dtype.fields[name][0].newbyteorder('<'))
+             for name in rows_dtype.names]
+  columns.extend([(name, numpy.dtype('<i4')) for name in ID_FIELDS])
+  return columns
+
+
+def get_ids(seqs):
+  if hasattr(seqs, 'length'):
+    seqs = [seqs]
+  return [s.id for s in seqs]
+
+
+def chunk_size(columns, n_rows, n_strings, strings_size):
+  size = CHUNK_HEADER.size
+  for _, dtype in columns:
+    size += padded(n_rows * dtype.itemsize)
+  size += padded((n_strings + 1) * OFFSET_DTYPE.itemsize)
+  size += padded(strings_size)
+  return size
+
+
+def read_header(fp):
+  """
+  Read the file header, returning the list of (name, dtype) columns.
+  """
+  data = fp.read(FILE_HEADER.size)
+  if len(data) < FILE_HEADER.size:
+    raise ValueError('not a results file: too short')
+  magic, n_columns = FILE_HEADER.unpack(data)
+  if magic != FILE_MAGIC:
+    raise ValueError('not a results file: bad magic %r' % magic)
+  columns = []
+  for _ in xrange(n_columns):
+    data = fp.read(COLUMN_DESC.size)
+    if len(data) < COLUMN_DESC.size:
+      raise ValueError('not a results file: truncated column table')
+    name, dtype = COLUMN_DESC.unpack(data)
+    columns.append((name.rstrip('\0'), numpy.dtype(dtype.rstrip('\0'))))
+  return columns
+
+
+def header_size(columns):
+  return padded(FILE_HEADER.size + len(columns) * COLUMN_DESC.size)
+
+
+def scan_chunks(buf, columns, start, size):
+  """
+  Yield (offset, n_rows, n_strings, strings_size) for each complete
+  chunk in buf[start:size].
+  """
+  pos = start
+  while pos + CHUNK_HEADER.size <= size:
+    magic, n_rows, n_strings, strings_size = CHUNK_HEADER.unpack_from(buf, pos)
+    if magic != CHUNK_MAGIC:
+      break
+    end = pos + chunk_size(columns, n_rows, n_strings, strings_size)
+    if end + CHUNK_TRAILER.size > size:
+      break
+    magic, stored_size = CHUNK_TRAILER.unpack_from(buf, end)
+    if magic != CHUNK_TRAILER_MAGIC or stored_size != end - pos:
+      break
+    yield pos, n_rows, n_strings, strings_size
+    pos = end + CHUNK_TRAILER.size
+
+
+class results_writer(object):
+
+  def __init__(self, path, chunk_rows=1<<16):
+    """
+    Writes HSP records to the results file at path, appending to it if
+    it already exists. Records are kept in memory and written as a
+    chunk every chunk_rows records, and by flush() and close().
+    """
+    self.columns = get_columns(ncbi_toolkit.results_array([]).dtype)
+    self.chunk_rows = chunk_rows
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+      self.fp = open(path, 'r+b')
+      self.__open_for_append()
+    else:
+      self.fp = open(path, 'w+b')
+      self.__write_header()
+    self.__reset()
+
+  def __write_header(self):
+    self.fp.write(FILE_HEADER.pack(FILE_MAGIC, len(self.columns)))
+    for name, dtype in self.columns:
+      self.fp.write(COLUMN_DESC.pack(name, dtype.str))
+    self.fp.write('\0' * (header_size(self.columns) - self.fp.tell()))
+
+  def __open_for_append(self):
+    columns = read_header(self.fp)
+    if columns != self.columns:
+      raise ValueError('%s has different columns' % self.fp.name)
+    size = os.fstat(self.fp.fileno()).st_size
+    buf = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      end = header_size(columns)
+      for pos, n_rows, n_strings, strings_size in scan_chunks(
+        buf, columns, end, size
+        ):
+        end = (pos + chunk_size(columns, n_rows, n_strings, strings_size) +
+               CHUNK_TRAILER.size)
+    finally:
+      buf.close()
+    self.fp.truncate(end)
+    self.fp.seek(end)
+
+  def __reset(self):
+    self.pending = []
+    self.n_pending = 0
+    self.strings = {}
+
+  def __string_ids(self, ids):
+    return numpy.array([self.strings.setdefault(i, len(self.strings))
+                        for i in ids], dtype=numpy.int32)
+
+  def write(self, queries, subjects, results):
+    """
+    Add the results of the search of queries against subjects (the
+    SSeqLoc objects, single items or lists, the search was run with).
+    """
+    rows = ncbi_toolkit.results_array(results)
+    if len(rows) == 0:
+      return
+    q_ids = self.__string_ids(get_ids(queries))
+    s_ids = self.__string_ids(get_ids(subjects))
+    # with a single subject, results may come from a batch (see
+    # blaster.blast_batch) and carry its oid within the batch
+    q_index = 0 if len(q_ids) == 1 else rows['query_index']
+    s_index = 0 if len(s_ids) == 1 else rows['subject_oid']
+    ids = (q_ids[q_index] + numpy.zeros(len(rows), numpy.int32),
+           s_ids[s_index] + numpy.zeros(len(rows), numpy.int32))
+    self.pending.append((rows, ids))
+    self.n_pending += len(rows)
+    if self.n_pending >= self.chunk_rows:
+      self.flush()
+
+  def consume(self, queries, stream):
+    """
+    Add all (subject, results) tuples from stream, e.g., a
+    blast_result_stream for a blaster on queries.
+    """
+    for subject, results in stream:
+      self.write(queries, subject, results)
+    self.flush()
+
+  def flush(self):
+    """
+    Write the pending records as a new chunk.
+    """
+    if not self.n_pending:
+      return
+    strings = [None] * len(self.strings)
+    for s, i in self.strings.iteritems():
+      strings[i] = s
+    offsets = numpy.zeros(len(strings) + 1, OFFSET_DTYPE)
+    offsets[1:] = numpy.cumsum([len(s) for s in strings])
+    blob = ''.join(strings)
+    start = self.fp.tell()
+    self.fp.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self.n_pending,
+                                    len(strings), len(blob)))
+    for name, dtype in self.columns:
+      if name in ID_FIELDS:
+        k = ID_FIELDS.index(name)
+        parts = [ids[k] for _, ids in self.pending]
+      else:
+        parts = [rows[name] for rows, _ in self.pending]
+      self.__write_padded(numpy.concatenate(parts).astype(dtype).tostring())
+    self.__write_padded(offsets.tostring())
+    self.__write_padded(blob)
+    self.fp.write(CHUNK_TRAILER.pack(CHUNK_TRAILER_MAGIC,
+                                     self.fp.tell() - start))
+    self.fp.flush()
+    self.__reset()
+
+  def __write_padded(self, data):
+    self.fp.write(data)
+    self.fp.write('\0' * (padded(len(data)) - len(data)))
+
+  def close(self):
+    if self.fp is not None:
+      self.flush()
+      self.fp.close()
+      self.fp = None
+
+
+class results_chunk(object):
+
+  def __init__(self, buf, columns, pos, n_rows, n_strings, strings_size):
+    self.n_rows = n_rows
+    self.arrays = {}
+    pos += CHUNK_HEADER.size
+    for name, dtype in columns:
+      self.arrays[name] = numpy.frombuffer(buf, dtype, n_rows, pos)
+      pos += padded(n_rows * dtype.itemsize)
+    self.offsets = numpy.frombuffer(buf, OFFSET_DTYPE, n_strings + 1, pos)
+    pos += padded(self.offsets.nbytes)
+    self.blob = buf[pos:pos + strings_size]
+    self.__strings = None
+
+  def __len__(self):
+    return self.n_rows
+
+  def __getitem__(self, name):
+    """
+    The given column, as a numpy view on the file.
+    """
+    return self.arrays[name]
+
+  @property
+  def strings(self):
+    """
+    The chunk's string table: query_id and subject_id index into it.
+    """
+    if self.__strings is None:
+      o = self.offsets.tolist()
+      self.__strings = [self.blob[o[i]:o[i+1]] for i in xrange(len(o) - 1)]
+    return self.__strings
+
+
+class results_reader(object):
+
+  def __init__(self, path):
+    """
+    Memory-maps the results file at path. The reader is a sequence of
+    results_chunk objects; column(name) concatenates a column over all
+    chunks. Incomplete trailing chunks are ignored. The views returned
+    by the chunks must not be used after close().
+    """
+    self.fp = open(path, 'rb')
+    self.columns = read_header(self.fp)
+    size = os.fstat(self.fp.fileno()).st_size
+    self.buf = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+    self.chunks = [results_chunk(self.buf, self.columns, *c)
+                   for c in scan_chunks(self.buf, self.columns,
+                                        header_size(self.columns), size)]
+
+  def __len__(self):
+    return len(self.chunks)
+
+  def __getitem__(self, i):
+    return self.chunks[i]
+
+  def __iter__(self):
+    return iter(self.chunks)
+
+  @property
+  def n_rows(self):
+    return sum([len(c) for c in self.chunks])
+
+  def column(self, name):
+    dtype = dict(self.columns)[name]
+    if not self.chunks:
+      return numpy.zeros(0, dtype)
+    return numpy.concatenate([c[name] for c in self.chunks])
+
+  def close(self):
+    self.chunks = []
+    self.buf.close()
+    self.fp.close()
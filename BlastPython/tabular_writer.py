@@ -0,0 +1,84 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+Blast tabular output (outfmt 6 and 7), formatted in native code.
+"""
+
+import ncbi_toolkit
+
+
+DEFAULT_COLUMNS = ('qseqid', 'sseqid', 'pident', 'length', 'mismatch',
+                   'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue',
+                   'bitscore')
+
+
+def get_seq_info(seqs):
+  if hasattr(seqs, 'length'):
+    seqs = [seqs]
+  return [s.id for s in seqs], [s.length for s in seqs]
+
+
+class tabular_writer(object):
+
+  def __init__(self, fp, columns=DEFAULT_COLUMNS,
+               program=ncbi_toolkit.EProgram.eBlastn, comments=False,
+               buffer_size=1<<20):
+    """
+    Writes HSPs to fp in blast tabular format, with the given columns
+    (any of qseqid, sseqid, pident, length, mismatch, gapopen, gaps,
+    qstart, qend, sstart, send, evalue, bitscore, score, nident, qlen,
+    slen, qframe, sframe). With comments=True, each query is introduced
+    by the comment lines of outfmt 7. Rows are formatted in C++ and
+    written in chunks of about buffer_size bytes; call close() (or
+    flush()) when done.
+    """
+    self.fp = fp
+    self.formatter = ncbi_toolkit.tabular_formatter(list(columns), program,
+                                                    comments)
+    self.buffer_size = buffer_size
+    self.__queries = self.__query_info = None
+
+  def write(self, queries, subjects, results):
+    """
+    Write the results of the search of queries against subjects (the
+    SSeqLoc objects, single items or lists, the search was run with).
+    """
+    if queries is not self.__queries:
+      self.__queries, self.__query_info = queries, get_seq_info(queries)
+    self.formatter.add(results, *(self.__query_info + get_seq_info(subjects)))
+    if self.formatter.buffered >= self.buffer_size:
+      self.flush()
+
+  def consume(self, queries, stream):
+    """
+    Write all (subject, results) tuples from stream, e.g., a
+    blast_result_stream for a blaster on queries.
+    """
+    for subject, results in stream:
+      self.write(queries, subject, results)
+    self.flush()
+
+  def flush(self):
+    self.fp.write(self.formatter.pop_output())
+
+  def close(self):
+    self.flush()
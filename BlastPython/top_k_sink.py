@@ -0,0 +1,150 @@
+# BEGIN_COPYRIGHT
+# 
+# Copyright (C) 2014 CRS4.
+# 
+# This file is part of blast-python.
+# 
+# blast-python is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+# 
+# blast-python is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along with
+# blast-python.  If not, see <http://www.gnu.org/licenses/>.
+# 
+# END_COPYRIGHT
+
+"""
+Keep only the best hits of each query over a whole result stream.
+"""
+
+import ncbi_toolkit
+from seq_info import get_subject_id
+
+
+# engine option tightened by adaptive runs, and how to tighten it
+ADAPTIVE_OPTIONS = {
+  'evalue': ('EvalueThreshold', min),
+  'score': ('CutoffScore', max),
+  }
+
+GAPPED_STATS = ('seqs_ungapped_passed', 'extensions', 'good_extensions',
+                'num_seqs_passed')
+
+
+def get_gapped_stats(blaster):
+  diagnostics = blaster.blast_engine.GetDiagnostics()
+  if diagnostics is None:
+    return (0,) * len(GAPPED_STATS)
+  return diagnostics.get_gapped_stats()
+
+
+class top_k_sink(object):
+
+  def __init__(self, k, key='evalue', get_metadata=get_subject_id):
+    """
+    Collects the best k HSPs of each query, ranked by key ('evalue',
+    'bit_score' or 'score'), from (subject, results) tuples such as the
+    ones yielded by blast_result_stream. Ranking runs in native code
+    on the raw engine results. Only get_metadata(subject) (by default,
+    the subject's id) is kept, and only while the subject holds one of
+    the best HSPs, so memory does not grow with the number of subjects.
+    """
+    self.key = key
+    self.accumulator = ncbi_toolkit.top_k_accumulator(k, key)
+    self.get_metadata = get_metadata
+    self.metadata = {}
+    self.n_subjects = 0
+
+  def add(self, subject, results):
+    """
+    Offer the results of the search on subject. Only results for a
+    single subject are supported.
+    """
+    subject_no = self.n_subjects
+    self.n_subjects += 1
+    if self.accumulator.add(results, subject_no):
+      self.metadata[subject_no] = self.get_metadata(subject)
+      for n in self.accumulator.pop_evicted():
+        self.metadata.pop(n, None)
+
+  def consume(self, stream):
+    """
+    Add all (subject, results) tuples from stream.
+    """
+    for subject, results in stream:
+      self.add(subject, results)
+    return self
+
+  def run(self, blaster, seq_stream, adaptive=True):
+    """
+    Blast each subject from seq_stream and add its results.
+
+    If adaptive is True, once every query has k HSPs the blaster's
+    EvalueThreshold (key 'evalue') or CutoffScore (key 'score') is
+    tightened to the current k-th best value each time it improves, so
+    that the engine drops hits that cannot make it into the best k
+    during gapped extension, before traceback. Thresholds are never
+    loosened, and no HSP that could still win is lost. The original
+    option value is restored when done. Adaptive runs are not
+    supported for key 'bit_score'.
+
+    Returns a dict with the number of searches and the gapped
+    extension statistics (see BlastDiagnostics.get_gapped_stats),
+    summed separately over the searches run with the original
+    threshold ('before') and with a tightened one ('after'). Comparing
+    good_extensions per search between the two shows how much
+    traceback work was saved.
+    """
+    if adaptive and self.key not in ADAPTIVE_OPTIONS:
+      raise ValueError("adaptive runs are not supported for key %r" %
+                       self.key)
+    totals = {}
+    for phase in 'before', 'after':
+      totals[phase] = dict.fromkeys(('searches',) + GAPPED_STATS, 0)
+    if adaptive:
+      name, tighten = ADAPTIVE_OPTIONS[self.key]
+      opts = blaster.set_options()
+      original = value = opts[name]
+    phase = totals['before']
+    try:
+      for subject in seq_stream:
+        _, results = blaster.blast(subject)
+        phase['searches'] += 1
+        for stat, v in zip(GAPPED_STATS, get_gapped_stats(blaster)):
+          phase[stat] += v
+        self.add(subject, results)
+        if not adaptive:
+          continue
+        threshold = self.accumulator.threshold()
+        if threshold is not None and tighten(value, threshold) != value:
+          value = tighten(value, threshold)
+          opts[name] = value
+          phase = totals['after']
+    finally:
+      if adaptive:
+        opts[name] = original
+    return totals
+
+  def snapshot(self):
+    """
+    The best HSPs of each query, best first, as a BlastResultsSnapshot.
+    Its subject_oid fields hold the position of the subject in the
+    sequence of add() calls.
+    """
+    return self.accumulator.snapshot()
+
+  def get_results(self):
+    """
+    Returns a list with one item per query: the list of its best
+    (metadata, hsp) pairs, best first.
+    """
+    snapshot = self.snapshot()
+    return [[(self.metadata[hsp.subject_oid], hsp)
+             for hsp in snapshot.for_query(i)]
+            for i in xrange(snapshot.num_queries)]
@@ -26,6 +26,7 @@ A (minimal) Python version of bl2seq.
 
 import sys, optparse
 from ncbi_toolkit import *
+from BlastPython import tabular_writer
 
 # possible values: both_rev, plus, minus, unknown, other, both
 # both_rev, other: programs exit with "Aborted."
@@ -74,33 +75,6 @@ def get_program_help():
     return "\n".join(lines)
 
 
-def get_match_endpoints(q_tuple, s_tuple, q_len, s_len, progname="blastn"):
-    q_frame, q_start, q_end, q_gap_start = q_tuple
-    s_frame, s_start, s_end, s_gap_start = s_tuple
-    if progname == "blastn":
-        if q_frame == -1:
-            q_start, q_end = q_len - q_end + 1, q_len - q_start
-            s_start, s_end = s_end, s_start + 1
-        else:
-            q_start += 1
-            s_start += 1
-    elif progname == "tblastx":
-        if q_frame >= 0:
-            q_start, q_end = 3*q_start + q_frame, 3*q_end + q_frame - 1
-        else:
-            q_start, q_end = q_len - 3*q_start + q_frame + 1, \
-                             q_len - 3*q_end + q_frame + 2
-        if s_frame >= 0:
-            s_start, s_end = 3*s_start + s_frame, 3*s_end + s_frame - 1
-        else:
-            s_start, s_end = s_len - 3*s_start + s_frame + 1, \
-                             s_len - 3*s_end + s_frame + 2
-    else:
-        raise ValueError("%s program not supported" % progname)
-
-    return q_start, q_end, s_start, s_end
-
-
 def main(argv):
 
     parser = make_parser()
@@ -159,22 +133,12 @@ def main(argv):
     result = blast_engine.GetResults()
     print "\t".join(["query_start", "query_end", "subject_start",
                      "subject_end", "e_value", "bit_score"])
-    hit_list = result[0]
-    if hit_list is not None:
-        hsp_list = hit_list[0]
-        for i, hsp in enumerate(hsp_list):
-            if options['Program'] == EProgram.eBlastn:
-                progname = "blastn"
-            else:
-                progname = "tblastx"
-
-            (q_start, q_end, s_start, s_end) = get_match_endpoints(
-                hsp.query, hsp.subject, query_seq.length, target_seq.length,
-                progname)
-            
-            print "\t".join(map(str, [q_start, q_end, s_start, s_end,
-                                     hsp.evalue, hsp.bit_score]))
-            
+    writer = tabular_writer(sys.stdout, ("qstart", "qend", "sstart", "send",
+                                         "evalue", "bitscore"),
+                            options['Program'])
+    writer.write(query_seq, target_seq, result)
+    writer.close()
+
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -42,7 +42,12 @@ mtime = lambda fn: os.stat(fn).st_mtime
 cpp_names = ["blast_options", "blast_sseq", "blast_sseq_factories",
              "blast_blast2seq", "blast_diagnostics", "blast_hits",
              "blast_sseq_loc_from_fasta", "blast_sseq_loc_from_str",
-             "cseq_sequence_extractor", "ncbi_toolkit_main"]
+             "blast_scope_pool",
+             "cseq_sequence_extractor", "blast_kmer_filter",
+             "blast_hsp_rows", "blast_results",
+             "blast_match_endpoints", "blast_top_k", "blast_tabular",
+             "blast_interval_index", "blast_predicate",
+             "ncbi_toolkit_main"]
 cpp_files = ["src/%s.cpp" % n for n in cpp_names]
 
 include_dirs = [NCBI_INCLUDE]
@@ -27,6 +27,10 @@
 
 #include <boost/python.hpp>
 
+#include "python_gil.hpp"
+#include "blast_hsp_rows.hpp"
+#include "blast_results.hpp"
+
 #include <assert.h>
 
 using namespace boost::python;
@@ -42,28 +46,36 @@ struct ncbi_blast_CBl2Seq_wrapper : public ncbi::blast::CBl2Seq {
   ncbi_blast_CBl2Seq_wrapper(PyObject* py_self, 
 			     const ncbi::blast::SSeqLoc& query, const ncbi::blast::SSeqLoc& subject,
 			     const ncbi::blast::EProgram prog) :
-    super_t(query, subject, prog), _py_self(py_self) {}
+    super_t(query, subject, prog), _py_self(py_self), _results_generation(0) {}
 
 
-  list get_results() const {
-    list l;
-    BlastHSPResults* r = GetResults();
-    for(int i = 0; i < r->num_queries; ++i){
-      l.append(r->hitlist_array[i]);
-    }
-    return l;
+  // Views returned by get_results check this counter, so that they
+  // cannot be used after the results they point to have been freed.
+  void invalidate_results() {
+    ++_results_generation;
+  }
+
+  blast_results_view get_results() const {
+    return blast_results_view(GetResults(), &_results_generation);
+  }
+  object get_results_arrays(int oid) const {
+    return hsp_rows_array(GetResults(), oid);
   }
-  list get_results_static(const ncbi::blast::CBl2Seq* p) const {
+
+  blast_results_view get_results_static(const ncbi::blast::CBl2Seq* p) const {
     const ncbi_blast_CBl2Seq_wrapper* cp = static_cast<const ncbi_blast_CBl2Seq_wrapper*>(p);
     return cp->get_results();
   }
 
   void SetupSearchProxy(bool query_already_setup = false) {   
     this->mi_bQuerySetUpDone = query_already_setup;
+    invalidate_results();
+    scoped_gil_release nogil;
     this->SetupSearch();
   }
 
   void SetQueryProxy(const ncbi::blast::SSeqLoc& query){
+    invalidate_results();
     SetQuery(query);
   }
   void SetQueriesProxy(list queries){
@@ -80,6 +92,7 @@ struct ncbi_blast_CBl2Seq_wrapper : public ncbi::blast::CBl2Seq {
       }
     }
 #if 1
+    invalidate_results();
     this->x_ResetQueryDs();
 //     std::cerr << "Done with reset" << std::endl;
     this->m_tQueries.clear();
@@ -93,6 +106,7 @@ struct ncbi_blast_CBl2Seq_wrapper : public ncbi::blast::CBl2Seq {
   }
 
   void SetSubjectProxy(const ncbi::blast::SSeqLoc& subject){
+    invalidate_results();
     SetSubject(subject);
   }
   void SetSubjectsProxy(list subjects){
@@ -109,6 +123,7 @@ struct ncbi_blast_CBl2Seq_wrapper : public ncbi::blast::CBl2Seq {
       }
     }
 #if 1
+    invalidate_results();
     this->x_ResetSubjectDs();
 //     std::cerr << "Done with reset" << std::endl;
     this->m_tSubjects.clear();
@@ -121,10 +136,24 @@ struct ncbi_blast_CBl2Seq_wrapper : public ncbi::blast::CBl2Seq {
 #endif
   }
 
+  void ResetSubjectsProxy() {
+    invalidate_results();
+    this->x_ResetSubjectDs();
+    this->m_tSubjects.clear();
+  }
+
   void ScanDBProxy() {   
+    invalidate_results();
+    scoped_gil_release nogil;
     this->RunFullSearch();  // TODO: check why this is not called directly.
   }
 
+  void RunWithoutSeqalignGenerationProxy() {
+    invalidate_results();
+    scoped_gil_release nogil;
+    this->RunWithoutSeqalignGeneration();
+  }
+
   const ncbi::blast::CBlastOptions& GetOptionsProxy() const {   
     return (this->GetOptionsHandle()).GetOptions();
   }
@@ -135,6 +164,7 @@ struct ncbi_blast_CBl2Seq_wrapper : public ncbi::blast::CBl2Seq {
 
   
   PyObject* _py_self;
+  unsigned long _results_generation;
 };
 
 static char set_query_doc[] = "Set the query to a given SSeqLoc";
@@ -144,17 +174,22 @@ static char get_subject_doc[] = "Get the subject";
 static char set_options_doc[] = "Returns a modifiable CBlastOptions object.";
 static char get_options_doc[] = "Returns a NON modifiable CBlastOptions object.";
 
-static char setup_search_doc[] = "Process the queries, do setup, and build the lookup table. If it passed True, assumes that query SSeqLoc has alreaby been setup. WARNING pass False the first time around :-).";
-static char RunWithoutSeqalignGeneration_doc[] = "Runs the search but does not produce seqalign output (useful if the raw search results are needed, rather than a set of complete Seq-aligns) (it amounts to  SetupQuery(False) + ScanDB())";
+static char setup_search_doc[] = "Process the queries, do setup, and build the lookup table. If it passed True, assumes that query SSeqLoc has alreaby been setup. WARNING pass False the first time around :-). The GIL is released while the setup runs.";
+static char RunWithoutSeqalignGeneration_doc[] = "Runs the search but does not produce seqalign output (useful if the raw search results are needed, rather than a set of complete Seq-aligns) (it amounts to  SetupQuery(False) + ScanDB()). The GIL is released while the search runs.";
 static char get_diagnostics_doc[] = "Retrieves the diagnostics information returned from the engine.";
-static char get_results_doc[] = "Retrieves the list of HSP results from the engine (to be used after RunWithoutSeqalignGeneration method)";
+static char get_results_doc[] = "Retrieves the HSP results from the engine (to be used after RunWithoutSeqalignGeneration method) as a BlastResults view, with one item per query. The view is only valid until the next search.";
+static char get_results_arrays_doc[] = "Returns all the HSPs found by the last search as a numpy structured array, one record per HSP, with the fields listed in BlastPython.HSP_FIELDS. If oid is not negative, only the HSPs of that subject are returned. Requires numpy.";
 static char get_error_message[] = "Returns error messages/warnings.";
+static char reset_subjects_doc[] = "Drops the subject(s) and the results of the last search, keeping the query set up.";
+static char scan_db_doc[] = "Runs the search on the current query and subject(s). The GIL is released while the search runs.";
 
 void export_blast_blast2seq() 
 {
   class_< ncbi::blast::CBl2Seq, boost::noncopyable, 
     ncbi_blast_CBl2Seq_wrapper>("CBl2Seq", 
-				"C++ glue to ncbi::blast::CBl2Seq",
+				"C++ glue to ncbi::blast::CBl2Seq. Searches release the GIL, so\n\
+ different CBl2Seq objects can be driven from different threads; a single\n\
+ CBl2Seq object must not be shared between threads.",
 				init<const ncbi::blast::SSeqLoc&, 
 				const ncbi::blast::SSeqLoc&,
 				const ncbi::blast::EProgram>("Initializes as an empty sequence.")
@@ -165,16 +200,21 @@ void export_blast_blast2seq()
     .def("SetSubject", &ncbi_blast_CBl2Seq_wrapper::SetSubjectProxy)
     .def("SetSubject", &ncbi_blast_CBl2Seq_wrapper::SetSubjectsProxy)
     .def("GetSubject", &ncbi::blast::CBl2Seq::GetSubject, return_internal_reference<>())
+    .def("ResetSubjects", &ncbi_blast_CBl2Seq_wrapper::ResetSubjectsProxy, reset_subjects_doc)
     
     .def("SetOptions", &ncbi_blast_CBl2Seq_wrapper::SetOptionsProxy, 
          return_internal_reference<>())
     .def("GetOptions", &ncbi_blast_CBl2Seq_wrapper::GetOptionsProxy, 
          return_internal_reference<>())
-    .def("SetupSearch", &ncbi_blast_CBl2Seq_wrapper::SetupSearchProxy)
-    .def("ScanDB", &ncbi_blast_CBl2Seq_wrapper::ScanDBProxy)
-    .def("RunWithoutSeqalignGeneration", &ncbi::blast::CBl2Seq::RunWithoutSeqalignGeneration)
+    .def("SetupSearch", &ncbi_blast_CBl2Seq_wrapper::SetupSearchProxy, setup_search_doc)
+    .def("ScanDB", &ncbi_blast_CBl2Seq_wrapper::ScanDBProxy, scan_db_doc)
+    .def("RunWithoutSeqalignGeneration", &ncbi_blast_CBl2Seq_wrapper::RunWithoutSeqalignGenerationProxy,
+	 RunWithoutSeqalignGeneration_doc)
     .def("GetDiagnostics", &ncbi::blast::CBl2Seq::GetDiagnostics, return_internal_reference<>())
-    .def("GetResults", &ncbi_blast_CBl2Seq_wrapper::get_results)
+    .def("GetResults", &ncbi_blast_CBl2Seq_wrapper::get_results,
+	 with_custodian_and_ward_postcall<0, 1>(), get_results_doc)
+    .def("GetResultsArrays", &ncbi_blast_CBl2Seq_wrapper::get_results_arrays,
+	 (arg("oid") = -1), get_results_arrays_doc)
     .def("GetMessages",  &ncbi::blast::CBl2Seq::GetMessages, return_value_policy<manage_new_object>())
     ;
 }
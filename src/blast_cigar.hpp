@@ -0,0 +1,82 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#ifndef _BLAST_CIGAR_HPP_
+#define _BLAST_CIGAR_HPP_
+
+#include <algo/blast/core/gapinfo.h>
+
+#include <cstdio>
+#include <stdexcept>
+#include <string>
+
+inline char cigar_op(int op) {
+  switch (op) {
+  case eGapAlignSub:     return 'M';
+  case eGapAlignDel:     return 'D';  // gap in query
+  case eGapAlignIns:     return 'I';  // gap in subject
+  default:
+    throw std::invalid_argument("Frame shifts cannot be written as CIGAR operations");
+  }
+}
+
+inline void append_cigar_op(std::string& cigar, int num, char op) {
+  char buf[16];
+  int n = std::sprintf(buf, "%d", num);
+  cigar.append(buf, n);
+  cigar.push_back(op);
+}
+
+// Append the CIGAR string for the edit script given by ops and nums
+// (size operations) to cigar. Consecutive operations of the same
+// kind are merged. A non-aligned (declined) region advances both
+// sequences without aligning them, and CIGAR has no operation for
+// that: it is written as an insertion followed by a deletion of the
+// same length, which keeps the coordinates right without claiming
+// aligned columns (an 'X' would claim mismatches).
+template <class OpType>
+void append_cigar(std::string& cigar, const OpType* ops, const Int4* nums, int size) {
+  int run = 0;
+  char run_op = 0;
+  for (int i = 0; i < size; ++i) {
+    if (ops[i] == eGapAlignDecline) {
+      if (run_op != 'I' && run > 0) {
+	append_cigar_op(cigar, run, run_op);
+	run = 0;
+      }
+      append_cigar_op(cigar, run + nums[i], 'I');
+      run_op = 'D';
+      run = nums[i];
+      continue;
+    }
+    char op = cigar_op(ops[i]);
+    if (op != run_op && run > 0) {
+      append_cigar_op(cigar, run, run_op);
+      run = 0;
+    }
+    run_op = op;
+    run += nums[i];
+  }
+  if (run > 0) {
+    append_cigar_op(cigar, run, run_op);
+  }
+}
+
+#endif // _BLAST_CIGAR_HPP_
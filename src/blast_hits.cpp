@@ -21,6 +21,9 @@
 #include <algo/blast/core/blast_hits.h>
 #include <algo/blast/core/gapinfo.h>
 
+#include "blast_cigar.hpp"
+#include "blast_hsp_rows.hpp"
+
 #include <iostream>
 #include <boost/python.hpp>
 
@@ -32,6 +35,13 @@ using namespace boost::python;
 // Helpers
 //+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
+// A numpy array over a copy of the size bytes at data: engine memory
+// is freed by the next search, while the array may be kept.
+static object copied_array(const void* data, std::size_t size, const char* dtype) {
+  object buf(handle<>(PyString_FromStringAndSize(static_cast<const char*>(data), size)));
+  return numpy_frombuffer(buf, object(dtype));
+}
+
 
 //+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 // BlastHitList
@@ -119,6 +129,13 @@ struct ncbi_blast_BlastHSP_wrapper : BlastHSP {
 
   static GapEditScript* get_gap_info(const BlastHSP* hl) { return hl->gap_info;}
 
+  static tuple    get_alignment_stats(const BlastHSP* hl) {
+    Int4 align_len, mismatches, gap_opens;
+    double pident;
+    ::get_alignment_stats(hl, align_len, mismatches, gap_opens, pident);
+    return make_tuple(align_len, mismatches, gap_opens, pident);
+  }
+
   PyObject* _py_self;
 };
 
@@ -159,6 +176,18 @@ struct ncbi_blast_GapEditScript_wrapper : GapEditScript {
     return gap_edit_script_iterator(g);
   }
 
+  static tuple as_arrays(const GapEditScript* g) {
+    static char op_type_dtype[] = {'i', char('0' + sizeof(EGapAlignOpType)), 0};
+    return make_tuple(copied_array(g->op_type, g->size * sizeof(EGapAlignOpType), op_type_dtype),
+		      copied_array(g->num, g->size * sizeof(Int4), "i4"));
+  }
+
+  static std::string cigar(const GapEditScript* g) {
+    std::string s;
+    append_cigar(s, g->op_type, g->num, g->size);
+    return s;
+  }
+
   PyObject* _py_self;
 };
 
@@ -238,6 +267,9 @@ void export_blast_hits()
  (<Translation frame>, <Start of hsp>, <End of HSP>, <Where the gapped extension started>)")
     .add_property("context", &ncbi_blast_BlastHSP_wrapper::get_context,
 		  "Context number of query")
+    .add_property("alignment_stats", &ncbi_blast_BlastHSP_wrapper::get_alignment_stats,
+		  "Alignment statistics, as in the blast tabular output. A tuple: \n\
+ (<Alignment length>, <Mismatches>, <Gap openings>, <Percent identity>)")
     .add_property("num_linked_hsp", &ncbi_blast_BlastHSP_wrapper::get_num_linked_hsp,
 		  "How many HSP's are linked together for sum statistics evaluation? If unset (0), this HSP is\n\
  not part of a linked set, i.e. value 0 is treated the same way as 1.")
@@ -259,6 +291,13 @@ void export_blast_hits()
                                       )
     .def("__len__",  &ncbi_blast_GapEditScript_wrapper::get_len)
     .def("__iter__", &ncbi_blast_GapEditScript_wrapper::get_iterator)
+    .def("as_arrays", &ncbi_blast_GapEditScript_wrapper::as_arrays,
+	 "Returns the (op_type, num) numpy arrays of the script. They are (read-only)\n\
+ copies, which stay valid after the next search.")
+    .def("cigar", &ncbi_blast_GapEditScript_wrapper::cigar,
+	 "Returns the script as a CIGAR string (M: substitution, D: gap in query,\n\
+ I: gap in subject). A non-aligned region of n residues is written as nInD.\n\
+ Frame shifts are not supported.")
     ;
 }
 
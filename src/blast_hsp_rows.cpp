@@ -0,0 +1,187 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#include "blast_hsp_rows.hpp"
+
+#include <algo/blast/core/gapinfo.h>
+
+#include <cstring>
+
+using namespace boost::python;
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Helpers
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+static object new_bytearray(std::size_t size) {
+  return object(handle<>(PyByteArray_FromStringAndSize(NULL, size)));
+}
+
+static hsp_row* bytearray_rows(object& buf) {
+  return reinterpret_cast<hsp_row*>(PyByteArray_AS_STRING(buf.ptr()));
+}
+
+static object bytearray_to_array(object& buf) {
+  return numpy_frombuffer(buf, hsp_rows_dtype());
+}
+
+object numpy_frombuffer(const object& buf, const object& dtype) {
+  object numpy = import("numpy");
+  if (len(buf) == 0) {
+    return numpy.attr("empty")(0, dtype);
+  }
+  return numpy.attr("frombuffer")(buf, dtype);
+}
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// hsp_row
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+void get_alignment_stats(const BlastHSP* hsp, Int4& align_len, Int4& mismatches,
+			 Int4& gap_opens, double& pident) {
+  const GapEditScript* g = hsp->gap_info;
+  Int4 gaps = 0;
+  gap_opens = 0;
+  if (g == NULL || g->size == 0) {
+    align_len = hsp->query.end - hsp->query.offset;
+  } else {
+    align_len = 0;
+    for (int i = 0; i < g->size; ++i) {
+      align_len += g->num[i];
+      if (g->op_type[i] != eGapAlignSub && g->op_type[i] != eGapAlignDecline) {
+	gaps += g->num[i];
+	++gap_opens;
+      }
+    }
+  }
+  mismatches = align_len - hsp->num_ident - gaps;
+  pident = align_len > 0 ? 100.0 * hsp->num_ident / align_len : 0.0;
+}
+
+void fill_hsp_row(hsp_row& row, const BlastHSPList* hsp_list, const BlastHSP* hsp) {
+  row.query_index          = hsp_list->query_index;
+  row.subject_oid          = hsp_list->oid;
+  row.score                = hsp->score;
+  row.bit_score            = hsp->bit_score;
+  row.evalue               = hsp->evalue;
+  row.num_ident            = hsp->num_ident;
+  row.query_frame          = hsp->query.frame;
+  row.query_offset         = hsp->query.offset;
+  row.query_end            = hsp->query.end;
+  row.query_gapped_start   = hsp->query.gapped_start;
+  row.subject_frame        = hsp->subject.frame;
+  row.subject_offset       = hsp->subject.offset;
+  row.subject_end          = hsp->subject.end;
+  row.subject_gapped_start = hsp->subject.gapped_start;
+  row.context              = hsp->context;
+  get_alignment_stats(hsp, row.align_len, row.mismatches, row.gap_opens, row.pident);
+}
+
+std::size_t count_hsps(const BlastHSPResults* r, int oid) {
+  std::size_t n = 0;
+  if (r == NULL) {
+    return n;
+  }
+  for (int i = 0; i < r->num_queries; ++i) {
+    const BlastHitList* hit_list = r->hitlist_array[i];
+    if (hit_list == NULL) {
+      continue;
+    }
+    for (int j = 0; j < hit_list->hsplist_count; ++j) {
+      const BlastHSPList* hsp_list = hit_list->hsplist_array[j];
+      if (oid < 0 || hsp_list->oid == oid) {
+	n += hsp_list->hspcnt;
+      }
+    }
+  }
+  return n;
+}
+
+void fill_hsp_rows(const BlastHSPResults* r, int oid, hsp_row* rows) {
+  if (r == NULL) {
+    return;
+  }
+  for (int i = 0; i < r->num_queries; ++i) {
+    const BlastHitList* hit_list = r->hitlist_array[i];
+    if (hit_list == NULL) {
+      continue;
+    }
+    for (int j = 0; j < hit_list->hsplist_count; ++j) {
+      const BlastHSPList* hsp_list = hit_list->hsplist_array[j];
+      if (oid >= 0 && hsp_list->oid != oid) {
+	continue;
+      }
+      for (int k = 0; k < hsp_list->hspcnt; ++k) {
+	fill_hsp_row(*rows++, hsp_list, hsp_list->hsp_array[k]);
+      }
+    }
+  }
+}
+
+#define add_hsp_field(name, fmt)		\
+  names.append(#name);				\
+  formats.append(fmt);				\
+  offsets.append(offsetof(hsp_row, name))
+
+object hsp_rows_dtype() {
+  list names, formats, offsets;
+  add_hsp_field(query_index,          "i4");
+  add_hsp_field(subject_oid,          "i4");
+  add_hsp_field(score,                "i4");
+  add_hsp_field(bit_score,            "f8");
+  add_hsp_field(evalue,               "f8");
+  add_hsp_field(num_ident,            "i4");
+  add_hsp_field(query_frame,          "i4");
+  add_hsp_field(query_offset,         "i4");
+  add_hsp_field(query_end,            "i4");
+  add_hsp_field(query_gapped_start,   "i4");
+  add_hsp_field(subject_frame,        "i4");
+  add_hsp_field(subject_offset,       "i4");
+  add_hsp_field(subject_end,          "i4");
+  add_hsp_field(subject_gapped_start, "i4");
+  add_hsp_field(context,              "i4");
+  add_hsp_field(align_len,            "i4");
+  add_hsp_field(mismatches,           "i4");
+  add_hsp_field(gap_opens,            "i4");
+  add_hsp_field(pident,               "f8");
+  dict d;
+  d["names"] = names;
+  d["formats"] = formats;
+  d["offsets"] = offsets;
+  d["itemsize"] = sizeof(hsp_row);
+  return import("numpy").attr("dtype")(d);
+}
+
+#undef add_hsp_field
+
+object hsp_rows_array(const BlastHSPResults* r, int oid) {
+  std::size_t n = count_hsps(r, oid);
+  object buf = new_bytearray(n * sizeof(hsp_row));
+  fill_hsp_rows(r, oid, bytearray_rows(buf));
+  return bytearray_to_array(buf);
+}
+
+object hsp_rows_array(const hsp_row* rows, std::size_t n) {
+  object buf = new_bytearray(n * sizeof(hsp_row));
+  if (n > 0) {
+    std::memcpy(bytearray_rows(buf), rows, n * sizeof(hsp_row));
+  }
+  return bytearray_to_array(buf);
+}
@@ -0,0 +1,84 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#ifndef _BLAST_HSP_ROWS_HPP_
+#define _BLAST_HSP_ROWS_HPP_
+
+#include <algo/blast/core/blast_hits.h>
+
+#include <boost/python.hpp>
+
+#include <cstddef>
+
+// A flattened HSP. Field names are those of BlastPython.HSP_FIELDS and
+// of the numpy dtype returned by hsp_rows_dtype().
+struct hsp_row {
+  Int4   query_index;
+  Int4   subject_oid;
+  Int4   score;
+  double bit_score;
+  double evalue;
+  Int4   num_ident;
+  Int4   query_frame;
+  Int4   query_offset;
+  Int4   query_end;
+  Int4   query_gapped_start;
+  Int4   subject_frame;
+  Int4   subject_offset;
+  Int4   subject_end;
+  Int4   subject_gapped_start;
+  Int4   context;
+  Int4   align_len;
+  Int4   mismatches;
+  Int4   gap_opens;
+  double pident;
+};
+
+// Alignment statistics as in the blast tabular output: the number of
+// alignment columns, mismatches and gap openings, and the percentage
+// of identical columns. They are computed from the gap edit script
+// and the engine's count of identities (ungapped HSPs have no script).
+void get_alignment_stats(const BlastHSP* hsp, Int4& align_len, Int4& mismatches,
+			 Int4& gap_opens, double& pident);
+
+void fill_hsp_row(hsp_row& row, const BlastHSPList* hsp_list, const BlastHSP* hsp);
+
+// Number of HSPs in r (restricted to subject oid if oid >= 0). r can be NULL.
+std::size_t count_hsps(const BlastHSPResults* r, int oid = -1);
+
+// Fill rows (which must have room for count_hsps(r, oid) items) with
+// the HSPs in r, in query, hit list, HSP order.
+void fill_hsp_rows(const BlastHSPResults* r, int oid, hsp_row* rows);
+
+// numpy.frombuffer(buf, dtype), also for empty buffers (which older
+// numpy versions reject).
+boost::python::object numpy_frombuffer(const boost::python::object& buf,
+				       const boost::python::object& dtype);
+
+// A numpy structured dtype matching hsp_row (numpy is imported at run time).
+boost::python::object hsp_rows_dtype();
+
+// A numpy structured array holding (a copy of) the HSPs in r.
+boost::python::object hsp_rows_array(const BlastHSPResults* r, int oid = -1);
+
+// A numpy structured array holding a copy of rows[0:n].
+boost::python::object hsp_rows_array(const hsp_row* rows, std::size_t n);
+
+#endif // _BLAST_HSP_ROWS_HPP_
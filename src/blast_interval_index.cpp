@@ -0,0 +1,444 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#include "blast_match_endpoints.hpp"
+#include "blast_results.hpp"
+
+#include <boost/python.hpp>
+
+#include <algorithm>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+using namespace boost::python;
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Helpers
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+// An HSP's extent on one of its sequences, as a 0-based half-open
+// range on the plus strand of the original sequence.
+struct hsp_interval {
+  Int4 key;    // query index or subject oid
+  Int4 start;
+  Int4 end;
+  Int4 hsp;    // HSP number, in insertion order
+
+  bool operator<(const hsp_interval& o) const {
+    if (key != o.key) {
+      return key < o.key;
+    }
+    if (start != o.start) {
+      return start < o.start;
+    }
+    return hsp < o.hsp;
+  }
+};
+
+static std::vector<Int4> get_lengths(const object& lengths) {
+  std::size_t n = len(lengths);
+  std::vector<Int4> v(n);
+  for (std::size_t i = 0; i < n; ++i) {
+    v[i] = extract<Int4>(lengths[i]);
+  }
+  return v;
+}
+
+static Int4 get_length(const std::vector<Int4>& lengths, Int4 i, const char* what) {
+  if (lengths.size() == 1) {
+    return lengths[0];
+  }
+  if (i < 0 || std::size_t(i) >= lengths.size()) {
+    PyErr_SetString(PyExc_IndexError, what);
+    throw_error_already_set();
+  }
+  return lengths[i];
+}
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// hsp_interval_index
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+// HSP extents on the query (or subject) side, grouped by query index
+// (or subject oid). Each group is a sorted array of intervals laid out
+// as an implicit binary search tree (the root of [lo, hi) is its
+// middle element) augmented with the largest end in each subtree.
+// Ranges given to and returned by the methods are 1-based and
+// inclusive, as the coordinates of match_endpoints.
+//
+// With n intervals in a key and k of them reported, finding the key
+// takes O(log N) (N intervals in all); overlapping, within and
+// containing take O((k + 1) log n), since every subtree that is
+// entered either holds a reported interval or lies on one of the two
+// search paths bounding the query; coverage takes O((k + 1) log n) for
+// the k intervals overlapping the window. cull is O(n log n) plus the
+// cost of a containing lookup per HSP, i.e., O(n^2 log n) in the worst
+// case of deeply nested HSPs.
+class hsp_interval_index {
+public:
+  hsp_interval_index(ncbi::blast::EProgram program, const std::string& side) :
+    _program(program), _built(true) {
+    get_seq_kinds(program, _query_kind, _subject_kind);
+    if (side == "query") {
+      _query_side = true;
+    } else if (side == "subject") {
+      _query_side = false;
+    } else {
+      throw std::invalid_argument("side must be 'query' or 'subject'");
+    }
+  }
+
+  // Add the HSPs in results. Lengths are those of the queries (by query
+  // index) and of the subjects (by oid). If subject_no is not
+  // negative, it replaces the subject oid of all the HSPs added.
+  void add(const object& results, const object& query_lengths,
+	   const object& subject_lengths, Int4 subject_no) {
+    std::vector<Int4> q_lengths = get_lengths(query_lengths);
+    std::vector<Int4> s_lengths = get_lengths(subject_lengths);
+    std::size_t first = _rows.size();
+    get_hsp_rows(results, _rows);
+    for (std::size_t i = first; i < _rows.size(); ++i) {
+      hsp_row& r = _rows[i];
+      match_endpoints_row e;
+      get_match_endpoints(r, _query_kind, _subject_kind,
+			  get_length(q_lengths, r.query_index, "query index out of range"),
+			  get_length(s_lengths, r.subject_oid, "subject oid out of range"), e);
+      if (subject_no >= 0) {
+	r.subject_oid = subject_no;
+      }
+      hsp_interval v;
+      v.key = _query_side ? r.query_index : r.subject_oid;
+      Int4 a = _query_side ? e.query_start : e.subject_start;
+      Int4 b = _query_side ? e.query_end : e.subject_end;
+      v.start = std::min(a, b) - 1;
+      v.end = std::max(a, b);
+      v.hsp = i;
+      _intervals.push_back(v);
+    }
+    _built = false;
+  }
+
+  // HSPs whose range overlaps [start, end].
+  list overlapping(Int4 key, Int4 start, Int4 end) {
+    std::vector<Int4> found;
+    find_overlapping(key, start - 1, end, found);
+    return to_list(found);
+  }
+
+  // HSPs whose range lies within [start, end].
+  list within(Int4 key, Int4 start, Int4 end) {
+    std::vector<Int4> found;
+    find_overlapping(key, start - 1, end, found);
+    std::vector<Int4> kept;
+    for (std::size_t i = 0; i < found.size(); ++i) {
+      const hsp_interval& v = _by_hsp(found[i]);
+      if (v.start >= start - 1 && v.end <= end) {
+	kept.push_back(found[i]);
+      }
+    }
+    return to_list(kept);
+  }
+
+  // HSPs whose range contains [start, end].
+  list containing(Int4 key, Int4 start, Int4 end) {
+    std::vector<Int4> found;
+    find_containing(key, start - 1, end, found);
+    return to_list(found);
+  }
+
+  // Number of positions of [start, end] covered by at least one HSP
+  // (the whole sequence if start and end are not given).
+  long coverage(Int4 key, Int4 start, Int4 end) {
+    Int4 from = start - 1;
+    std::vector<Int4> found;
+    find_overlapping(key, from, end, found);
+    // positions in _intervals are in start order
+    for (std::size_t i = 0; i < found.size(); ++i) {
+      found[i] = _position[found[i]];
+    }
+    std::sort(found.begin(), found.end());
+    long covered = 0;
+    Int4 run_start = 0, run_end = 0;
+    bool in_run = false;
+    // merge the overlapping intervals into runs
+    for (std::size_t i = 0; i < found.size(); ++i) {
+      const hsp_interval& v = _intervals[found[i]];
+      Int4 s = std::max(v.start, from);
+      Int4 e = std::min(v.end, end);
+      if (s >= e) {
+	continue;
+      }
+      if (in_run && s <= run_end) {
+	run_end = std::max(run_end, e);
+	continue;
+      }
+      if (in_run) {
+	covered += run_end - run_start;
+      }
+      run_start = s;
+      run_end = e;
+      in_run = true;
+    }
+    if (in_run) {
+      covered += run_end - run_start;
+    }
+    return covered;
+  }
+
+  long total_coverage(Int4 key) {
+    return coverage(key, 1, INT_MAX_COORD);
+  }
+
+  // Client-side version of the CullingLimit option: the HSPs that are
+  // kept when any HSP whose range is contained in the ranges of at
+  // least limit higher-scoring (kept) HSPs of the same key is dropped.
+  // Each HSP costs a containing lookup, so this is quadratic when most
+  // HSPs are nested in each other.
+  list cull(int limit) {
+    build();
+    std::vector<Int4> order(_rows.size());
+    for (std::size_t i = 0; i < order.size(); ++i) {
+      order[i] = i;
+    }
+    std::stable_sort(order.begin(), order.end(), score_greater(_rows));
+    std::vector<bool> kept(_rows.size(), false);
+    std::vector<Int4> found;
+    for (std::size_t i = 0; i < order.size(); ++i) {
+      const hsp_interval& v = _by_hsp(order[i]);
+      found.clear();
+      find_containing(v.key, v.start, v.end, found);
+      int n = 0;
+      for (std::size_t j = 0; j < found.size() && n < limit; ++j) {
+	if (kept[found[j]]) {
+	  ++n;
+	}
+      }
+      kept[order[i]] = n < limit;
+    }
+    std::vector<Int4> result;
+    for (std::size_t i = 0; i < kept.size(); ++i) {
+      if (kept[i]) {
+	result.push_back(i);
+      }
+    }
+    return to_list(result);
+  }
+
+  // The range of HSP i, as (key, start, end).
+  tuple get_interval(int i) {
+    if (i < 0 || std::size_t(i) >= _rows.size()) {
+      PyErr_SetString(PyExc_IndexError, "HSP number out of range");
+      throw_error_already_set();
+    }
+    const hsp_interval& v = _by_hsp(i);
+    return make_tuple(v.key, v.start + 1, v.end);
+  }
+
+  object as_array() const {
+    return hsp_rows_array(_rows.empty() ? NULL : &_rows[0], _rows.size());
+  }
+
+  int get_len() const { return _rows.size(); }
+
+private:
+  static const Int4 INT_MAX_COORD = 0x7fffffff;
+
+  struct score_greater {
+    score_greater(const std::vector<hsp_row>& rows) : _rows(rows) {}
+    bool operator()(Int4 a, Int4 b) const { return _rows[a].score > _rows[b].score; }
+    const std::vector<hsp_row>& _rows;
+  };
+
+  void build() {
+    if (_built) {
+      return;
+    }
+    std::sort(_intervals.begin(), _intervals.end());
+    _position.resize(_intervals.size());
+    for (std::size_t i = 0; i < _intervals.size(); ++i) {
+      _position[_intervals[i].hsp] = i;
+    }
+    _max_end.resize(_intervals.size());
+    std::size_t lo = 0;
+    while (lo < _intervals.size()) {
+      std::size_t hi = lo;
+      while (hi < _intervals.size() && _intervals[hi].key == _intervals[lo].key) {
+	++hi;
+      }
+      build_max_end(lo, hi);
+      lo = hi;
+    }
+    _built = true;
+  }
+
+  Int4 build_max_end(std::size_t lo, std::size_t hi) {
+    if (lo >= hi) {
+      return -1;
+    }
+    std::size_t mid = lo + (hi - lo) / 2;
+    Int4 m = _intervals[mid].end;
+    m = std::max(m, build_max_end(lo, mid));
+    m = std::max(m, build_max_end(mid + 1, hi));
+    _max_end[mid] = m;
+    return m;
+  }
+
+  const hsp_interval& _by_hsp(Int4 hsp) {
+    build();
+    return _intervals[_position[hsp]];
+  }
+
+  void key_range(Int4 key, std::size_t& lo, std::size_t& hi) const {
+    hsp_interval v;
+    v.key = key;
+    v.start = -1;
+    v.hsp = -1;
+    lo = std::lower_bound(_intervals.begin(), _intervals.end(), v) - _intervals.begin();
+    v.start = INT_MAX_COORD;
+    v.hsp = INT_MAX_COORD;
+    hi = std::upper_bound(_intervals.begin() + lo, _intervals.end(), v) - _intervals.begin();
+  }
+
+  // intervals of key overlapping the half-open [start, end)
+  void find_overlapping(Int4 key, Int4 start, Int4 end, std::vector<Int4>& found) {
+    build();
+    std::size_t lo, hi;
+    key_range(key, lo, hi);
+    overlapping_in(lo, hi, start, end, found);
+    std::sort(found.begin(), found.end());
+  }
+
+  void overlapping_in(std::size_t lo, std::size_t hi, Int4 start, Int4 end,
+		      std::vector<Int4>& found) const {
+    if (lo >= hi) {
+      return;
+    }
+    std::size_t mid = lo + (hi - lo) / 2;
+    if (_max_end[mid] <= start) {
+      return;  // everything in this subtree ends before start
+    }
+    overlapping_in(lo, mid, start, end, found);
+    const hsp_interval& v = _intervals[mid];
+    if (v.start < end) {
+      if (v.end > start) {
+	found.push_back(v.hsp);
+      }
+      overlapping_in(mid + 1, hi, start, end, found);
+    }
+  }
+
+  // intervals of key containing the half-open [start, end)
+  void find_containing(Int4 key, Int4 start, Int4 end, std::vector<Int4>& found) {
+    build();
+    std::size_t lo, hi;
+    key_range(key, lo, hi);
+    // candidates are the prefix [lo, first) of the intervals starting
+    // at or before start
+    hsp_interval v;
+    v.key = key;
+    v.start = start;
+    v.hsp = INT_MAX_COORD;
+    std::size_t first = std::upper_bound(_intervals.begin() + lo, _intervals.begin() + hi, v) -
+      _intervals.begin();
+    containing_in(lo, hi, first, end, found);
+    std::sort(found.begin(), found.end());
+  }
+
+  // Subtrees of [lo, hi) that lie within the prefix [lo, first) are
+  // only entered if they hold an interval reaching end, which is then
+  // reported; the others lie on the search path of first.
+  void containing_in(std::size_t lo, std::size_t hi, std::size_t first, Int4 end,
+		     std::vector<Int4>& found) const {
+    if (lo >= hi || lo >= first) {
+      return;
+    }
+    std::size_t mid = lo + (hi - lo) / 2;
+    if (_max_end[mid] < end) {
+      return;  // nothing in this subtree reaches end
+    }
+    containing_in(lo, mid, first, end, found);
+    if (mid < first) {
+      if (_intervals[mid].end >= end) {
+	found.push_back(_intervals[mid].hsp);
+      }
+      containing_in(mid + 1, hi, first, end, found);
+    }
+  }
+
+  static list to_list(const std::vector<Int4>& v) {
+    list l;
+    for (std::size_t i = 0; i < v.size(); ++i) {
+      l.append(v[i]);
+    }
+    return l;
+  }
+
+  ncbi::blast::EProgram     _program;
+  seq_kind                  _query_kind;
+  seq_kind                  _subject_kind;
+  bool                      _query_side;
+  bool                      _built;
+  std::vector<hsp_row>      _rows;
+  std::vector<hsp_interval> _intervals;
+  std::vector<Int4>         _position;  // of each HSP in _intervals
+  std::vector<Int4>         _max_end;
+};
+
+static const char hsp_interval_index_add_doc[] = "add(RESULTS, QUERY_LENGTHS, SUBJECT_LENGTHS, SUBJECT_NO=-1)\n\
+ Add the HSPs in RESULTS (a BlastResults view, a BlastResultsSnapshot or a list laid\n\
+ out as the results of blaster.blast_batch). HSPs are numbered in the order they are\n\
+ added. If SUBJECT_NO is not negative, it replaces the subject oid of the HSPs, so that\n\
+ the results of a stream of single-subject searches can be indexed by subject.";
+
+static const char hsp_interval_index_cull_doc[] = "cull(LIMIT)\n\
+ Returns the numbers of the HSPs kept by the CullingLimit rule: an HSP is dropped if its\n\
+ range is contained in the ranges of at least LIMIT kept, higher-scoring HSPs.";
+
+void export_blast_interval_index()
+{
+  class_<hsp_interval_index, boost::noncopyable>("hsp_interval_index",
+		      "An interval index over the query (or subject) ranges of HSPs. Ranges are\n\
+ 1-based and inclusive, on the plus strand of the original sequences, and they are\n\
+ grouped by KEY: the query index (or the subject oid).",
+		      init<ncbi::blast::EProgram, std::string>("hsp_interval_index(PROGRAM, SIDE): SIDE is"
+							       " 'query' or 'subject'.")
+		      )
+    .def("add", &hsp_interval_index::add,
+	 (arg("results"), arg("query_lengths"), arg("subject_lengths"), arg("subject_no") = -1),
+	 hsp_interval_index_add_doc)
+    .def("overlapping", &hsp_interval_index::overlapping,
+	 "overlapping(KEY, START, END): numbers of the HSPs overlapping [START, END]")
+    .def("within", &hsp_interval_index::within,
+	 "within(KEY, START, END): numbers of the HSPs lying within [START, END]")
+    .def("containing", &hsp_interval_index::containing,
+	 "containing(KEY, START, END): numbers of the HSPs containing [START, END]")
+    .def("coverage", &hsp_interval_index::coverage,
+	 "coverage(KEY, START, END): positions of [START, END] covered by at least one HSP")
+    .def("coverage", &hsp_interval_index::total_coverage,
+	 "coverage(KEY): positions covered by at least one HSP")
+    .def("cull", &hsp_interval_index::cull, hsp_interval_index_cull_doc)
+    .def("get_interval", &hsp_interval_index::get_interval,
+	 "get_interval(I): the (KEY, START, END) range of HSP number I")
+    .def("as_array", &hsp_interval_index::as_array,
+	 "The HSPs, in the order they were added, as a numpy structured array")
+    .def("__len__", &hsp_interval_index::get_len)
+    ;
+}
@@ -0,0 +1,173 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#include <boost/python.hpp>
+
+#include "python_gil.hpp"
+
+#include <algorithm>
+#include <string>
+#include <vector>
+#include <stdint.h>
+
+using namespace boost::python;
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Helpers
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+// 2-bit nucleotide codes, -1 for anything that is not an unambiguous base
+static inline int base_code(char c) {
+  switch (c) {
+  case 'A': case 'a': return 0;
+  case 'C': case 'c': return 1;
+  case 'G': case 'g': return 2;
+  case 'T': case 't': return 3;
+  default: return -1;
+  }
+}
+
+// largest k for which the k-mer set is kept as a plain bitmap (4^k bits)
+static const int MAX_BITMAP_K = 12;
+static const int MAX_K = 32;
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// kmer_filter
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+// Set of the k-mers (2-bit packed) found in one or more sequences, used
+// to tell whether another sequence shares at least one of them.
+class kmer_filter {
+public:
+  kmer_filter(int k) : _k(k), _n_words(0), _sorted(true) {
+    if (k < 1 || k > MAX_K) {
+      throw std::runtime_error("k must be in [1, 32].");
+    }
+    _mask = (k == MAX_K) ? ~uint64_t(0) : ((uint64_t(1) << (2*k)) - 1);
+    if (k <= MAX_BITMAP_K) {
+      _bitmap.assign(((uint64_t(1) << (2*k)) + 63) / 64, 0);
+    }
+  }
+
+  void add(const std::string& seq, bool both_strands) {
+    const int shift = 2*(_k - 1);
+    uint64_t fwd = 0, rev = 0;
+    int valid = 0;
+    for (std::string::const_iterator it = seq.begin(); it != seq.end(); ++it) {
+      int c = base_code(*it);
+      if (c < 0) {
+	valid = 0;
+	continue;
+      }
+      fwd = ((fwd << 2) | c) & _mask;
+      rev = (rev >> 2) | (uint64_t(3 - c) << shift);
+      if (++valid >= _k) {
+	insert(fwd);
+	if (both_strands) {
+	  insert(rev);
+	}
+      }
+    }
+  }
+
+  bool shares_word(const std::string& seq) {
+    finalize();
+    scoped_gil_release nogil;
+    uint64_t code = 0;
+    int valid = 0;
+    for (std::string::const_iterator it = seq.begin(); it != seq.end(); ++it) {
+      int c = base_code(*it);
+      if (c < 0) {
+	valid = 0;
+	continue;
+      }
+      code = ((code << 2) | c) & _mask;
+      if (++valid >= _k && contains(code)) {
+	return true;
+      }
+    }
+    return false;
+  }
+
+  int get_k() const { return _k; }
+
+  std::size_t get_len() {
+    finalize();
+    return _bitmap.empty() ? _words.size() : _n_words;
+  }
+
+private:
+  void insert(uint64_t code) {
+    if (_bitmap.empty()) {
+      _words.push_back(code);
+      _sorted = false;
+    } else {
+      uint64_t& w = _bitmap[code >> 6];
+      uint64_t bit = uint64_t(1) << (code & 63);
+      if (!(w & bit)) {
+	w |= bit;
+	++_n_words;
+      }
+    }
+  }
+
+  bool contains(uint64_t code) const {
+    if (_bitmap.empty()) {
+      return std::binary_search(_words.begin(), _words.end(), code);
+    }
+    return (_bitmap[code >> 6] >> (code & 63)) & 1;
+  }
+
+  void finalize() {
+    if (!_sorted) {
+      std::sort(_words.begin(), _words.end());
+      _words.erase(std::unique(_words.begin(), _words.end()), _words.end());
+      _sorted = true;
+    }
+  }
+
+  int                   _k;
+  uint64_t              _mask;
+  std::vector<uint64_t> _bitmap;
+  std::size_t           _n_words;
+  std::vector<uint64_t> _words;
+  bool                  _sorted;
+};
+
+
+static const char kmer_filter_add_doc[] = "add(SEQ, BOTH_STRANDS)\n\
+ Add the k-mers of nucleotide string SEQ (and of its reverse complement if BOTH_STRANDS\n\
+ is True). k-mers containing anything other than A, C, G, T are skipped.";
+
+static const char kmer_filter_shares_word_doc[] = "shares_word(SEQ)\n\
+ True if nucleotide string SEQ contains at least one of the k-mers in the set.";
+
+void export_blast_kmer_filter()
+{
+  class_<kmer_filter>("kmer_filter",
+		      "A bit-packed set of nucleotide k-mers (1 <= k <= 32)",
+		      init<int>("kmer_filter(K): an empty set of K-mers.")
+		      )
+    .def("add", &kmer_filter::add, kmer_filter_add_doc)
+    .def("shares_word", &kmer_filter::shares_word, kmer_filter_shares_word_doc)
+    .def("__len__", &kmer_filter::get_len)
+    .add_property("k", &kmer_filter::get_k)
+    ;
+}
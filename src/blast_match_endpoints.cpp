@@ -0,0 +1,217 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#include "blast_match_endpoints.hpp"
+#include "blast_results.hpp"
+
+#include <boost/python.hpp>
+
+#include <stdexcept>
+#include <vector>
+
+using namespace boost::python;
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Helpers
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+void get_seq_kinds(ncbi::blast::EProgram program, seq_kind& query, seq_kind& subject) {
+  switch (program) {
+  case ncbi::blast::eBlastn:
+  case ncbi::blast::eMegablast:
+  case ncbi::blast::eDiscMegablast:
+    query = subject = nucleotide_seq;
+    break;
+  case ncbi::blast::eBlastp:
+  case ncbi::blast::eRPSBlast:
+  case ncbi::blast::ePSIBlast:
+    query = subject = protein_seq;
+    break;
+  case ncbi::blast::eBlastx:
+  case ncbi::blast::eRPSTblastn:
+    query = translated_seq;
+    subject = protein_seq;
+    break;
+  case ncbi::blast::eTblastn:
+    query = protein_seq;
+    subject = translated_seq;
+    break;
+  case ncbi::blast::eTblastx:
+    query = subject = translated_seq;
+    break;
+  default:
+    throw std::invalid_argument("Unsupported blast program");
+  }
+}
+
+// 1-based endpoints on the nucleotide sequence of an alignment found
+// on one of its translations. Minus frames give start > end.
+static void translated_endpoints(Int4 frame, Int4 offset, Int4 end, Int4 length,
+				 Int4& start_out, Int4& end_out) {
+  if (frame >= 0) {
+    start_out = 3 * offset + frame;
+    end_out = 3 * end + frame - 1;
+  } else {
+    start_out = length - 3 * offset + frame + 1;
+    end_out = length - 3 * end + frame + 2;
+  }
+}
+
+static std::vector<Int4> get_lengths(const object& lengths) {
+  std::size_t n = len(lengths);
+  std::vector<Int4> v(n);
+  for (std::size_t i = 0; i < n; ++i) {
+    v[i] = extract<Int4>(lengths[i]);
+  }
+  return v;
+}
+
+static Int4 get_length(const std::vector<Int4>& lengths, Int4 i, const char* what) {
+  if (i < 0 || std::size_t(i) >= lengths.size()) {
+    PyErr_SetString(PyExc_IndexError, what);
+    throw_error_already_set();
+  }
+  return lengths[i];
+}
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// match_endpoints
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+void get_match_endpoints(const hsp_row& r, seq_kind query, seq_kind subject,
+			 Int4 query_length, Int4 subject_length,
+			 match_endpoints_row& out) {
+  if (query == nucleotide_seq) {
+    // both sides are nucleotide: the subject is reported on the
+    // minus strand when the query matches with its reverse complement
+    if (r.query_frame < 0) {
+      out.query_start = query_length - r.query_end + 1;
+      out.query_end = query_length - r.query_offset;
+      out.subject_start = r.subject_end;
+      out.subject_end = r.subject_offset + 1;
+    } else {
+      out.query_start = r.query_offset + 1;
+      out.query_end = r.query_end;
+      out.subject_start = r.subject_offset + 1;
+      out.subject_end = r.subject_end;
+    }
+    return;
+  }
+  if (query == translated_seq) {
+    translated_endpoints(r.query_frame, r.query_offset, r.query_end, query_length,
+			 out.query_start, out.query_end);
+  } else {
+    out.query_start = r.query_offset + 1;
+    out.query_end = r.query_end;
+  }
+  if (subject == translated_seq) {
+    translated_endpoints(r.subject_frame, r.subject_offset, r.subject_end, subject_length,
+			 out.subject_start, out.subject_end);
+  } else {
+    out.subject_start = r.subject_offset + 1;
+    out.subject_end = r.subject_end;
+  }
+}
+
+static object match_endpoints_dtype() {
+  list names, formats;
+  names.append("query_start");
+  names.append("query_end");
+  names.append("subject_start");
+  names.append("subject_end");
+  for (int i = 0; i < 4; ++i) {
+    formats.append("i4");
+  }
+  dict d;
+  d["names"] = names;
+  d["formats"] = formats;
+  return import("numpy").attr("dtype")(d);
+}
+
+static object match_endpoints_rows(const hsp_row* rows, std::size_t n,
+				   ncbi::blast::EProgram program,
+				   const object& query_lengths, const object& subject_lengths) {
+  seq_kind query, subject;
+  get_seq_kinds(program, query, subject);
+  std::vector<Int4> q_lengths = get_lengths(query_lengths);
+  std::vector<Int4> s_lengths = get_lengths(subject_lengths);
+  object buf(handle<>(PyByteArray_FromStringAndSize(NULL, n * sizeof(match_endpoints_row))));
+  match_endpoints_row* out = reinterpret_cast<match_endpoints_row*>(PyByteArray_AS_STRING(buf.ptr()));
+  for (std::size_t i = 0; i < n; ++i) {
+    const hsp_row& r = rows[i];
+    get_match_endpoints(r, query, subject,
+			get_length(q_lengths, r.query_index, "query index out of range"),
+			get_length(s_lengths, r.subject_oid, "subject oid out of range"),
+			out[i]);
+  }
+  return numpy_frombuffer(buf, match_endpoints_dtype());
+}
+
+static object match_endpoints_view(const blast_results_view& v, ncbi::blast::EProgram program,
+				   const object& query_lengths, const object& subject_lengths) {
+  std::vector<hsp_row> rows(count_hsps(v.results()));
+  if (rows.empty()) {
+    return match_endpoints_rows(NULL, 0, program, query_lengths, subject_lengths);
+  }
+  fill_hsp_rows(v.results(), -1, &rows[0]);
+  return match_endpoints_rows(&rows[0], rows.size(), program, query_lengths, subject_lengths);
+}
+
+static object match_endpoints_snapshot(const blast_results_snapshot& s, ncbi::blast::EProgram program,
+				       const object& query_lengths, const object& subject_lengths) {
+  const hsp_row* rows = s.rows.empty() ? NULL : &s.rows[0];
+  return match_endpoints_rows(rows, s.rows.size(), program, query_lengths, subject_lengths);
+}
+
+static object match_endpoints_array(const object& a, ncbi::blast::EProgram program,
+				    const object& query_lengths, const object& subject_lengths) {
+  object rows = import("numpy").attr("ascontiguousarray")(a);
+  if (!(rows.attr("dtype") == hsp_rows_dtype())) {
+    PyErr_SetString(PyExc_TypeError, "expected an array of HSP rows (see CBl2Seq.GetResultsArrays)");
+    throw_error_already_set();
+  }
+  const void* data;
+  Py_ssize_t size;
+  if (PyObject_AsReadBuffer(rows.ptr(), &data, &size) < 0) {
+    throw_error_already_set();
+  }
+  return match_endpoints_rows(static_cast<const hsp_row*>(data), size / sizeof(hsp_row),
+			      program, query_lengths, subject_lengths);
+}
+
+static char match_endpoints_doc[] = "match_endpoints(hsps, program, query_lengths, subject_lengths)\n\n\
+ Converts the HSP coordinates in hsps (a BlastResults view, a\n\
+ BlastResultsSnapshot or an array returned by CBl2Seq.GetResultsArrays) to\n\
+ 1-based alignment endpoints on the original sequences, as reported by\n\
+ the blast command line tools. query_lengths and subject_lengths are the\n\
+ lengths of the queries (by query index) and of the subjects (by oid).\n\
+ Returns a numpy structured array with fields query_start, query_end,\n\
+ subject_start and subject_end, one record per HSP.";
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Exporting function definitions.
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+void export_blast_match_endpoints()
+{
+  // overloads are tried in reverse order: the generic one goes first
+  def("match_endpoints", &match_endpoints_array, match_endpoints_doc);
+  def("match_endpoints", &match_endpoints_snapshot, match_endpoints_doc);
+  def("match_endpoints", &match_endpoints_view, match_endpoints_doc);
+}
@@ -0,0 +1,50 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#ifndef _BLAST_MATCH_ENDPOINTS_HPP_
+#define _BLAST_MATCH_ENDPOINTS_HPP_
+
+#include <algo/blast/api/blast_types.hpp>
+
+#include "blast_hsp_rows.hpp"
+
+// How the sequence on each side of an alignment is searched.
+enum seq_kind {
+  protein_seq,
+  nucleotide_seq,
+  translated_seq
+};
+
+// Throws std::invalid_argument for unsupported programs.
+void get_seq_kinds(ncbi::blast::EProgram program, seq_kind& query, seq_kind& subject);
+
+// 1-based alignment endpoints on the original sequences.
+struct match_endpoints_row {
+  Int4 query_start;
+  Int4 query_end;
+  Int4 subject_start;
+  Int4 subject_end;
+};
+
+void get_match_endpoints(const hsp_row& r, seq_kind query, seq_kind subject,
+			 Int4 query_length, Int4 subject_length,
+			 match_endpoints_row& out);
+
+#endif // _BLAST_MATCH_ENDPOINTS_HPP_
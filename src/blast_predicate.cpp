@@ -0,0 +1,284 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#include <algo/blast/core/blast_hits.h>
+#include <algo/blast/core/gapinfo.h>
+
+#include "blast_hsp_rows.hpp"
+#include "blast_results.hpp"
+
+#include <boost/python.hpp>
+
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+using namespace boost::python;
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// hsp_predicate
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+// A conjunction of comparisons between hsp_row fields and constants,
+// such as [("evalue", "<", 1e-5), ("pident", ">=", 90)], evaluated on
+// the engine's HSPs. Terms on the ids, scores and identities are
+// checked first, so that the rest of the row, including the alignment
+// statistics that walk the gap edit script, is only computed for HSPs
+// that pass them.
+class hsp_predicate {
+public:
+  explicit hsp_predicate(const object& terms) {
+    std::size_t n = len(terms);
+    for (std::size_t i = 0; i < n; ++i) {
+      object t = terms[i];
+      if (len(t) != 3) {
+	throw std::invalid_argument("terms must be (field, op, value) tuples");
+      }
+      term x;
+      x.field = get_field(extract<std::string>(t[0]));
+      x.op = get_op(extract<std::string>(t[1]));
+      x.value = extract<double>(t[2]);
+      if (is_stats_field(x.field)) {
+	_late.push_back(x);
+      } else {
+	_early.push_back(x);
+      }
+    }
+  }
+
+  // Does the HSP pass all terms? If it does, row is filled.
+  bool accepts(const BlastHSPList* hsp_list, const BlastHSP* hsp, hsp_row& row) const {
+    row.query_index = hsp_list->query_index;
+    row.subject_oid = hsp_list->oid;
+    row.score = hsp->score;
+    row.bit_score = hsp->bit_score;
+    row.evalue = hsp->evalue;
+    row.num_ident = hsp->num_ident;
+    row.context = hsp->context;
+    if (!check(_early, row)) {
+      return false;
+    }
+    fill_hsp_row(row, hsp_list, hsp);
+    return check(_late, row);
+  }
+
+  bool accepts_row(const hsp_row& row) const {
+    return check(_early, row) && check(_late, row);
+  }
+
+private:
+  enum field_type {
+    f_query_index, f_subject_oid, f_score, f_bit_score, f_evalue, f_num_ident,
+    f_query_frame, f_query_offset, f_query_end, f_query_gapped_start,
+    f_subject_frame, f_subject_offset, f_subject_end, f_subject_gapped_start,
+    f_context, f_align_len, f_mismatches, f_gap_opens, f_pident
+  };
+
+  enum op_type { op_lt, op_le, op_gt, op_ge, op_eq, op_ne };
+
+  struct term {
+    field_type field;
+    op_type    op;
+    double     value;
+  };
+
+  static field_type get_field(const std::string& name) {
+    static const char* names[] = {
+      "query_index", "subject_oid", "score", "bit_score", "evalue", "num_ident",
+      "query_frame", "query_offset", "query_end", "query_gapped_start",
+      "subject_frame", "subject_offset", "subject_end", "subject_gapped_start",
+      "context", "align_len", "mismatches", "gap_opens", "pident"
+    };
+    for (std::size_t i = 0; i < sizeof(names) / sizeof(names[0]); ++i) {
+      if (name == names[i]) {
+	return field_type(i);
+      }
+    }
+    throw std::invalid_argument("unknown HSP field: " + name);
+  }
+
+  static op_type get_op(const std::string& op) {
+    if (op == "<")  return op_lt;
+    if (op == "<=") return op_le;
+    if (op == ">")  return op_gt;
+    if (op == ">=") return op_ge;
+    if (op == "==") return op_eq;
+    if (op == "!=") return op_ne;
+    throw std::invalid_argument("unknown comparison operator: " + op);
+  }
+
+  // fields that are not set before fill_hsp_row
+  static bool is_stats_field(field_type f) {
+    switch (f) {
+    case f_query_index: case f_subject_oid: case f_score: case f_bit_score:
+    case f_evalue: case f_num_ident: case f_context:
+      return false;
+    default:
+      return true;
+    }
+  }
+
+  static double get_value(const hsp_row& r, field_type f) {
+    switch (f) {
+    case f_query_index:          return r.query_index;
+    case f_subject_oid:          return r.subject_oid;
+    case f_score:                return r.score;
+    case f_bit_score:            return r.bit_score;
+    case f_evalue:               return r.evalue;
+    case f_num_ident:            return r.num_ident;
+    case f_query_frame:          return r.query_frame;
+    case f_query_offset:         return r.query_offset;
+    case f_query_end:            return r.query_end;
+    case f_query_gapped_start:   return r.query_gapped_start;
+    case f_subject_frame:        return r.subject_frame;
+    case f_subject_offset:       return r.subject_offset;
+    case f_subject_end:          return r.subject_end;
+    case f_subject_gapped_start: return r.subject_gapped_start;
+    case f_context:              return r.context;
+    case f_align_len:            return r.align_len;
+    case f_mismatches:           return r.mismatches;
+    case f_gap_opens:            return r.gap_opens;
+    default:                     return r.pident;
+    }
+  }
+
+  static bool check(const std::vector<term>& terms, const hsp_row& r) {
+    for (std::size_t i = 0; i < terms.size(); ++i) {
+      const term& t = terms[i];
+      double v = get_value(r, t.field);
+      bool ok;
+      switch (t.op) {
+      case op_lt: ok = v <  t.value; break;
+      case op_le: ok = v <= t.value; break;
+      case op_gt: ok = v >  t.value; break;
+      case op_ge: ok = v >= t.value; break;
+      case op_eq: ok = v == t.value; break;
+      default:    ok = v != t.value; break;
+      }
+      if (!ok) {
+	return false;
+      }
+    }
+    return true;
+  }
+
+  std::vector<term> _early;
+  std::vector<term> _late;
+};
+
+struct hsp_predicate_wrapper {
+  // Append to s the HSPs of hsp_list that pass p.
+  static void select_hsp_list(const hsp_predicate& p, const BlastHSPList* hsp_list,
+			      blast_results_snapshot& s) {
+    hsp_row row;
+    for (int k = 0; k < hsp_list->hspcnt; ++k) {
+      const BlastHSP* hsp = hsp_list->hsp_array[k];
+      if (!p.accepts(hsp_list, hsp, row)) {
+	continue;
+      }
+      s.rows.push_back(row);
+      const GapEditScript* g = hsp->gap_info;
+      if (g != NULL) {
+	s.gap_ops.insert(s.gap_ops.end(), g->op_type, g->op_type + g->size);
+	s.gap_nums.insert(s.gap_nums.end(), g->num, g->num + g->size);
+      }
+      s.gap_start.push_back(s.gap_ops.size());
+    }
+  }
+
+  // The result object for s, which takes ownership of it: None if no
+  // HSP was selected.
+  static object wrap(std::auto_ptr<blast_results_snapshot> s) {
+    if (s->rows.empty()) {
+      return object();
+    }
+    return object(handle<>(
+      manage_new_object::apply<blast_results_snapshot*>::type()(s.release())));
+  }
+
+  static object select_view(const hsp_predicate& p, const blast_results_view& v) {
+    const BlastHSPResults* r = v.results();
+    std::auto_ptr<blast_results_snapshot> s(new blast_results_snapshot());
+    s->num_queries = r == NULL ? 0 : r->num_queries;
+    for (int i = 0; i < s->num_queries; ++i) {
+      const BlastHitList* hit_list = r->hitlist_array[i];
+      for (int j = 0; hit_list != NULL && j < hit_list->hsplist_count; ++j) {
+	select_hsp_list(p, hit_list->hsplist_array[j], *s);
+      }
+      s->query_start.push_back(s->rows.size());
+    }
+    return wrap(s);
+  }
+
+  static object select_snapshot(const hsp_predicate& p, const blast_results_snapshot& in) {
+    std::auto_ptr<blast_results_snapshot> s(new blast_results_snapshot());
+    s->num_queries = in.num_queries;
+    for (int i = 0; i < in.num_queries; ++i) {
+      for (Int4 j = in.query_start[i]; j < in.query_start[i + 1]; ++j) {
+	if (!p.accepts_row(in.rows[j])) {
+	  continue;
+	}
+	s->rows.push_back(in.rows[j]);
+	s->gap_ops.insert(s->gap_ops.end(), in.gap_ops.begin() + in.gap_start[j],
+			  in.gap_ops.begin() + in.gap_start[j + 1]);
+	s->gap_nums.insert(s->gap_nums.end(), in.gap_nums.begin() + in.gap_start[j],
+			   in.gap_nums.begin() + in.gap_start[j + 1]);
+	s->gap_start.push_back(s->gap_ops.size());
+      }
+      s->query_start.push_back(s->rows.size());
+    }
+    return wrap(s);
+  }
+
+  static object select_list(const hsp_predicate& p, const object& results) {
+    std::auto_ptr<blast_results_snapshot> s(new blast_results_snapshot());
+    s->num_queries = len(results);
+    for (int i = 0; i < s->num_queries; ++i) {
+      object hit_list = results[i];
+      std::size_t m = hit_list.is_none() ? 0 : len(hit_list);
+      for (std::size_t j = 0; j < m; ++j) {
+	select_hsp_list(p, extract<const BlastHSPList*>(hit_list[j]), *s);
+      }
+      s->query_start.push_back(s->rows.size());
+    }
+    return wrap(s);
+  }
+};
+
+static const char hsp_predicate_doc[] = "hsp_predicate(TERMS)\n\
+ A conjunction of comparisons between HSP fields (as in BlastPython.HSP_FIELDS) and\n\
+ numbers, given as a list of (FIELD, OP, VALUE) tuples, where OP is one of\n\
+ '<', '<=', '>', '>=', '==', '!='.";
+
+static const char hsp_predicate_select_doc[] = "select(RESULTS)\n\
+ Returns the HSPs in RESULTS (a BlastResults view, a BlastResultsSnapshot or a list laid\n\
+ out as the results of blaster.blast_batch) that satisfy all terms, as a\n\
+ BlastResultsSnapshot, or None if there are none.";
+
+void export_blast_predicate()
+{
+  class_<hsp_predicate>("hsp_predicate", hsp_predicate_doc, init<object>())
+    // overloads are tried in reverse order: the generic one goes first
+    .def("select", &hsp_predicate_wrapper::select_list, hsp_predicate_select_doc)
+    .def("select", &hsp_predicate_wrapper::select_snapshot, hsp_predicate_select_doc)
+    .def("select", &hsp_predicate_wrapper::select_view, hsp_predicate_select_doc)
+    ;
+}
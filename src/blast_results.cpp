@@ -0,0 +1,445 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#include "blast_results.hpp"
+#include "blast_hsp_rows.hpp"
+#include "blast_cigar.hpp"
+
+#include <algo/blast/core/gapinfo.h>
+
+#include <boost/python.hpp>
+
+#include <cstring>
+
+using namespace boost::python;
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Helpers
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+// Hit lists are handed to python as (shallow) copies, None if empty.
+static object hit_list_object(const BlastHitList* hl) {
+  if (hl == NULL) {
+    return object();
+  }
+  return object(hl);
+}
+
+static bool is_empty(const BlastHitList* hl) {
+  return hl == NULL || hl->hsplist_count == 0;
+}
+
+static object pass_through(const object& o) { return o; }
+
+static int check_index(int i, int n, const char* what) {
+  if (i < 0) {
+    i += n;
+  }
+  if (i < 0 || i >= n) {
+    PyErr_SetString(PyExc_IndexError, what);
+    throw_error_already_set();
+  }
+  return i;
+}
+
+template <class T>
+static object vector_to_string(const std::vector<T>& v) {
+  const char* data = v.empty() ? NULL : reinterpret_cast<const char*>(&v[0]);
+  return object(handle<>(PyString_FromStringAndSize(data, v.size() * sizeof(T))));
+}
+
+template <class T>
+static void string_to_vector(const object& s, std::vector<T>& v) {
+  char* data;
+  Py_ssize_t size;
+  if (PyString_AsStringAndSize(s.ptr(), &data, &size) < 0) {
+    throw_error_already_set();
+  }
+  if (size % sizeof(T) != 0) {
+    throw std::runtime_error("Invalid snapshot state");
+  }
+  // the string buffer is not necessarily aligned for T
+  v.resize(size / sizeof(T));
+  if (size > 0) {
+    std::memcpy(&v[0], data, size);
+  }
+}
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Iterators
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+struct blast_results_iterator {
+  blast_results_iterator(const blast_results_view& view, bool nonempty) :
+    _view(view), _index(0), _nonempty(nonempty) {}
+
+  object get_next() {
+    int n = _view.size();
+    if (_nonempty) {
+      while (_index < n && is_empty(_view.hit_list(_index))) {
+	++_index;
+      }
+    }
+    if (_index >= n) {
+      boost::python::objects::stop_iteration_error();
+    }
+    int i = _index++;
+    object hl = hit_list_object(_view.hit_list(i));
+    if (_nonempty) {
+      return make_tuple(i, hl);
+    }
+    return hl;
+  }
+
+  blast_results_view _view;
+  int                _index;
+  bool               _nonempty;
+};
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// blast_results_view
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+struct blast_results_view_wrapper {
+
+  static int get_len(const blast_results_view& v) { return v.size(); }
+
+  static object get_item(const blast_results_view& v, int i) {
+    i = check_index(i, v.size(), "query index out of range");
+    return hit_list_object(v.hit_list(i));
+  }
+
+  static blast_results_iterator get_iterator(const blast_results_view& v) {
+    return blast_results_iterator(v, false);
+  }
+
+  static blast_results_iterator get_nonempty_iterator(const blast_results_view& v) {
+    return blast_results_iterator(v, true);
+  }
+
+  static object as_array(const blast_results_view& v) {
+    return hsp_rows_array(v.results());
+  }
+
+  static list cigars(const blast_results_view& v) {
+    const BlastHSPResults* r = v.results();
+    list l;
+    std::string cigar;
+    for (int i = 0; r != NULL && i < r->num_queries; ++i) {
+      const BlastHitList* hit_list = r->hitlist_array[i];
+      for (int j = 0; hit_list != NULL && j < hit_list->hsplist_count; ++j) {
+	const BlastHSPList* hsp_list = hit_list->hsplist_array[j];
+	for (int k = 0; k < hsp_list->hspcnt; ++k) {
+	  const BlastHSP* hsp = hsp_list->hsp_array[k];
+	  const GapEditScript* g = hsp->gap_info;
+	  cigar.clear();
+	  if (g != NULL && g->size > 0) {
+	    append_cigar(cigar, g->op_type, g->num, g->size);
+	  } else {
+	    append_cigar_op(cigar, hsp->query.end - hsp->query.offset, 'M');
+	  }
+	  l.append(cigar);
+	}
+      }
+    }
+    return l;
+  }
+
+  static blast_results_snapshot* snapshot(const blast_results_view& v) {
+    return new blast_results_snapshot(v.results());
+  }
+};
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// blast_results_snapshot
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+blast_results_snapshot::blast_results_snapshot() : num_queries(0) {
+  query_start.push_back(0);
+  gap_start.push_back(0);
+}
+
+blast_results_snapshot::blast_results_snapshot(const BlastHSPResults* r) : num_queries(0) {
+  std::size_t n = count_hsps(r);
+  rows.reserve(n);
+  gap_start.reserve(n + 1);
+  query_start.push_back(0);
+  gap_start.push_back(0);
+  if (r == NULL) {
+    return;
+  }
+  num_queries = r->num_queries;
+  query_start.reserve(num_queries + 1);
+  for (int i = 0; i < r->num_queries; ++i) {
+    const BlastHitList* hit_list = r->hitlist_array[i];
+    for (int j = 0; hit_list != NULL && j < hit_list->hsplist_count; ++j) {
+      const BlastHSPList* hsp_list = hit_list->hsplist_array[j];
+      for (int k = 0; k < hsp_list->hspcnt; ++k) {
+	const BlastHSP* hsp = hsp_list->hsp_array[k];
+	rows.push_back(hsp_row());
+	fill_hsp_row(rows.back(), hsp_list, hsp);
+	const GapEditScript* g = hsp->gap_info;
+	for (int l = 0; g != NULL && l < g->size; ++l) {
+	  gap_ops.push_back(g->op_type[l]);
+	  gap_nums.push_back(g->num[l]);
+	}
+	gap_start.push_back(gap_ops.size());
+      }
+    }
+    query_start.push_back(rows.size());
+  }
+}
+
+// An HSP of a snapshot. It holds a reference to the snapshot object,
+// so it stays valid for as long as it is around.
+struct snapshot_hsp {
+  snapshot_hsp(const object& owner, int index) :
+    _owner(owner), _snapshot(&extract<const blast_results_snapshot&>(owner)()),
+    _index(index) {}
+
+  const hsp_row& row() const { return _snapshot->rows[_index]; }
+
+  object                        _owner;
+  const blast_results_snapshot* _snapshot;
+  int                           _index;
+};
+
+struct snapshot_hsp_wrapper {
+  static int    get_query_index(const snapshot_hsp& h) { return h.row().query_index; }
+  static int    get_subject_oid(const snapshot_hsp& h) { return h.row().subject_oid; }
+  static int    get_score(const snapshot_hsp& h)       { return h.row().score; }
+  static int    get_num_ident(const snapshot_hsp& h)   { return h.row().num_ident; }
+  static double get_bit_score(const snapshot_hsp& h)   { return h.row().bit_score; }
+  static double get_evalue(const snapshot_hsp& h)      { return h.row().evalue; }
+  static int    get_context(const snapshot_hsp& h)     { return h.row().context; }
+
+  static tuple get_query(const snapshot_hsp& h) {
+    const hsp_row& r = h.row();
+    return make_tuple(r.query_frame, r.query_offset, r.query_end, r.query_gapped_start);
+  }
+
+  static tuple get_subject(const snapshot_hsp& h) {
+    const hsp_row& r = h.row();
+    return make_tuple(r.subject_frame, r.subject_offset, r.subject_end, r.subject_gapped_start);
+  }
+
+  static tuple get_alignment_stats(const snapshot_hsp& h) {
+    const hsp_row& r = h.row();
+    return make_tuple(r.align_len, r.mismatches, r.gap_opens, r.pident);
+  }
+
+  static list get_gap_info(const snapshot_hsp& h) {
+    const blast_results_snapshot& s = *h._snapshot;
+    list l;
+    for (int i = s.gap_start[h._index]; i < s.gap_start[h._index + 1]; ++i) {
+      l.append(make_tuple(EGapAlignOpType(s.gap_ops[i]), s.gap_nums[i]));
+    }
+    return l;
+  }
+};
+
+struct blast_results_snapshot_wrapper {
+
+  static int get_len(const blast_results_snapshot& s) { return s.size(); }
+  static int get_num_queries(const blast_results_snapshot& s) { return s.num_queries; }
+
+  static snapshot_hsp get_item(const object& self, int i) {
+    const blast_results_snapshot& s = extract<const blast_results_snapshot&>(self);
+    return snapshot_hsp(self, check_index(i, s.size(), "HSP index out of range"));
+  }
+
+  static list for_query(const object& self, int i) {
+    const blast_results_snapshot& s = extract<const blast_results_snapshot&>(self);
+    i = check_index(i, s.num_queries, "query index out of range");
+    list l;
+    for (int j = s.query_start[i]; j < s.query_start[i + 1]; ++j) {
+      l.append(snapshot_hsp(self, j));
+    }
+    return l;
+  }
+
+  static list cigars(const blast_results_snapshot& s) {
+    list l;
+    std::string cigar;
+    for (std::size_t i = 0; i < s.size(); ++i) {
+      int begin = s.gap_start[i], end = s.gap_start[i + 1];
+      cigar.clear();
+      if (end > begin) {
+	append_cigar(cigar, &s.gap_ops[begin], &s.gap_nums[begin], end - begin);
+      } else {
+	append_cigar_op(cigar, s.rows[i].query_end - s.rows[i].query_offset, 'M');
+      }
+      l.append(cigar);
+    }
+    return l;
+  }
+
+  static object as_array(const blast_results_snapshot& s) {
+    return hsp_rows_array(s.rows.empty() ? NULL : &s.rows[0], s.rows.size());
+  }
+};
+
+struct blast_results_snapshot_pickle_suite : pickle_suite {
+  static tuple getstate(const blast_results_snapshot& s) {
+    return make_tuple(s.num_queries, vector_to_string(s.rows),
+		      vector_to_string(s.query_start), vector_to_string(s.gap_start),
+		      vector_to_string(s.gap_ops), vector_to_string(s.gap_nums));
+  }
+
+  static void setstate(blast_results_snapshot& s, tuple state) {
+    if (len(state) != 6) {
+      throw std::runtime_error("Invalid snapshot state");
+    }
+    s.num_queries = extract<int>(state[0]);
+    string_to_vector(state[1], s.rows);
+    string_to_vector(state[2], s.query_start);
+    string_to_vector(state[3], s.gap_start);
+    string_to_vector(state[4], s.gap_ops);
+    string_to_vector(state[5], s.gap_nums);
+  }
+};
+
+static char blast_results_doc[] = "Results of the last search of a CBl2Seq engine: a sequence\n\
+ with one item per query, either a BlastHitList or None if the query has no\n\
+ hits. The view keeps its engine alive, but becomes invalid (any access raises\n\
+ RuntimeError) as soon as the engine runs a new search.";
+static char iter_nonempty_doc[] = "Iterates over the (query_index, hit_list) pairs of the queries that have hits.";
+static char as_array_doc[] = "Returns all HSPs as a numpy structured array (see CBl2Seq.GetResultsArrays).";
+static char snapshot_doc[] = "Copies the results to a BlastResultsSnapshot, which does not depend on the engine.";
+static char blast_results_snapshot_doc[] = "A copy of the results of a search, stored in a few flat arrays. It is\n\
+ a sequence of SnapshotHSP objects, ordered by query index, and it can be\n\
+ kept, queued or pickled (for a machine with the same architecture)\n\
+ independently of the engine that produced it.";
+static char cigars_doc[] = "Returns the list of the CIGAR strings of all HSPs (see GapEditScript.cigar); ungapped HSPs are a single match.";
+static char for_query_doc[] = "Returns the list of the HSPs of the given query.";
+static char snapshot_hsp_doc[] = "An HSP of a BlastResultsSnapshot, with the same properties as BlastHSP.";
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// get_hsp_rows
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+void get_hsp_rows(const object& results, std::vector<hsp_row>& rows) {
+  extract<const blast_results_view&> view(results);
+  if (view.check()) {
+    const BlastHSPResults* r = view().results();
+    std::size_t n = rows.size();
+    rows.resize(n + count_hsps(r));
+    if (rows.size() > n) {
+      fill_hsp_rows(r, -1, &rows[n]);
+    }
+    return;
+  }
+  extract<const blast_results_snapshot&> snapshot(results);
+  if (snapshot.check()) {
+    rows.insert(rows.end(), snapshot().rows.begin(), snapshot().rows.end());
+    return;
+  }
+  std::size_t n = len(results);
+  for (std::size_t i = 0; i < n; ++i) {
+    object hit_list = results[i];
+    if (hit_list.is_none()) {
+      continue;
+    }
+    std::size_t m = len(hit_list);
+    for (std::size_t j = 0; j < m; ++j) {
+      const BlastHSPList* hsp_list = extract<const BlastHSPList*>(hit_list[j]);
+      for (int k = 0; k < hsp_list->hspcnt; ++k) {
+	rows.push_back(hsp_row());
+	fill_hsp_row(rows.back(), hsp_list, hsp_list->hsp_array[k]);
+      }
+    }
+  }
+}
+
+static object results_array(const object& results) {
+  std::vector<hsp_row> rows;
+  get_hsp_rows(results, rows);
+  return hsp_rows_array(rows.empty() ? NULL : &rows[0], rows.size());
+}
+
+static char results_array_doc[] = "results_array(results)\n\n\
+ Returns the HSPs in results (a BlastResults view, a BlastResultsSnapshot or\n\
+ a list laid out as the results of blaster.blast_batch) as a numpy structured\n\
+ array (see CBl2Seq.GetResultsArrays).";
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Exporting class definitions.
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+void export_blast_results()
+{
+  class_< blast_results_iterator >("BlastResultsIterator",
+				   "Iterates along the hit lists of a BlastResults view",
+				   no_init)
+    .def("__iter__", &pass_through)
+    .def("next",     &blast_results_iterator::get_next)
+    ;
+
+  class_< blast_results_view >("BlastResults", blast_results_doc, no_init)
+    .def("__len__",       &blast_results_view_wrapper::get_len)
+    .def("__getitem__",   &blast_results_view_wrapper::get_item)
+    .def("__iter__",      &blast_results_view_wrapper::get_iterator,
+	 with_custodian_and_ward_postcall<0, 1>())
+    .def("iter_nonempty", &blast_results_view_wrapper::get_nonempty_iterator,
+	 with_custodian_and_ward_postcall<0, 1>(), iter_nonempty_doc)
+    .def("as_array",      &blast_results_view_wrapper::as_array, as_array_doc)
+    .def("cigars",        &blast_results_view_wrapper::cigars, cigars_doc)
+    .def("snapshot",      &blast_results_view_wrapper::snapshot,
+	 return_value_policy<manage_new_object>(), snapshot_doc)
+    ;
+
+  class_< snapshot_hsp >("SnapshotHSP", snapshot_hsp_doc, no_init)
+    .def("get_gap_info", &snapshot_hsp_wrapper::get_gap_info,
+	 "Get the gap editing script as a list of (EGapAlignOpType, count) tuples")
+    .add_property("query_index", &snapshot_hsp_wrapper::get_query_index,
+		  "Index of the query")
+    .add_property("subject_oid", &snapshot_hsp_wrapper::get_subject_oid,
+		  "The ordinal id of the subject sequence")
+    .add_property("score",       &snapshot_hsp_wrapper::get_score,
+		  "This HSP's raw score ")
+    .add_property("num_ident",   &snapshot_hsp_wrapper::get_num_ident,
+		  "Number of identical base pairs in this HSP ")
+    .add_property("bit_score",   &snapshot_hsp_wrapper::get_bit_score,
+		  "Bit score, calculated from score ")
+    .add_property("evalue",      &snapshot_hsp_wrapper::get_evalue,
+		  "This HSP's e-value ")
+    .add_property("query",       &snapshot_hsp_wrapper::get_query,
+		  "Query sequence info, as in BlastHSP.query")
+    .add_property("subject",     &snapshot_hsp_wrapper::get_subject,
+		  "Subject sequence info, as in BlastHSP.subject")
+    .add_property("context",     &snapshot_hsp_wrapper::get_context,
+		  "Context number of query")
+    .add_property("alignment_stats", &snapshot_hsp_wrapper::get_alignment_stats,
+		  "Alignment statistics, as in BlastHSP.alignment_stats")
+    ;
+
+  class_< blast_results_snapshot >("BlastResultsSnapshot", blast_results_snapshot_doc,
+				   init<>("Initializes as an empty snapshot."))
+    .def("__len__",     &blast_results_snapshot_wrapper::get_len)
+    .def("__getitem__", &blast_results_snapshot_wrapper::get_item)
+    .def("for_query",   &blast_results_snapshot_wrapper::for_query, for_query_doc)
+    .def("as_array",    &blast_results_snapshot_wrapper::as_array, as_array_doc)
+    .def("cigars",      &blast_results_snapshot_wrapper::cigars, cigars_doc)
+    .add_property("num_queries", &blast_results_snapshot_wrapper::get_num_queries,
+		  "Number of queries of the search")
+    .def_pickle(blast_results_snapshot_pickle_suite())
+    ;
+
+  def("results_array", &results_array, results_array_doc);
+}
@@ -0,0 +1,88 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#ifndef _BLAST_RESULTS_HPP_
+#define _BLAST_RESULTS_HPP_
+
+#include <algo/blast/core/blast_hits.h>
+
+#include "blast_hsp_rows.hpp"
+
+#include <stdexcept>
+#include <vector>
+
+// A view of the results held by a search engine. The engine frees
+// its results when a new search is set up, so the view records the
+// engine's generation counter at construction time and refuses any
+// access once the counter has moved on.
+class blast_results_view {
+public:
+  blast_results_view(const BlastHSPResults* r, const unsigned long* generation) :
+    _r(r), _generation(generation), _expected(*generation) {}
+
+  const BlastHSPResults* results() const {
+    if (*_generation != _expected) {
+      throw std::runtime_error("results are no longer valid: a new search has been run");
+    }
+    return _r;
+  }
+
+  int size() const {
+    const BlastHSPResults* r = results();
+    return r == NULL ? 0 : r->num_queries;
+  }
+
+  // The hit list for query i, NULL if the query has no hits.
+  const BlastHitList* hit_list(int i) const {
+    const BlastHSPResults* r = results();
+    return r->hitlist_array[i];
+  }
+
+private:
+  const BlastHSPResults* _r;
+  const unsigned long*   _generation;
+  unsigned long          _expected;
+};
+
+// A self-contained copy of a result set: one hsp_row per HSP, grouped
+// by query, plus the gap edit scripts, all in flat arrays.
+struct blast_results_snapshot {
+  blast_results_snapshot();
+  explicit blast_results_snapshot(const BlastHSPResults* r);
+
+  std::size_t size() const { return rows.size(); }
+
+  Int4                 num_queries;
+  std::vector<hsp_row> rows;
+  // the rows of query i are [query_start[i], query_start[i+1])
+  std::vector<Int4>    query_start;
+  // the gap edit script of row j is [gap_start[j], gap_start[j+1])
+  std::vector<Int4>    gap_start;
+  std::vector<Int4>    gap_ops;
+  std::vector<Int4>    gap_nums;
+};
+
+// Append to rows the HSPs of results, which can be a BlastResults
+// view, a BlastResultsSnapshot or a list laid out as the results of
+// blaster.blast_batch (one item per query: None or a sequence of
+// BlastHSPList).
+void get_hsp_rows(const boost::python::object& results, std::vector<hsp_row>& rows);
+
+#endif // _BLAST_RESULTS_HPP_
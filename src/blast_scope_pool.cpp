@@ -0,0 +1,155 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#include "blast_scope_pool.hpp"
+
+#include <objects/seq/Bioseq.hpp>
+#include <serial/iterator.hpp>
+
+#include <stdexcept>
+
+using namespace ncbi;
+using namespace ncbi::objects;
+
+static bool default_data_loaders = true;
+
+bool get_default_data_loaders() {
+  return default_data_loaders;
+}
+
+void set_default_data_loaders(bool use_data_loaders) {
+  default_data_loaders = use_data_loaders;
+}
+
+CRef<CScope> new_blast_scope(CObjectManager& objmgr, bool use_data_loaders) {
+  CRef<CScope> scope(new CScope(objmgr));
+  if (use_data_loaders) {
+    scope->AddDefaults();
+  }
+  return scope;
+}
+
+
+blast_scope_pool::blast_scope_pool(CObjectManager& objmgr, std::size_t max_entries,
+				   std::size_t max_residues, bool use_data_loaders) :
+  _objmngr(&objmgr), _max_entries(max_entries), _max_residues(max_residues),
+  _use_data_loaders(use_data_loaders), _slots(N_SCOPES), _current(0) {
+  if (max_entries == 0) {
+    throw std::invalid_argument("max_entries must be positive");
+  }
+}
+
+void blast_scope_pool::reset(slot& s) {
+  s.scope = new_blast_scope(*_objmngr, _use_data_loaders);
+  s.records.clear();
+  s.ids.clear();
+  s.residues = 0;
+}
+
+// Remove the entries no sequence refers to any more, i.e., whose
+// Seq-locs are only referenced by the pool (see blast_scope_pool).
+void blast_scope_pool::sweep(slot& s) {
+  std::size_t kept = 0;
+  for (std::size_t i = 0; i < s.records.size(); ++i) {
+    record& r = s.records[i];
+    bool live = false;
+    for (std::size_t j = 0; j < r.locs.size() && !live; ++j) {
+      live = !r.locs[j]->ReferencedOnlyOnce();
+    }
+    if (live) {
+      if (kept != i) {
+	s.records[kept] = r;
+      }
+      ++kept;
+      continue;
+    }
+    s.scope->RemoveTopLevelSeqEntry(r.handle);
+    for (std::size_t j = 0; j < r.ids.size(); ++j) {
+      s.ids.erase(r.ids[j]);
+    }
+    s.residues -= r.residues;
+  }
+  s.records.resize(kept);
+}
+
+bool blast_scope_pool::accepts(const slot& s, const std::vector<CSeq_id_Handle>& ids,
+			       std::size_t residues) const {
+  if (!s.scope) {
+    return false;
+  }
+  if (!s.records.empty()) {
+    if (s.records.size() >= _max_entries) {
+      return false;
+    }
+    if (_max_residues > 0 && s.residues + residues > _max_residues) {
+      return false;
+    }
+  }
+  for (std::size_t i = 0; i < ids.size(); ++i) {
+    if (s.ids.find(ids[i]) != s.ids.end()) {
+      return false;
+    }
+  }
+  return true;
+}
+
+CRef<CScope> blast_scope_pool::add(CSeq_entry& entry, std::size_t residues) {
+  std::vector<CSeq_id_Handle> ids;
+  for (CTypeConstIterator<CBioseq> itr(ConstBegin(entry)); itr; ++itr) {
+    ITERATE(CBioseq::TId, id, itr->GetId()) {
+      ids.push_back(CSeq_id_Handle::GetHandle(**id));
+    }
+  }
+  // the current scope as it is, then each scope after removing its
+  // dead entries, then a fresh scope in place of the next one
+  std::size_t n = _slots.size();
+  std::size_t chosen = n;
+  if (accepts(_slots[_current], ids, residues)) {
+    chosen = _current;
+  }
+  for (std::size_t k = 0; chosen == n && k < n; ++k) {
+    std::size_t i = (_current + k) % n;
+    if (!_slots[i].scope) {
+      continue;
+    }
+    sweep(_slots[i]);
+    if (accepts(_slots[i], ids, residues)) {
+      chosen = i;
+    }
+  }
+  if (chosen == n) {
+    chosen = _slots[_current].scope ? (_current + 1) % n : _current;
+    reset(_slots[chosen]);
+  }
+  _current = chosen;
+  slot& s = _slots[chosen];
+  record r;
+  r.handle = s.scope->AddTopLevelSeqEntry(entry);
+  r.ids = ids;
+  r.residues = residues;
+  s.records.push_back(r);
+  s.ids.insert(ids.begin(), ids.end());
+  s.residues += residues;
+  return s.scope;
+}
+
+void blast_scope_pool::hold(const CRef<CSeq_loc>& loc) {
+  _slots[_current].records.back().locs.push_back(loc);
+}
@@ -0,0 +1,111 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#ifndef _BLAST_SCOPE_POOL_HPP_
+#define _BLAST_SCOPE_POOL_HPP_
+
+#include <objmgr/object_manager.hpp>
+#include <objmgr/scope.hpp>
+#include <objmgr/seq_entry_handle.hpp>
+#include <objects/seq/Seq_entry.hpp>
+#include <objects/seq/seq_id_handle.hpp>
+#include <objects/seqloc/Seq_loc.hpp>
+
+#include <cstddef>
+#include <set>
+#include <vector>
+
+// Whether new scopes get the object manager's default data loaders
+// (AddDefaults), which may fetch unknown ids over the network. This is
+// the module-wide default; factories can override it.
+bool get_default_data_loaders();
+void set_default_data_loaders(bool use_data_loaders);
+
+// A new scope, with the default data loaders if use_data_loaders is
+// true and with only the entries added to it otherwise.
+ncbi::CRef<ncbi::objects::CScope> new_blast_scope(ncbi::objects::CObjectManager& objmgr,
+						  bool use_data_loaders);
+
+// A small set of long-lived scopes shared by the sequences made by a
+// factory, so that a new CScope (and its AddDefaults) is not needed
+// for every sequence. Entries are added to the current scope as top
+// level entries; the pool holds a reference to the Seq-locs built on
+// each entry, and an entry whose Seq-locs are no longer referenced
+// anywhere else is removed from its scope when room is needed. When
+// the current scope is full (max_entries entries or max_residues
+// residues) or already holds a live sequence with one of the new
+// entry's ids, the next scope is used, and a fresh one replaces it if
+// it cannot take the entry either. Replaced scopes stay alive as long
+// as the sequences that use them.
+//
+// Liveness is only tracked through the registered Seq-loc objects, so
+// an entry stays in its scope as long as an SSeqLoc sharing one of them
+// (e.g., a copy held by a search engine) exists. A Seq-loc or Seq-id
+// copied out of a sequence does not count: once all the sequences of an
+// entry are gone, resolving such a copy in the scope fails.
+class blast_scope_pool {
+public:
+  static const std::size_t N_SCOPES = 4;
+
+  blast_scope_pool(ncbi::objects::CObjectManager& objmgr, std::size_t max_entries,
+		   std::size_t max_residues, bool use_data_loaders);
+
+  // Add entry (holding residues residues) to one of the scopes and
+  // return it. Seq-locs built on the entry must then be registered
+  // with hold().
+  ncbi::CRef<ncbi::objects::CScope> add(ncbi::objects::CSeq_entry& entry,
+					std::size_t residues);
+
+  void hold(const ncbi::CRef<ncbi::objects::CSeq_loc>& loc);
+
+  std::size_t max_entries() const { return _max_entries; }
+  std::size_t max_residues() const { return _max_residues; }
+  bool use_data_loaders() const { return _use_data_loaders; }
+
+private:
+  struct record {
+    ncbi::objects::CSeq_entry_Handle                  handle;
+    std::vector<ncbi::objects::CSeq_id_Handle>        ids;
+    std::vector<ncbi::CRef<ncbi::objects::CSeq_loc> > locs;
+    std::size_t                                       residues;
+  };
+
+  struct slot {
+    slot() : residues(0) {}
+    ncbi::CRef<ncbi::objects::CScope>       scope;
+    std::vector<record>                     records;
+    std::set<ncbi::objects::CSeq_id_Handle> ids;
+    std::size_t                             residues;
+  };
+
+  void reset(slot& s);
+  void sweep(slot& s);
+  bool accepts(const slot& s, const std::vector<ncbi::objects::CSeq_id_Handle>& ids,
+	       std::size_t residues) const;
+
+  ncbi::CRef<ncbi::objects::CObjectManager> _objmngr;
+  std::size_t                               _max_entries;
+  std::size_t                               _max_residues;
+  bool                                      _use_data_loaders;
+  std::vector<slot>                         _slots;
+  std::size_t                               _current;
+};
+
+#endif // _BLAST_SCOPE_POOL_HPP_
@@ -28,10 +28,115 @@
 
 #include <iostream>
 #include <assert.h>
+#include <istream>
 #include <map>
+#include <string>
+#include <vector>
 
 using namespace boost::python;
 
+// The memory of an object supporting the buffer protocol (str,
+// bytearray, mmap, memoryview...), held for the lifetime of the
+// py_buffer. Objects that only support the old buffer interface are
+// read through it. That takes no export lock, and neither do python 2
+// buffer objects (even through the new interface) on the object they
+// wrap, so the memory of both can be resized or freed under us: it
+// must only be used before returning to python, unless copy_unlocked
+// is true, in which case their data is copied. Unicode objects are
+// rejected with a TypeError.
+class py_buffer : boost::noncopyable {
+public:
+  explicit py_buffer(const object& o, bool copy_unlocked = false) :
+    _owner(o), _has_view(false) {
+    // the buffer of a unicode object is its UCS-2/UCS-4 storage
+    if (PyUnicode_Check(o.ptr())) {
+      PyErr_SetString(PyExc_TypeError, "fasta data must be bytes, not unicode");
+      throw_error_already_set();
+    }
+    if (PyObject_CheckBuffer(o.ptr()) && !(copy_unlocked && PyBuffer_Check(o.ptr()))) {
+      if (PyObject_GetBuffer(o.ptr(), &_view, PyBUF_SIMPLE) < 0) {
+	throw_error_already_set();
+      }
+      _has_view = true;
+      _data = static_cast<const char*>(_view.buf);
+      _size = _view.len;
+      return;
+    }
+    const void* data;
+    Py_ssize_t size;
+    if (PyObject_AsReadBuffer(o.ptr(), &data, &size) < 0) {
+      throw_error_already_set();
+    }
+    _data = static_cast<const char*>(data);
+    _size = size;
+    if (copy_unlocked) {
+      _copy.assign(_data, _size);
+      _data = _copy.data();
+    }
+  }
+
+  ~py_buffer() {
+    if (_has_view) {
+      PyBuffer_Release(&_view);
+    }
+  }
+
+  const char* data() const { return _data; }
+  std::size_t size() const { return _size; }
+
+private:
+  object      _owner;
+  Py_buffer   _view;
+  bool        _has_view;
+  const char* _data;
+  std::size_t _size;
+  std::string _copy;
+};
+
+// The records in records: either a sequence of strings, or a single
+// buffer (str, bytearray, mmap...) holding them all. In a buffer, each
+// line is a record or, if fasta is true, each record starts with a '>'
+// line.
+static std::vector<std::string> get_records(const object& records, bool fasta) {
+  std::vector<std::string> v;
+  PyObject* o = records.ptr();
+  if (!PyUnicode_Check(o) && !PyObject_CheckBuffer(o) && !PyObject_CheckReadBuffer(o)) {
+    std::size_t n = len(records);
+    v.reserve(n);
+    for (std::size_t i = 0; i < n; ++i) {
+      v.push_back(extract<std::string>(records[i]));
+    }
+    return v;
+  }
+  py_buffer buffer(records);
+  const std::string b(buffer.data(), buffer.size());
+  std::size_t start = 0;
+  while (start < b.size()) {
+    std::size_t end = b.find('\n', start);
+    if (fasta) {
+      while (end != std::string::npos && end + 1 < b.size() && b[end + 1] != '>') {
+	end = b.find('\n', end + 1);
+      }
+    }
+    if (end == std::string::npos) {
+      end = b.size();
+    }
+    if (b.find_first_not_of(" \t\r\n", start) < end) {
+      v.push_back(b.substr(start, end - start));
+    }
+    start = end + 1;
+  }
+  return v;
+}
+
+static list to_list(const ncbi::blast::TSeqLocVector& v) {
+  list l;
+  for (std::size_t i = 0; i < v.size(); ++i) {
+    l.append(v[i]);
+  }
+  return l;
+}
+
 
 //+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 // blast_sseq_loc_from_string_wrapper
@@ -45,6 +150,12 @@ struct blast_sseq_loc_from_str_wrapper : public blast_sseq_loc_from_str, wrapper
 			    ncbi::objects::ENa_strand strand, int from, int to) {
     return blast_sseq_loc_from_str::make(seq_data, is_prot, seq_gi, title, strand, from, to);
   }
+
+  list make_many(const object& records, bool is_prot, const std::string& title,
+		 ncbi::objects::ENa_strand strand) {
+    return to_list(blast_sseq_loc_from_str::make_many(get_records(records, false), is_prot,
+						      title, strand));
+  }
   
   PyObject* _py_self;
 };
@@ -59,10 +170,11 @@ struct blast_sseq_loc_from_fasta_wrapper : public blast_sseq_loc_from_fasta, wra
   blast_sseq_loc_from_fasta_wrapper(PyObject* py_self) : blast_sseq_loc_from_fasta(), _py_self(py_self) {
   }
 
-  ncbi::blast::SSeqLoc make(str fasta, int s, 
+  ncbi::blast::SSeqLoc make(const object& fasta, int s, 
 			    ncbi::objects::ENa_strand strand, int from, int to, bool get_lcase_mask) {
-    const char* fstr = extract<const char*>(fasta);
-    return blast_sseq_loc_from_fasta::make(fstr, s, strand, from, to, get_lcase_mask);
+    py_buffer b(fasta);
+    return blast_sseq_loc_from_fasta::make(b.data(), b.size(), s, strand, from, to,
+					   get_lcase_mask);
   }
 
   std::string make_dummy(str fasta, ncbi::objects::ENa_strand strand, 
@@ -73,7 +185,19 @@ struct blast_sseq_loc_from_fasta_wrapper : public blast_sseq_loc_from_fasta, wra
     return s;
   }
 
-  ncbi::blast::SSeqLoc make_zero_seq(str fasta, ncbi::objects::ENa_strand strand, 
+  list make_many(const object& records, ncbi::objects::ENa_strand strand,
+		 int from, int to, bool get_lcase_mask) {
+    return to_list(blast_sseq_loc_from_fasta::make_many(get_records(records, true), strand,
+							from, to, get_lcase_mask));
+  }
+
+  list make_all(const object& fasta, ncbi::objects::ENa_strand strand, bool get_lcase_mask) {
+    py_buffer b(fasta);
+    return to_list(blast_sseq_loc_from_fasta::make_all(b.data(), b.size(), strand,
+						       get_lcase_mask));
+  }
+
+  ncbi::blast::SSeqLoc make_zero_seq(const object& fasta, ncbi::objects::ENa_strand strand, 
 				     int from, int to, bool get_lcase_mask) {
     return make(fasta, 0, strand, from, to, get_lcase_mask) ;
   }
@@ -82,9 +206,56 @@ struct blast_sseq_loc_from_fasta_wrapper : public blast_sseq_loc_from_fasta, wra
 };
 
 
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// fasta_sseq_iterator
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+// Reads the sequences of a fasta buffer one at a time, in place (but
+// from a copy for buffers that cannot be locked, see py_buffer). Unless the factory
+// has a scope pool, they share the scopes of a pool owned by the
+// iterator.
+class fasta_sseq_iterator {
+public:
+  static const std::size_t MAX_ENTRIES = 1000;
+
+  fasta_sseq_iterator(blast_sseq_loc_from_fasta& factory, const object& fasta,
+		      ncbi::objects::ENa_strand strand, bool get_lcase_mask) :
+    _factory(factory), _fasta(fasta, true), _buf(_fasta.data(), _fasta.size()), _in(&_buf),
+    _strand(strand), _get_lcase_mask(get_lcase_mask),
+    _pool(*ncbi::objects::CObjectManager::GetInstance(), MAX_ENTRIES, 0,
+	  factory.get_use_data_loaders()) {}
+
+  ncbi::blast::SSeqLoc next() {
+    ncbi::blast::SSeqLoc sl;
+    if (!_factory.make_next(_in, _strand, _get_lcase_mask, &_pool, sl)) {
+      PyErr_SetString(PyExc_StopIteration, "No more sequences.");
+      throw_error_already_set();
+    }
+    return sl;
+  }
+
+private:
+  blast_sseq_loc_from_fasta& _factory;
+  py_buffer                  _fasta;
+  memory_streambuf           _buf;
+  std::istream               _in;
+  ncbi::objects::ENa_strand  _strand;
+  bool                       _get_lcase_mask;
+  blast_scope_pool           _pool;
+};
+
+static fasta_sseq_iterator* iter_all(blast_sseq_loc_from_fasta& factory, const object& fasta,
+				     ncbi::objects::ENa_strand strand, bool get_lcase_mask) {
+  return new fasta_sseq_iterator(factory, fasta, strand, get_lcase_mask);
+}
+
+static object pass_through(const object& o) { return o; }
+
 static char make_from_fasta_doc[] = "make(FASTA, S=0, STRAND, FROM, TO, LCASE_MASK)\n\
  Returns a blast::SSeq_loc object from chars[FROM:TO[ of the S sequence contained in string FASTA\n\
- assign STRAND to it and do a lower case mask if LCASE_MASK is True. To select the whole sequence put FROM=0 and TO=0.";
+ assign STRAND to it and do a lower case mask if LCASE_MASK is True. To select the whole sequence put FROM=0 and TO=0.\n\
+ FASTA can be any object supporting the buffer protocol (str, bytearray, mmap, memoryview...):\n\
+ it is parsed in place, without being copied.";
 
 static char make_from_str_doc[] = "make(SEQ_DATA, IS_PROT, GID, TITLE, STRAND, FROM, TO)\n\
  Returns a blast::SSeq_loc objectfrom chars[FROM:TO[ of the S sequence contained\
@@ -92,8 +263,52 @@ static char make_from_str_doc[] = "make(SEQ_DATA, IS_PROT, GID, TITLE, STRAND, F
  have gid GID and title TITLE. To select the whole sequence put FROM=0\
  and TO=0.";
 
+static char make_many_from_fasta_doc[] = "make_many(RECORDS, STRAND, FROM, TO, LCASE_MASK)\n\
+ Returns a list with a blast::SSeq_loc object, as built by make, for the first sequence\n\
+ of each fasta record in RECORDS: a list of strings, or a single buffer holding all the\n\
+ records. The records are parsed in one call, and their sequences share scopes.";
+
+static char make_all_from_fasta_doc[] = "make_all(FASTA, STRAND, LCASE_MASK)\n\
+ Returns a list with a blast::SSeq_loc object for each sequence in FASTA (a string, or\n\
+ any object supporting the buffer protocol, parsed in place), all read in a single parse.";
+
+static char iter_all_from_fasta_doc[] = "iter_all(FASTA, STRAND, LCASE_MASK)\n\
+ Returns an iterator over blast::SSeq_loc objects for the sequences in FASTA (a string,\n\
+ or any object supporting the buffer protocol), which reads one sequence at a time, in a\n\
+ single pass over FASTA and without copying it. Buffer objects, and objects that only\n\
+ support the old buffer interface, cannot be locked while the iterator reads them, so\n\
+ they are copied.";
+
+static char make_many_from_str_doc[] = "make_many(RECORDS, IS_PROT, TITLE, STRAND)\n\
+ Returns a list with a blast::SSeq_loc object, as built by make, for each 'GID SEQ_DATA'\n\
+ record in RECORDS: a list of strings, or a single buffer with one record per line.\n\
+ All sequences get title TITLE. The records are parsed in one call, and their\n\
+ sequences share scopes.";
+
+static char set_scope_pool_doc[] = "set_scope_pool(MAX_ENTRIES, MAX_RESIDUES)\n\
+ Make the following sequences share a small pool of long-lived scopes instead of\n\
+ creating (and populating with defaults) a new scope for each of them. A scope is\n\
+ recycled once it holds MAX_ENTRIES sequences or MAX_RESIDUES residues (0 for no\n\
+ limit): the sequences no longer referenced are removed from it, and it is replaced\n\
+ by a new one if that is not enough. MAX_ENTRIES=0 turns the pool off.\n\
+ A sequence stays in its scope as long as the blast::SSeq_loc object returned for it\n\
+ (or a copy of it, e.g. held by a CBl2Seq engine) is alive: Seq-locs or Seq-ids\n\
+ copied out of it do not keep it there.";
+
+static char use_data_loaders_doc[] = "Whether the scopes of new sequences get the default data loaders\n\
+ of the object manager, which may look unknown ids up over the network. When False,\n\
+ sequences only see the entries added by the factory. Initially the module-wide\n\
+ default (see set_default_data_loaders).";
+
+static char set_default_data_loaders_doc[] = "set_default_data_loaders(FLAG)\n\
+ Set whether factories created from now on give their scopes the default data loaders\n\
+ (True, the initial value) or only the entries they add (False).";
+
 void export_blast_sseq_factories() 
 {
+  def("set_default_data_loaders", set_default_data_loaders, set_default_data_loaders_doc);
+  def("get_default_data_loaders", get_default_data_loaders);
+
   class_< blast_sseq_loc_from_fasta,
     boost::noncopyable, 
     blast_sseq_loc_from_fasta_wrapper
@@ -103,7 +318,20 @@ void export_blast_sseq_factories()
       )
     .def("make", &blast_sseq_loc_from_fasta_wrapper::make, make_from_fasta_doc)
     .def("make", &blast_sseq_loc_from_fasta_wrapper::make_zero_seq)
+    .def("make_many", &blast_sseq_loc_from_fasta_wrapper::make_many, make_many_from_fasta_doc)
+    .def("make_all", &blast_sseq_loc_from_fasta_wrapper::make_all, make_all_from_fasta_doc)
+    .def("iter_all", iter_all, return_value_policy<manage_new_object,
+	 with_custodian_and_ward_postcall<0, 1> >(), iter_all_from_fasta_doc)
     .def("make_dummy", &blast_sseq_loc_from_fasta_wrapper::make_dummy)
+    .def("set_scope_pool", &blast_sseq_loc_from_fasta::set_scope_pool, set_scope_pool_doc)
+    .add_property("use_data_loaders", &blast_sseq_loc_from_fasta::get_use_data_loaders,
+		  &blast_sseq_loc_from_fasta::set_use_data_loaders, use_data_loaders_doc)
+    ;
+
+  class_< fasta_sseq_iterator, boost::noncopyable >("blast_sseq_loc_iterator",
+      "Iterates along the sequences of a fasta string", no_init)
+    .def("__iter__", &pass_through)
+    .def("next", &fasta_sseq_iterator::next)
     ;
 
   class_< blast_sseq_loc_from_str,
@@ -114,6 +342,10 @@ void export_blast_sseq_factories()
       init<>("Ready to generate!.")
       )
     .def("make", &blast_sseq_loc_from_str_wrapper::make, make_from_str_doc)
+    .def("make_many", &blast_sseq_loc_from_str_wrapper::make_many, make_many_from_str_doc)
+    .def("set_scope_pool", &blast_sseq_loc_from_str::set_scope_pool, set_scope_pool_doc)
+    .add_property("use_data_loaders", &blast_sseq_loc_from_str::get_use_data_loaders,
+		  &blast_sseq_loc_from_str::set_use_data_loaders, use_data_loaders_doc)
     ;
 }
 
@@ -47,32 +47,50 @@ using namespace ncbi::blast;
  * @param counter What index to start assigning local ids from? First unused 
  *                index on exit. [in] [out]
  * @param get_lcase_mask Should lower case be masked? [in]
+ * @param pool Scope pool to add the sequences to, NULL for a new scope [in]
+ * @param use_data_loaders Should a new scope get the default data loaders? [in]
+ * @param one_seq Read only the next sequence? [in]
  * @return Vector of sequence location structures.
  */
 TSeqLocVector
 BLASTGetSeqLocFromStream(std::istream& in, CObjectManager& objmgr, 
                          ENa_strand strand, int from, int to, 
-                         int *counter, bool get_lcase_mask)
+                         int *counter, bool get_lcase_mask,
+                         blast_scope_pool* pool, bool use_data_loaders,
+                         bool one_seq = false)
 {
   TSeqLocVector retval;
   CRef<CSeq_entry> seq_entry;
 
   vector<CConstRef<CSeq_loc> > lcase_mask;
 
-  CRef<CScope> scope(new CScope(objmgr));
-  scope->AddDefaults();
-
+  TReadFastaFlags flags = fReadFasta_AllSeqIds;
+  if (one_seq) {
+    flags |= fReadFasta_OneSeq;
+  }
   if (get_lcase_mask) {
-    if ( !(seq_entry = ReadFasta(in, fReadFasta_AllSeqIds, counter, 
+    if ( !(seq_entry = ReadFasta(in, flags, counter, 
 				 &lcase_mask)))
       throw std::runtime_error("Could not retrieve seq entry");
   } else {
-    if ( !(seq_entry = ReadFasta(in, fReadFasta_AllSeqIds, counter)))
+    if ( !(seq_entry = ReadFasta(in, flags, counter)))
       throw std::runtime_error("Could not retrieve seq entry");
   }
 
   int index = 0;
-  scope->AddTopLevelSeqEntry(*seq_entry);
+  CRef<CScope> scope;
+  if (pool) {
+    std::size_t residues = 0;
+    for (CTypeConstIterator<CBioseq> itr(ConstBegin(*seq_entry)); itr; ++itr) {
+      if (itr->GetInst().IsSetLength()) {
+        residues += itr->GetInst().GetLength();
+      }
+    }
+    scope = pool->add(*seq_entry, residues);
+  } else {
+    scope = new_blast_scope(objmgr, use_data_loaders);
+    scope->AddTopLevelSeqEntry(*seq_entry);
+  }
 
   from = std::max(from - 1, 0);
   to = std::max(to - 1, 0);
@@ -95,6 +113,9 @@ BLASTGetSeqLocFromStream(std::istream& in, CObjectManager& objmgr,
 
     seqloc->SetInt().SetStrand(strand);
     seqloc->SetInt().SetId().Assign(*itr->GetId().front());
+    if (pool) {
+      pool->hold(seqloc);
+    }
 
     //CRef<CScope> s(scope);
     SSeqLoc sl(seqloc, scope);
@@ -114,10 +135,13 @@ BLASTGetSeqLocFromStream(std::istream& in, CObjectManager& objmgr,
 }
 
 
-SSeqLoc blast_sseq_loc_from_fasta::make(const char* fasta_str, std::size_t s, ENa_strand strand, 
-					std::size_t from, std::size_t to, bool get_lcase_mask) {
-  std::istringstream is(fasta_str);
-  TSeqLocVector vec = BLASTGetSeqLocFromStream(is, *_objmngr, strand, from, to, &_counter, get_lcase_mask);
+SSeqLoc blast_sseq_loc_from_fasta::make(const char* data, std::size_t size, std::size_t s,
+					ENa_strand strand, std::size_t from, std::size_t to,
+					bool get_lcase_mask) {
+  memory_streambuf buf(data, size);
+  std::istream is(&buf);
+  TSeqLocVector vec = BLASTGetSeqLocFromStream(is, *_objmngr, strand, from, to, &_counter, get_lcase_mask,
+						_pool.get(), _use_data_loaders);
   if (s < 0 ) {
     throw std::runtime_error("Only non negative sequence selections are allowed.");
   }
@@ -126,3 +150,51 @@ SSeqLoc blast_sseq_loc_from_fasta::make(const char* fasta_str, std::size_t s, EN
   }
   return vec[s];
 }
+
+TSeqLocVector blast_sseq_loc_from_fasta::make_many(const std::vector<std::string>& records,
+						   ENa_strand strand, std::size_t from, std::size_t to,
+						   bool get_lcase_mask) {
+  TSeqLocVector retval;
+  if (records.empty()) {
+    return retval;
+  }
+  blast_scope_pool batch(*_objmngr, records.size(), 0, _use_data_loaders);
+  blast_scope_pool* pool = _pool ? _pool.get() : &batch;
+  retval.reserve(records.size());
+  for (std::size_t i = 0; i < records.size(); ++i) {
+    std::istringstream is(records[i]);
+    TSeqLocVector vec = BLASTGetSeqLocFromStream(is, *_objmngr, strand, from, to, &_counter,
+						 get_lcase_mask, pool, _use_data_loaders);
+    if (vec.empty()) {
+      throw std::runtime_error("Could not read requested sequence from fasta file.");
+    }
+    retval.push_back(vec[0]);
+  }
+  return retval;
+}
+
+TSeqLocVector blast_sseq_loc_from_fasta::make_all(const char* data, std::size_t size,
+						  ENa_strand strand, bool get_lcase_mask) {
+  memory_streambuf buf(data, size);
+  std::istream is(&buf);
+  return BLASTGetSeqLocFromStream(is, *_objmngr, strand, 0, 0, &_counter, get_lcase_mask,
+				  _pool.get(), _use_data_loaders);
+}
+
+bool blast_sseq_loc_from_fasta::make_next(std::istream& in, ENa_strand strand, bool get_lcase_mask,
+					  blast_scope_pool* pool, SSeqLoc& sl) {
+  in >> std::ws;
+  if (in.peek() == std::char_traits<char>::eof()) {
+    return false;
+  }
+  if (_pool) {
+    pool = _pool.get();
+  }
+  TSeqLocVector vec = BLASTGetSeqLocFromStream(in, *_objmngr, strand, 0, 0, &_counter,
+					       get_lcase_mask, pool, _use_data_loaders, true);
+  if (vec.empty()) {
+    throw std::runtime_error("Could not read sequence from fasta file.");
+  }
+  sl = vec[0];
+  return true;
+}
@@ -25,6 +25,48 @@
 #include <algo/blast/api/sseqloc.hpp>
 #include <objmgr/object_manager.hpp>
 
+#include "blast_scope_pool.hpp"
+
+#include <boost/shared_ptr.hpp>
+
+#include <cstring>
+#include <istream>
+#include <streambuf>
+#include <string>
+#include <vector>
+
+// A read-only streambuf over memory owned by someone else, so that
+// fasta data can be parsed in place, without copying it to a string.
+class memory_streambuf : public std::streambuf {
+public:
+  memory_streambuf(const char* data, std::size_t size) {
+    char* p = const_cast<char*>(data);
+    setg(p, p, p + size);
+  }
+
+protected:
+  pos_type seekoff(off_type off, std::ios_base::seekdir dir,
+		   std::ios_base::openmode which = std::ios_base::in) {
+    char* p;
+    if (dir == std::ios_base::beg) {
+      p = eback() + off;
+    } else if (dir == std::ios_base::cur) {
+      p = gptr() + off;
+    } else {
+      p = egptr() + off;
+    }
+    if (!(which & std::ios_base::in) || p < eback() || p > egptr()) {
+      return pos_type(off_type(-1));
+    }
+    setg(eback(), p, egptr());
+    return pos_type(p - eback());
+  }
+
+  pos_type seekpos(pos_type pos, std::ios_base::openmode which = std::ios_base::in) {
+    return seekoff(off_type(pos), std::ios_base::beg, which);
+  }
+};
+
 class blast_sseq_loc_from_fasta {
  public:
   blast_sseq_loc_from_fasta() {
@@ -33,12 +75,40 @@ class blast_sseq_loc_from_fasta {
       throw std::runtime_error("Could not initialize object manager");
     }
     _counter= 0;
+    _use_data_loaders = get_default_data_loaders();
   }
 
   blast_sseq_loc_from_fasta(const blast_sseq_loc_from_fasta& o)  {
     _objmngr = o._objmngr;
     _counter = o._counter;
+    _pool    = o._pool;
+    _use_data_loaders = o._use_data_loaders;
   }
+
+  // Share a pool of scopes (see blast_scope_pool) among the sequences
+  // made from now on; max_entries == 0 goes back to a new scope per
+  // sequence.
+  void set_scope_pool(std::size_t max_entries, std::size_t max_residues) {
+    if (max_entries == 0) {
+      _pool.reset();
+    } else {
+      _pool.reset(new blast_scope_pool(*_objmngr, max_entries, max_residues,
+					 _use_data_loaders));
+    }
+  }
+
+  // Whether the scopes of the sequences made from now on get the
+  // object manager's default data loaders (initially, the module-wide
+  // default). Without them, sequences only see the entries added
+  // locally, and no lookup ever leaves the process.
+  void set_use_data_loaders(bool use_data_loaders) {
+    _use_data_loaders = use_data_loaders;
+    if (_pool && _pool->use_data_loaders() != use_data_loaders) {
+      set_scope_pool(_pool->max_entries(), _pool->max_residues());
+    }
+  }
+
+  bool get_use_data_loaders() const { return _use_data_loaders; }
   
   ncbi::blast::SSeqLoc make(const char* fasta_str, ncbi::objects::ENa_strand strand, 
 			    std::size_t from, std::size_t to, bool get_lcase_mask) {
@@ -46,11 +116,38 @@ class blast_sseq_loc_from_fasta {
   }
 
   ncbi::blast::SSeqLoc make(const char* fasta_str, std::size_t s, ncbi::objects::ENa_strand strand, 
+			    std::size_t from, std::size_t to, bool get_lcase_mask) {
+    return make(fasta_str, std::strlen(fasta_str), s, strand, from, to, get_lcase_mask);
+  }
+
+  // As above, for the size bytes at data, which are parsed in place.
+  ncbi::blast::SSeqLoc make(const char* data, std::size_t size, std::size_t s,
+			    ncbi::objects::ENa_strand strand, 
 			    std::size_t from, std::size_t to, bool get_lcase_mask);
 
+  // The first sequence of each fasta record. Sequences share scopes:
+  // those of the scope pool if there is one, a few scopes for the
+  // whole batch otherwise.
+  ncbi::blast::TSeqLocVector make_many(const std::vector<std::string>& records,
+				       ncbi::objects::ENa_strand strand,
+				       std::size_t from, std::size_t to, bool get_lcase_mask);
+
+  // All the sequences in the size bytes at data, from a single parse, in one scope
+  // (or in the scope pool).
+  ncbi::blast::TSeqLocVector make_all(const char* data, std::size_t size,
+				      ncbi::objects::ENa_strand strand, bool get_lcase_mask);
+
+  // Read the next sequence from in into sl, adding it to the factory's
+  // scope pool if there is one, to pool otherwise. Returns false at
+  // the end of in.
+  bool make_next(std::istream& in, ncbi::objects::ENa_strand strand, bool get_lcase_mask,
+		 blast_scope_pool* pool, ncbi::blast::SSeqLoc& sl);
+
  protected:
   ncbi::CRef<ncbi::objects::CObjectManager> _objmngr;
   int                                       _counter;
+  boost::shared_ptr<blast_scope_pool>       _pool;
+  bool                                      _use_data_loaders;
 };
 
 #endif // _BLAST_SSEQ_LOC_FROM_FASTA_HPP_
@@ -99,6 +99,33 @@ build_bioseq(const std::string& seq_data,
 
 SSeqLoc blast_sseq_loc_from_str::make(const std::string& seq_data, bool is_prot, int  seq_gi, const std::string& title,
 				      ENa_strand strand, int from, int to) {
+  return make_in(seq_data, is_prot, seq_gi, title, strand, from, to, _pool.get());
+}
+
+TSeqLocVector blast_sseq_loc_from_str::make_many(const std::vector<std::string>& records, bool is_prot,
+						 const std::string& title, ENa_strand strand) {
+  TSeqLocVector retval;
+  if (records.empty()) {
+    return retval;
+  }
+  blast_scope_pool batch(*_objmngr, records.size(), 0, _use_data_loaders);
+  blast_scope_pool* pool = _pool ? _pool.get() : &batch;
+  retval.reserve(records.size());
+  for (std::size_t i = 0; i < records.size(); ++i) {
+    std::istringstream is(records[i]);
+    int seq_gi;
+    std::string seq_data;
+    if (!(is >> seq_gi >> seq_data)) {
+      throw std::runtime_error("Invalid record: " + records[i]);
+    }
+    retval.push_back(make_in(seq_data, is_prot, seq_gi, title, strand, 0, 0, pool));
+  }
+  return retval;
+}
+
+SSeqLoc blast_sseq_loc_from_str::make_in(const std::string& seq_data, bool is_prot, int  seq_gi,
+					 const std::string& title, ENa_strand strand, int from, int to,
+					 blast_scope_pool* pool) {
   
   if (seq_gi < 0) {
     throw std::runtime_error("seq_id cannot be negative.");
@@ -110,9 +137,6 @@ SSeqLoc blast_sseq_loc_from_str::make(const std::string& seq_data, bool is_prot,
     throw std::runtime_error("title cannot be empty.");
   }
   
-  CRef<CScope> scope(new CScope(*_objmngr));
-  scope->AddDefaults();
-
   from = std::max(from - 1, 0);
   to   = std::max(to - 1,   0);
   if (to <= 0 || to > seq_data.size()){
@@ -125,7 +149,13 @@ SSeqLoc blast_sseq_loc_from_str::make(const std::string& seq_data, bool is_prot,
   CRef<CSeq_entry> entry(new CSeq_entry);
   CRef<CBioseq> bioseq = build_bioseq(seq_data, is_prot, seq_gi, title);
   entry->SetSeq(*bioseq);
-  scope->AddTopLevelSeqEntry(*entry);
+  CRef<CScope> scope;
+  if (pool) {
+    scope = pool->add(*entry, seq_data.size());
+  } else {
+    scope = new_blast_scope(*_objmngr, _use_data_loaders);
+    scope->AddTopLevelSeqEntry(*entry);
+  }
   
   CRef<CSeq_loc> seqloc(new CSeq_loc());
 
@@ -133,6 +163,9 @@ SSeqLoc blast_sseq_loc_from_str::make(const std::string& seq_data, bool is_prot,
   seqloc->SetInt().SetFrom(from);
   seqloc->SetStrand(strand);
   seqloc->SetInt().SetId().Assign(*bioseq->GetId().front());
+  if (pool) {
+    pool->hold(seqloc);
+  }
   
   SSeqLoc sl(seqloc, scope);
   return sl;
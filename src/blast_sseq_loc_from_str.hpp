@@ -25,6 +25,13 @@
 #include <algo/blast/api/sseqloc.hpp>
 #include <objmgr/object_manager.hpp>
 
+#include "blast_scope_pool.hpp"
+
+#include <boost/shared_ptr.hpp>
+
+#include <string>
+#include <vector>
+
 class blast_sseq_loc_from_str {
 public:
   blast_sseq_loc_from_str() {
@@ -33,12 +40,40 @@ public:
       throw std::runtime_error("Could not initialize object manager");
     }
     _counter= 0;
+    _use_data_loaders = get_default_data_loaders();
   }
 
   blast_sseq_loc_from_str(const blast_sseq_loc_from_str& o)  {
     _objmngr = o._objmngr;
     _counter = o._counter;
+    _pool    = o._pool;
+    _use_data_loaders = o._use_data_loaders;
   }
+
+  // Share a pool of scopes (see blast_scope_pool) among the sequences
+  // made from now on; max_entries == 0 goes back to a new scope per
+  // sequence.
+  void set_scope_pool(std::size_t max_entries, std::size_t max_residues) {
+    if (max_entries == 0) {
+      _pool.reset();
+    } else {
+      _pool.reset(new blast_scope_pool(*_objmngr, max_entries, max_residues,
+					 _use_data_loaders));
+    }
+  }
+
+  // Whether the scopes of the sequences made from now on get the
+  // object manager's default data loaders (initially, the module-wide
+  // default). Without them, sequences only see the entries added
+  // locally, and no lookup ever leaves the process.
+  void set_use_data_loaders(bool use_data_loaders) {
+    _use_data_loaders = use_data_loaders;
+    if (_pool && _pool->use_data_loaders() != use_data_loaders) {
+      set_scope_pool(_pool->max_entries(), _pool->max_residues());
+    }
+  }
+
+  bool get_use_data_loaders() const { return _use_data_loaders; }
   
   ncbi::blast::SSeqLoc make(const std::string& seq_data, 
 			    bool is_prot,             
@@ -48,9 +83,25 @@ public:
 			    int from,
 			    int to
 			    );
+
+  // One sequence for each "GI SEQ_DATA" record (whitespace separated),
+  // all with the given title. Sequences share scopes: those of the
+  // scope pool if there is one, a few scopes for the whole batch
+  // otherwise.
+  ncbi::blast::TSeqLocVector make_many(const std::vector<std::string>& records,
+				       bool is_prot,
+				       const std::string& title,
+				       ncbi::objects::ENa_strand strand);
 protected:
+  ncbi::blast::SSeqLoc make_in(const std::string& seq_data, bool is_prot, int seq_gi,
+			       const std::string& title, ncbi::objects::ENa_strand strand,
+			       int from, int to, blast_scope_pool* pool);
+
+
   ncbi::CRef<ncbi::objects::CObjectManager> _objmngr;
   int                                       _counter;
+  boost::shared_ptr<blast_scope_pool>       _pool;
+  bool                                      _use_data_loaders;
 };
 
 #endif // _BLAST_SSEQ_LOC_FROM_STR_HPP_
@@ -0,0 +1,307 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#include "blast_match_endpoints.hpp"
+#include "blast_results.hpp"
+
+#include <boost/python.hpp>
+
+#include <cstdio>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+using namespace boost::python;
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Helpers
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+enum tabular_column {
+  col_qseqid, col_sseqid, col_pident, col_length, col_mismatch, col_gapopen, col_gaps,
+  col_qstart, col_qend, col_sstart, col_send, col_evalue, col_bitscore, col_score,
+  col_nident, col_qlen, col_slen, col_qframe, col_sframe
+};
+
+struct column_info {
+  const char*    name;
+  const char*    title;  // as in the "# Fields:" line of outfmt 7
+  tabular_column column;
+};
+
+static const column_info COLUMNS[] = {
+  {"qseqid",   "query id",         col_qseqid},
+  {"sseqid",   "subject id",       col_sseqid},
+  {"pident",   "% identity",       col_pident},
+  {"length",   "alignment length", col_length},
+  {"mismatch", "mismatches",       col_mismatch},
+  {"gapopen",  "gap opens",        col_gapopen},
+  {"gaps",     "gaps",             col_gaps},
+  {"qstart",   "q. start",         col_qstart},
+  {"qend",     "q. end",           col_qend},
+  {"sstart",   "s. start",         col_sstart},
+  {"send",     "s. end",           col_send},
+  {"evalue",   "evalue",           col_evalue},
+  {"bitscore", "bit score",        col_bitscore},
+  {"score",    "score",            col_score},
+  {"nident",   "identical",        col_nident},
+  {"qlen",     "query length",     col_qlen},
+  {"slen",     "subject length",   col_slen},
+  {"qframe",   "query frame",      col_qframe},
+  {"sframe",   "sbjct frame",      col_sframe},
+};
+
+static const std::size_t N_COLUMNS = sizeof(COLUMNS) / sizeof(COLUMNS[0]);
+
+static const char* program_name(ncbi::blast::EProgram program) {
+  switch (program) {
+  case ncbi::blast::eBlastp:     return "BLASTP";
+  case ncbi::blast::eBlastx:     return "BLASTX";
+  case ncbi::blast::eTblastn:    return "TBLASTN";
+  case ncbi::blast::eTblastx:    return "TBLASTX";
+  case ncbi::blast::eRPSBlast:   return "RPSBLAST";
+  case ncbi::blast::eRPSTblastn: return "RPSTBLASTN";
+  case ncbi::blast::ePSIBlast:   return "PSIBLAST";
+  default:                       return "BLASTN";
+  }
+}
+
+// printf-style formatting, without the leading blanks of fixed widths
+static void append_format(std::string& out, const char* format, double value) {
+  char buf[64];
+  int n = std::sprintf(buf, format, value);
+  const char* p = buf;
+  while (*p == ' ') {
+    ++p;
+  }
+  out.append(p, buf + n - p);
+}
+
+static void append_int(std::string& out, long value) {
+  char buf[24];
+  int n = std::sprintf(buf, "%ld", value);
+  out.append(buf, n);
+}
+
+// evalue and bit score are written as by the blast command line tools
+static void append_evalue(std::string& out, double evalue) {
+  if (evalue < 1.0e-180) {
+    out.append("0.0");
+  } else if (evalue < 1.0e-99) {
+    append_format(out, "%2.0le", evalue);
+  } else if (evalue < 0.0009) {
+    append_format(out, "%3.0le", evalue);
+  } else if (evalue < 0.1) {
+    append_format(out, "%4.3lf", evalue);
+  } else if (evalue < 1.0) {
+    append_format(out, "%3.2lf", evalue);
+  } else if (evalue < 10.0) {
+    append_format(out, "%2.1lf", evalue);
+  } else {
+    append_format(out, "%5.0lf", evalue);
+  }
+}
+
+static void append_bit_score(std::string& out, double bit_score) {
+  if (bit_score > 9999) {
+    append_format(out, "%4.3le", bit_score);
+  } else if (bit_score > 99.9) {
+    append_int(out, long(bit_score));
+  } else {
+    append_format(out, "%2.1lf", bit_score);
+  }
+}
+
+static std::vector<std::string> get_strings(const object& seq) {
+  std::size_t n = len(seq);
+  std::vector<std::string> v(n);
+  for (std::size_t i = 0; i < n; ++i) {
+    v[i] = extract<std::string>(seq[i]);
+  }
+  return v;
+}
+
+static std::vector<Int4> get_ints(const object& seq) {
+  std::size_t n = len(seq);
+  std::vector<Int4> v(n);
+  for (std::size_t i = 0; i < n; ++i) {
+    v[i] = extract<Int4>(seq[i]);
+  }
+  return v;
+}
+
+static std::size_t seq_index(Int4 i, std::size_t n, const char* what) {
+  if (n == 1) {
+    // a single sequence: results may come from a batch (see blaster.blast_batch)
+    return 0;
+  }
+  if (i < 0 || std::size_t(i) >= n) {
+    PyErr_SetString(PyExc_IndexError, what);
+    throw_error_already_set();
+  }
+  return i;
+}
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// tabular_formatter
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+// Formats HSPs as the tab-separated rows of the blast tabular output
+// (outfmt 6, or 7 with comments) into an output buffer.
+class tabular_formatter {
+public:
+  tabular_formatter(const list& columns, ncbi::blast::EProgram program, bool comments) :
+    _program(program_name(program)), _comments(comments) {
+    get_seq_kinds(program, _query_kind, _subject_kind);
+    std::size_t n = len(columns);
+    if (n == 0) {
+      throw std::invalid_argument("no columns given");
+    }
+    for (std::size_t i = 0; i < n; ++i) {
+      std::string name = extract<std::string>(columns[i]);
+      std::size_t c = 0;
+      while (c < N_COLUMNS && name != COLUMNS[c].name) {
+	++c;
+      }
+      if (c == N_COLUMNS) {
+	throw std::invalid_argument("unknown column: " + name);
+      }
+      _columns.push_back(COLUMNS[c].column);
+      _fields.append(i == 0 ? "# Fields: " : ", ");
+      _fields.append(COLUMNS[c].title);
+    }
+    _fields.push_back('\n');
+  }
+
+  void add(const object& results,
+	   const object& query_ids, const object& query_lengths,
+	   const object& subject_ids, const object& subject_lengths) {
+    std::vector<std::string> q_ids = get_strings(query_ids);
+    std::vector<std::string> s_ids = get_strings(subject_ids);
+    std::vector<Int4> q_lengths = get_ints(query_lengths);
+    std::vector<Int4> s_lengths = get_ints(subject_lengths);
+    if (q_ids.size() != q_lengths.size() || s_ids.size() != s_lengths.size()) {
+      throw std::invalid_argument("ids and lengths must have the same size");
+    }
+    _rows.clear();
+    get_hsp_rows(results, _rows);
+    if (!_comments) {
+      for (std::size_t i = 0; i < _rows.size(); ++i) {
+	append_row(_rows[i], q_ids, q_lengths, s_ids, s_lengths);
+      }
+      return;
+    }
+    std::size_t i = 0;
+    for (std::size_t q = 0; q < q_ids.size(); ++q) {
+      std::size_t end = i;
+      while (end < _rows.size() &&
+	     seq_index(_rows[end].query_index, q_ids.size(), "query index out of range") == q) {
+	++end;
+      }
+      _out.append("# ").append(_program).append("\n# Query: ").append(q_ids[q]).push_back('\n');
+      if (s_ids.size() == 1) {
+	_out.append("# Subject: ").append(s_ids[0]).push_back('\n');
+      }
+      if (end > i) {
+	_out.append(_fields);
+      }
+      _out.append("# ");
+      append_int(_out, end - i);
+      _out.append(" hits found\n");
+      for (; i < end; ++i) {
+	append_row(_rows[i], q_ids, q_lengths, s_ids, s_lengths);
+      }
+    }
+  }
+
+  int get_buffered() const { return _out.size(); }
+
+  object pop_output() {
+    object s(handle<>(PyString_FromStringAndSize(_out.data(), _out.size())));
+    _out.clear();
+    return s;
+  }
+
+private:
+  void append_row(const hsp_row& r,
+		  const std::vector<std::string>& q_ids, const std::vector<Int4>& q_lengths,
+		  const std::vector<std::string>& s_ids, const std::vector<Int4>& s_lengths) {
+    std::size_t q = seq_index(r.query_index, q_ids.size(), "query index out of range");
+    std::size_t s = seq_index(r.subject_oid, s_ids.size(), "subject oid out of range");
+    match_endpoints_row e;
+    get_match_endpoints(r, _query_kind, _subject_kind, q_lengths[q], s_lengths[s], e);
+    for (std::size_t c = 0; c < _columns.size(); ++c) {
+      if (c > 0) {
+	_out.push_back('\t');
+      }
+      switch (_columns[c]) {
+      case col_qseqid:   _out.append(q_ids[q]); break;
+      case col_sseqid:   _out.append(s_ids[s]); break;
+      case col_pident:   append_format(_out, "%.2f", r.pident); break;
+      case col_length:   append_int(_out, r.align_len); break;
+      case col_mismatch: append_int(_out, r.mismatches); break;
+      case col_gapopen:  append_int(_out, r.gap_opens); break;
+      case col_gaps:     append_int(_out, r.align_len - r.num_ident - r.mismatches); break;
+      case col_qstart:   append_int(_out, e.query_start); break;
+      case col_qend:     append_int(_out, e.query_end); break;
+      case col_sstart:   append_int(_out, e.subject_start); break;
+      case col_send:     append_int(_out, e.subject_end); break;
+      case col_evalue:   append_evalue(_out, r.evalue); break;
+      case col_bitscore: append_bit_score(_out, r.bit_score); break;
+      case col_score:    append_int(_out, r.score); break;
+      case col_nident:   append_int(_out, r.num_ident); break;
+      case col_qlen:     append_int(_out, q_lengths[q]); break;
+      case col_slen:     append_int(_out, s_lengths[s]); break;
+      case col_qframe:   append_int(_out, r.query_frame); break;
+      case col_sframe:   append_int(_out, r.subject_frame); break;
+      }
+    }
+    _out.push_back('\n');
+  }
+
+  std::vector<tabular_column> _columns;
+  std::string                 _program;
+  std::string                 _fields;
+  bool                        _comments;
+  seq_kind                    _query_kind;
+  seq_kind                    _subject_kind;
+  std::vector<hsp_row>        _rows;
+  std::string                 _out;
+};
+
+static const char tabular_formatter_add_doc[] = "add(RESULTS, QUERY_IDS, QUERY_LENGTHS, SUBJECT_IDS, SUBJECT_LENGTHS)\n\
+ Format the HSPs in RESULTS (a BlastResults view, a BlastResultsSnapshot or a list laid\n\
+ out as the results of blaster.blast_batch) and append them to the output buffer.\n\
+ Queries are looked up by query index and subjects by oid, unless there is only one.";
+
+static const char tabular_formatter_pop_output_doc[] = "pop_output()\n\
+ Returns the contents of the output buffer as a string and empties it.";
+
+void export_blast_tabular()
+{
+  class_<tabular_formatter, boost::noncopyable>("tabular_formatter",
+		      "Formats HSPs as blast tabular output (outfmt 6, or 7 with comments)",
+		      init<list, ncbi::blast::EProgram, bool>("tabular_formatter(COLUMNS, PROGRAM, COMMENTS)")
+		      )
+    .def("add", &tabular_formatter::add, tabular_formatter_add_doc)
+    .def("pop_output", &tabular_formatter::pop_output, tabular_formatter_pop_output_doc)
+    .add_property("buffered", &tabular_formatter::get_buffered, "Size of the output buffer")
+    ;
+}
@@ -0,0 +1,301 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#include <algo/blast/core/blast_hits.h>
+#include <algo/blast/core/gapinfo.h>
+
+#include "blast_hsp_rows.hpp"
+#include "blast_results.hpp"
+
+#include <boost/python.hpp>
+
+#include <algorithm>
+#include <map>
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+using namespace boost::python;
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// top_k_accumulator
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+// Keeps the best K HSPs of each query seen so far, together with their
+// gap edit scripts. HSPs are ranked by key (the smaller the better),
+// then by subject number and arrival order, so ties are broken in
+// favour of the first subjects.
+class top_k_accumulator {
+public:
+  top_k_accumulator(int k, const std::string& key) : _k(k), _num_queries(0), _order(0) {
+    if (k < 1) {
+      throw std::invalid_argument("k must be positive");
+    }
+    if (key == "evalue") {
+      _key = by_evalue;
+    } else if (key == "bit_score") {
+      _key = by_bit_score;
+    } else if (key == "score") {
+      _key = by_score;
+    } else {
+      throw std::invalid_argument("key must be one of 'evalue', 'bit_score', 'score'");
+    }
+  }
+
+  // Offer all HSPs of hsp_list, found on subject number subject_no.
+  // Returns the number of HSPs kept.
+  int add_hsp_list(const BlastHSPList* hsp_list, Int4 subject_no) {
+    if (hsp_list->query_index >= Int4(_heaps.size())) {
+      _heaps.resize(hsp_list->query_index + 1);
+      note_queries(hsp_list->query_index + 1);
+    }
+    std::vector<entry>& heap = _heaps[hsp_list->query_index];
+    int kept = 0;
+    for (int i = 0; i < hsp_list->hspcnt; ++i) {
+      const BlastHSP* hsp = hsp_list->hsp_array[i];
+      entry e;
+      e.key = get_key(hsp);
+      e.subject_no = subject_no;
+      e.order = _order++;
+      if (int(heap.size()) == _k) {
+	if (!better(e, heap.front())) {
+	  continue;
+	}
+	std::pop_heap(heap.begin(), heap.end(), better);
+	release(heap.back().subject_no);
+	heap.pop_back();
+      }
+      fill_hsp_row(e.row, hsp_list, hsp);
+      e.row.subject_oid = subject_no;
+      const GapEditScript* g = hsp->gap_info;
+      if (g != NULL) {
+	e.ops.assign(g->op_type, g->op_type + g->size);
+	e.nums.assign(g->num, g->num + g->size);
+      }
+      heap.push_back(e);
+      std::push_heap(heap.begin(), heap.end(), better);
+      ++_held[subject_no];
+      ++kept;
+    }
+    return kept;
+  }
+
+  int add_results(const BlastHSPResults* r, Int4 subject_no) {
+    int kept = 0;
+    if (r == NULL) {
+      return kept;
+    }
+    note_queries(r->num_queries);
+    for (int i = 0; i < r->num_queries; ++i) {
+      const BlastHitList* hit_list = r->hitlist_array[i];
+      for (int j = 0; hit_list != NULL && j < hit_list->hsplist_count; ++j) {
+	kept += add_hsp_list(hit_list->hsplist_array[j], subject_no);
+      }
+    }
+    return kept;
+  }
+
+  void note_queries(Int4 num_queries) {
+    _num_queries = std::max(_num_queries, num_queries);
+  }
+
+  // The key value an HSP must beat to enter the best K of every query,
+  // None until all queries have K HSPs.
+  object threshold() const {
+    if (_num_queries == 0 || int(_heaps.size()) < _num_queries) {
+      return object();
+    }
+    double worst = 0;
+    for (int q = 0; q < _num_queries; ++q) {
+      if (int(_heaps[q].size()) < _k) {
+	return object();
+      }
+      if (q == 0 || _heaps[q].front().key > worst) {
+	worst = _heaps[q].front().key;
+      }
+    }
+    switch (_key) {
+    case by_bit_score: return object(-worst);
+    case by_score:     return object(int(-worst));
+    default:           return object(worst);
+    }
+  }
+
+  // Subject numbers that no longer have any HSP among the best ones
+  // since the last call.
+  list pop_evicted() {
+    list l;
+    for (std::size_t i = 0; i < _evicted.size(); ++i) {
+      if (_held.find(_evicted[i]) == _held.end()) {
+	l.append(_evicted[i]);
+      }
+    }
+    _evicted.clear();
+    return l;
+  }
+
+  // The best HSPs of each query, best first.
+  blast_results_snapshot* snapshot() const {
+    std::auto_ptr<blast_results_snapshot> s(new blast_results_snapshot());
+    s->num_queries = _num_queries;
+    for (int q = 0; q < _num_queries; ++q) {
+      if (q < int(_heaps.size())) {
+	std::vector<entry> sorted(_heaps[q]);
+	std::sort(sorted.begin(), sorted.end(), better);
+	for (std::size_t i = 0; i < sorted.size(); ++i) {
+	  const entry& e = sorted[i];
+	  s->rows.push_back(e.row);
+	  s->gap_ops.insert(s->gap_ops.end(), e.ops.begin(), e.ops.end());
+	  s->gap_nums.insert(s->gap_nums.end(), e.nums.begin(), e.nums.end());
+	  s->gap_start.push_back(s->gap_ops.size());
+	}
+      }
+      s->query_start.push_back(s->rows.size());
+    }
+    return s.release();
+  }
+
+  int get_k() const { return _k; }
+
+  int get_len() const {
+    int n = 0;
+    for (std::size_t i = 0; i < _heaps.size(); ++i) {
+      n += _heaps[i].size();
+    }
+    return n;
+  }
+
+private:
+  enum key_type {
+    by_evalue,
+    by_bit_score,
+    by_score
+  };
+
+  struct entry {
+    double            key;
+    Int4              subject_no;
+    long              order;
+    hsp_row           row;
+    std::vector<Int4> ops;
+    std::vector<Int4> nums;
+  };
+
+  // true if a ranks before b (heaps keep the worst entry on top)
+  static bool better(const entry& a, const entry& b) {
+    if (a.key != b.key) {
+      return a.key < b.key;
+    }
+    if (a.subject_no != b.subject_no) {
+      return a.subject_no < b.subject_no;
+    }
+    return a.order < b.order;
+  }
+
+  double get_key(const BlastHSP* hsp) const {
+    switch (_key) {
+    case by_bit_score: return -hsp->bit_score;
+    case by_score:     return -hsp->score;
+    default:           return hsp->evalue;
+    }
+  }
+
+  void release(Int4 subject_no) {
+    std::map<Int4, int>::iterator i = _held.find(subject_no);
+    if (--(i->second) == 0) {
+      _held.erase(i);
+      _evicted.push_back(subject_no);
+    }
+  }
+
+  int                             _k;
+  key_type                        _key;
+  Int4                            _num_queries;
+  long                            _order;
+  std::vector<std::vector<entry> > _heaps;
+  std::map<Int4, int>             _held;
+  std::vector<Int4>               _evicted;
+};
+
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+// Python interface
+//+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+struct top_k_accumulator_wrapper {
+  static int add_view(top_k_accumulator& t, const blast_results_view& v, Int4 subject_no) {
+    return t.add_results(v.results(), subject_no);
+  }
+
+  // results laid out as by blaster.blast_batch: one item per query,
+  // either None or a sequence of BlastHSPList
+  static int add_list(top_k_accumulator& t, const object& results, Int4 subject_no) {
+    int kept = 0;
+    std::size_t n = len(results);
+    t.note_queries(n);
+    for (std::size_t i = 0; i < n; ++i) {
+      object hit_list = results[i];
+      if (hit_list.is_none()) {
+	continue;
+      }
+      std::size_t m = len(hit_list);
+      for (std::size_t j = 0; j < m; ++j) {
+	const BlastHSPList* hsp_list = extract<const BlastHSPList*>(hit_list[j]);
+	kept += t.add_hsp_list(hsp_list, subject_no);
+      }
+    }
+    return kept;
+  }
+};
+
+static const char top_k_accumulator_add_doc[] = "add(RESULTS, SUBJECT_NO)\n\
+ Offer the HSPs in RESULTS (a BlastResults view, or a list laid out as the results\n\
+ of blaster.blast_batch) found on the subject numbered SUBJECT_NO. Returns the number\n\
+ of HSPs that made it into the best K of their query.";
+
+static const char top_k_accumulator_pop_evicted_doc[] = "pop_evicted()\n\
+ Returns the subject numbers that lost all their HSPs since the last call.";
+
+static const char top_k_accumulator_threshold_doc[] = "threshold()\n\
+ The evalue (or score, or bit score, depending on KEY) an HSP must beat to make it\n\
+ into the best K of any query. None until every query has K HSPs.";
+
+static const char top_k_accumulator_snapshot_doc[] = "snapshot()\n\
+ Returns the best HSPs of each query, best first, as a BlastResultsSnapshot whose\n\
+ subject_oid fields hold subject numbers.";
+
+void export_blast_top_k()
+{
+  class_<top_k_accumulator>("top_k_accumulator",
+			    "Keeps the best K HSPs of each query across many searches",
+			    init<int, std::string>("top_k_accumulator(K, KEY): KEY is 'evalue',"
+						   " 'bit_score' or 'score'.")
+			    )
+    // overloads are tried in reverse order: the generic one goes first
+    .def("add", &top_k_accumulator_wrapper::add_list, top_k_accumulator_add_doc)
+    .def("add", &top_k_accumulator_wrapper::add_view, top_k_accumulator_add_doc)
+    .def("threshold", &top_k_accumulator::threshold, top_k_accumulator_threshold_doc)
+    .def("pop_evicted", &top_k_accumulator::pop_evicted, top_k_accumulator_pop_evicted_doc)
+    .def("snapshot", &top_k_accumulator::snapshot, return_value_policy<manage_new_object>(),
+	 top_k_accumulator_snapshot_doc)
+    .def("__len__", &top_k_accumulator::get_len)
+    .add_property("k", &top_k_accumulator::get_k)
+    ;
+}
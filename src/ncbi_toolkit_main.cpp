@@ -25,6 +25,13 @@ void export_blast_sseq_factories();
 void export_blast_blast2seq();
 void export_blast_diagnostics();
 void export_blast_hits();
+void export_blast_kmer_filter();
+void export_blast_results();
+void export_blast_match_endpoints();
+void export_blast_top_k();
+void export_blast_tabular();
+void export_blast_interval_index();
+void export_blast_predicate();
 BOOST_PYTHON_MODULE(ncbi_toolkit){
 export_blast_options();
 export_blast_sseq();
@@ -32,4 +39,11 @@ export_blast_sseq_factories();
 export_blast_blast2seq();
 export_blast_diagnostics();
 export_blast_hits();
+export_blast_kmer_filter();
+export_blast_results();
+export_blast_match_endpoints();
+export_blast_top_k();
+export_blast_tabular();
+export_blast_interval_index();
+export_blast_predicate();
 }
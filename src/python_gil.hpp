@@ -0,0 +1,43 @@
+// BEGIN_COPYRIGHT
+// 
+// Copyright (C) 2014 CRS4.
+// 
+// This file is part of blast-python.
+// 
+// blast-python is free software: you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by the Free
+// Software Foundation, either version 3 of the License, or (at your option)
+// any later version.
+// 
+// blast-python is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+// FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+// more details.
+// 
+// You should have received a copy of the GNU General Public License along
+// with blast-python.  If not, see <http://www.gnu.org/licenses/>.
+// 
+// END_COPYRIGHT
+#ifndef _PYTHON_GIL_HPP_
+#define _PYTHON_GIL_HPP_
+
+#include <Python.h>
+
+// Releases the GIL for the lifetime of the object. The GIL is taken back
+// in the destructor, so it is also restored when the guarded code throws
+// (boost.python needs it to translate the exception).
+//
+// Code run while the GIL is released must not touch Python objects.
+class scoped_gil_release {
+public:
+  scoped_gil_release() : _state(PyEval_SaveThread()) {}
+  ~scoped_gil_release() { PyEval_RestoreThread(_state); }
+
+private:
+  scoped_gil_release(const scoped_gil_release&);
+  scoped_gil_release& operator=(const scoped_gil_release&);
+
+  PyThreadState* _state;
+};
+
+#endif // _PYTHON_GIL_HPP_
@@ -28,12 +28,16 @@
 ### evalues.
 
 
-import unittest, os, copy
+import unittest, os, copy, cPickle, string, struct
+from cStringIO import StringIO
 from itertools import izip
 from operator import attrgetter, itemgetter
 
 import ncbi_toolkit
-from BlastPython import blaster
+from BlastPython import blaster, parallel_blaster, blast_result_stream
+from BlastPython import query_cache, default_query_cache
+from BlastPython import hsp_records, HSP_FIELDS
+from BlastPython import match_endpoints, tabular_writer
 
 
 # possible values: both_rev, plus, minus, unknown, other, both
@@ -555,10 +559,406 @@ class tblastx_tc_multi_both(blast_tc_multi_both, unittest.TestCase):
         self.test_all_hits(diagonal=True)
 
 
+def get_hsp_data(r):
+    hit_list = r[0]
+    if hit_list is None:
+        return []
+    return sorted([(hsp.score, hsp.query, hsp.subject)
+                   for hsp in hit_list[0]])
+
+
+def count_columns(hsp, q_seqs=None, s_seq=None):
+    """
+    (alignment length, identities, mismatches, gap openings) of a
+    blastn hsp, counted by walking its edit script over the aligned
+    residues (q_seqs maps query frames to the query strands), or only
+    over its operations, taking identities from hsp, if no sequences
+    are given.
+    """
+    op_type = ncbi_toolkit.EGapAlignOpType
+    q_frame, q_pos, q_end, _ = hsp.query
+    s_frame, s_pos, s_end, _ = hsp.subject
+    g = hsp.get_gap_info()
+    if g is None:
+        ops = [(op_type.eGapAlignSub, q_end - q_pos)]
+    else:
+        ops = list(g)
+    align_len = ident = subs = gap_opens = 0
+    for t, n in ops:
+        align_len += n
+        if t == op_type.eGapAlignSub:
+            subs += n
+            if q_seqs is not None:
+                ident += len([1 for a, c in zip(q_seqs[q_frame][q_pos:q_pos+n],
+                                                s_seq[s_pos:s_pos+n])
+                              if a == c])
+            q_pos += n
+            s_pos += n
+        elif t == op_type.eGapAlignDel:
+            gap_opens += 1
+            s_pos += n
+        elif t == op_type.eGapAlignIns:
+            gap_opens += 1
+            q_pos += n
+        else:
+            raise ValueError("unexpected op: %s" % t)
+    if q_seqs is None:
+        ident = hsp.num_ident
+    else:
+        assert (q_pos, s_pos) == (q_end, s_end)
+    return align_len, ident, subs - ident, gap_opens
+
+
+def get_strands(seq):
+    complement = string.maketrans('ACGTNacgtn', 'TGCANtgcan')
+    plus = seq.get_sequence().upper()
+    return {1: plus, -1: plus.translate(complement)[::-1]}
+
+
+# evalue and bit score formatting rules of the blast command line tools
+def format_evalue(evalue):
+    if evalue < 1.0e-180:
+        return "0.0"
+    for limit, fmt in ((1.0e-99, "%2.0e"), (0.0009, "%3.0e"), (0.1, "%4.3f"),
+                       (1.0, "%3.2f"), (10.0, "%2.1f")):
+        if evalue < limit:
+            return fmt % evalue
+    return "%5.0f" % evalue
+
+
+def format_bit_score(bit_score):
+    if bit_score > 9999:
+        return "%4.3e" % bit_score
+    if bit_score > 99.9:
+        return "%d" % int(bit_score)
+    return "%2.1f" % bit_score
+
+
+class parallel_blaster_tc(unittest.TestCase):
+
+    def setUp(self):
+        self.sequences = sequences
+        self.blast_options = {'Program': ncbi_toolkit.EProgram.eBlastn,
+                              'MatchReward': 1}
+
+    def get_exp_results(self, query):
+        b = blaster(query, **self.blast_options)
+        return [get_hsp_data(b.blast(s)[1]) for s in self.sequences]
+
+    def check_results(self, results, exp_results):
+        results = [(subject, get_hsp_data(r)) for subject, r in results]
+        self.assertEqual([s for s, _ in results], self.sequences)
+        self.assertEqual([d for _, d in results], exp_results)
+
+    def test_blast_many(self):
+        for query in self.sequences:
+            exp_results = self.get_exp_results(query)
+            pb = parallel_blaster(query, workers=3, **self.blast_options)
+            self.check_results(pb.blast_many(self.sequences), exp_results)
+
+    def test_batched_stream(self):
+        max_residues = sum([len(s) for s in self.sequences]) / 2
+        for query in self.sequences:
+            exp_results = self.get_exp_results(query)
+            b = blaster(query, **self.blast_options)
+            for batch_size, max_res in (2, 0), (0, max_residues):
+                stream = blast_result_stream(b, iter(self.sequences),
+                                             batch_size, max_res)
+                self.check_results(stream, exp_results)
+
+
+class query_cache_tc(unittest.TestCase):
+
+    def setUp(self):
+        self.sequences = sequences
+        self.blast_options = {'Program': ncbi_toolkit.EProgram.eBlastn,
+                              'MatchReward': 1}
+
+    def test_reuse(self):
+        cache = query_cache()
+        query = self.sequences[0]
+        b = blaster(query, cache=cache, **self.blast_options)
+        exp_results = [get_hsp_data(b.blast(s)[1]) for s in self.sequences]
+        engine = b.blast_engine
+        b.close()
+        self.assertEqual(len(cache), 1)
+        b = blaster(query, cache=cache, **self.blast_options)
+        self.assertTrue(b.blast_engine is engine)
+        self.assertTrue(b.query_already_setup)
+        self.assertEqual(len(cache), 0)
+        results = [get_hsp_data(b.blast(s)[1]) for s in self.sequences]
+        self.assertEqual(results, exp_results)
+
+    def test_default_cache(self):
+        default_query_cache.clear()
+        try:
+            b = blaster(self.sequences[0], **self.blast_options)
+            self.assertTrue(b.cache is default_query_cache)
+            b.blast(self.sequences[1])
+            engine = b.blast_engine
+            b.close()
+            self.assertEqual(len(default_query_cache), 1)
+            b = blaster(self.sequences[0], **self.blast_options)
+            self.assertTrue(b.blast_engine is engine)
+            self.assertTrue(b.query_already_setup)
+            b.close()
+            b = blaster(self.sequences[0], cache=False, **self.blast_options)
+            self.assertTrue(b.cache is None)
+            b.blast(self.sequences[1])
+            b.close()
+            self.assertEqual(len(default_query_cache), 1)
+        finally:
+            default_query_cache.clear()
+
+    def test_changed_options(self):
+        cache = query_cache()
+        b = blaster(self.sequences[0], cache=cache, **self.blast_options)
+        b.blast(self.sequences[1])
+        b.set_options()['EvalueThreshold'] = 1e-3
+        b.close()
+        self.assertEqual(len(cache), 0)
+
+
+class results_arrays_tc(unittest.TestCase):
+
+    def setUp(self):
+        self.sequences = sequences
+        self.blast_options = {'Program': ncbi_toolkit.EProgram.eBlastn,
+                              'MatchReward': 1}
+
+    def test_results_arrays(self):
+        for query in self.sequences[:2]:
+            b = blaster(query, **self.blast_options)
+            for s in self.sequences:
+                r = b.blast(s)[1]
+                a = b.blast_engine.GetResultsArrays()
+                self.assertEqual(a.dtype.names, HSP_FIELDS)
+                self.assertEqual(a.tolist(), hsp_records(r))
+
+
+class results_view_tc(unittest.TestCase):
+
+    def setUp(self):
+        self.sequences = sequences
+        self.blast_options = {'Program': ncbi_toolkit.EProgram.eBlastn,
+                              'MatchReward': 1}
+
+    def test_results_view(self):
+        b = blaster(self.sequences, **self.blast_options)
+        for s in self.sequences:
+            results = b.blast(s)[1]
+            self.assertEqual(len(results), len(self.sequences))
+            hit_lists = list(results)
+            self.assertEqual(len(hit_lists), len(results))
+            self.assertEqual([r is None for r in hit_lists],
+                             [results[i] is None for i in xrange(len(results))])
+            self.assertEqual([i for i, _ in results.iter_nonempty()],
+                             [i for i, r in enumerate(hit_lists)
+                              if r is not None and len(r) > 0])
+        b.blast(self.sequences[0])
+        self.assertRaises(RuntimeError, len, results)
+
+    def test_snapshot(self):
+        b = blaster(self.sequences, **self.blast_options)
+        snapshots = []
+        for s in self.sequences:
+            results = b.blast(s)[1]
+            snapshots.append((results.snapshot(), hsp_records(results)))
+        for snapshot, exp_records in snapshots:
+            self.assertEqual(snapshot.num_queries, len(self.sequences))
+            for s in snapshot, cPickle.loads(cPickle.dumps(snapshot, 2)):
+                records = [(h.query_index, h.subject_oid, h.score,
+                            h.bit_score, h.evalue, h.num_ident) +
+                           h.query + h.subject + (h.context,) +
+                           h.alignment_stats for h in s]
+                self.assertEqual(records, exp_records)
+                self.assertEqual(sum([len(s.for_query(i))
+                                      for i in xrange(s.num_queries)]),
+                                 len(s))
+
+    def test_cigars(self):
+        cigar_ops = {
+            ncbi_toolkit.EGapAlignOpType.eGapAlignSub: "M",
+            ncbi_toolkit.EGapAlignOpType.eGapAlignDel: "D",
+            ncbi_toolkit.EGapAlignOpType.eGapAlignIns: "I",
+            }
+        b = blaster(self.sequences[0], **self.blast_options)
+        for s in self.sequences:
+            r = b.blast(s)[1]
+            cigars = []
+            for _, hit_list in r.iter_nonempty():
+                for hsp in hit_list[0]:
+                    g = hsp.get_gap_info()
+                    if g is None:
+                        cigars.append("%dM" % (hsp.query[2] - hsp.query[1]))
+                        continue
+                    ops = list(g)
+                    op_type, num = g.as_arrays()
+                    self.assertEqual(zip(op_type.tolist(), num.tolist()),
+                                     [(int(t), n) for t, n in ops])
+                    cigar = "".join(["%d%s" % (n, cigar_ops[t])
+                                     for t, n in ops])
+                    self.assertEqual(g.cigar(), cigar)
+                    cigars.append(cigar)
+            self.assertEqual(r.cigars(), cigars)
+            self.assertEqual(r.snapshot().cigars(), cigars)
+
+    def test_gap_arrays_copied(self):
+        b = blaster(self.sequences[0], **self.blast_options)
+        arrays = []
+        for s in self.sequences:
+            r = b.blast(s)[1]
+            for _, hit_list in r.iter_nonempty():
+                for hsp in hit_list[0]:
+                    g = hsp.get_gap_info()
+                    if g is not None:
+                        arrays.append((list(g), g.as_arrays()))
+        self.assertTrue(arrays)
+        # the engine results have been freed by the following searches
+        b.blast(self.sequences[0])
+        for ops, (op_type, num) in arrays:
+            self.assertEqual(zip(op_type.tolist(), num.tolist()),
+                             [(int(t), n) for t, n in ops])
+
+    def test_cigars_decline(self):
+        # declined (non-aligned) regions advance both sequences
+        op_type = ncbi_toolkit.EGapAlignOpType
+        b = blaster(self.sequences[0], **self.blast_options)
+        snapshot = b.blast(self.sequences[0])[1].snapshot()
+        state = snapshot.__getstate__()
+        n = len(snapshot)
+        for ops, exp_cigar in (
+            ([(op_type.eGapAlignSub, 5), (op_type.eGapAlignDecline, 3),
+              (op_type.eGapAlignSub, 4)], "5M3I3D4M"),
+            ([(op_type.eGapAlignSub, 5), (op_type.eGapAlignIns, 2),
+              (op_type.eGapAlignDecline, 3), (op_type.eGapAlignDel, 1),
+              (op_type.eGapAlignSub, 4)], "5M5I4D4M"),
+            ):
+            gap_start = [0] + [len(ops)] * n
+            snapshot.__setstate__(state[:3] + (
+                struct.pack("%di" % len(gap_start), *gap_start),
+                struct.pack("%di" % len(ops), *[int(t) for t, _ in ops]),
+                struct.pack("%di" % len(ops), *[k for _, k in ops])))
+            self.assertEqual(snapshot.cigars()[0], exp_cigar)
+
+    def test_alignment_stats(self):
+        # count the columns of each alignment from the aligned residues
+        query = self.sequences[0]
+        q_seqs = get_strands(query)
+        b = blaster(query, **self.blast_options)
+        for s in self.sequences:
+            s_seq = get_strands(s)[1]
+            r = b.blast(s)[1]
+            for _, hit_list in r.iter_nonempty():
+                for hsp in hit_list[0]:
+                    self.assertEqual(hsp.subject[0], 1)
+                    align_len, ident, mismatches, gap_opens = count_columns(
+                        hsp, q_seqs, s_seq)
+                    self.assertEqual(hsp.num_ident, ident)
+                    self.assertEqual(hsp.alignment_stats[:3],
+                                     (align_len, mismatches, gap_opens))
+                    self.assertAlmostEqual(hsp.alignment_stats[3],
+                                           100.0 * ident / align_len)
+
+
+class match_endpoints_tc(unittest.TestCase):
+
+    def setUp(self):
+        self.sequences = sequences
+
+    def test_match_endpoints(self):
+        for progname in "blastn", "tblastx":
+            program = get_program(progname)
+            query = self.sequences[0]
+            b = blaster(query, Program=program, MatchReward=1)
+            for s in self.sequences:
+                r = b.blast(s)[1]
+                exp_endpoints = [get_match_endpoints(
+                    hsp.query, hsp.subject, query.length, s.length, progname
+                    ) for hsp in r.snapshot()]
+                for hsps in r, r.snapshot():
+                    endpoints = match_endpoints(hsps, program, query, s)
+                    self.assertEqual([tuple(e) for e in endpoints.tolist()],
+                                     exp_endpoints)
+
+
+class tabular_writer_tc(unittest.TestCase):
+
+    def setUp(self):
+        self.sequences = sequences
+
+    def test_tabular_writer(self):
+        columns = ('qseqid', 'sseqid', 'pident', 'length', 'mismatch',
+                   'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue',
+                   'bitscore', 'score', 'nident')
+        for progname in "blastn", "tblastx":
+            program = get_program(progname)
+            query = self.sequences[0]
+            q_seqs = get_strands(query) if progname == "blastn" else None
+            b = blaster(query, Program=program, MatchReward=1)
+            exp_lines = []
+            for s in self.sequences:
+                s_seq = get_strands(s)[1] if progname == "blastn" else None
+                r = b.blast(s)[1]
+                for hsp in r.snapshot():
+                    align_len, ident, mismatches, gap_opens = count_columns(
+                        hsp, q_seqs, s_seq)
+                    exp_lines.append("\t".join(
+                        [query.id, s.id, "%.2f" % (100.0 * ident / align_len)] +
+                        map(str, (align_len, mismatches, gap_opens) +
+                            get_match_endpoints(hsp.query, hsp.subject,
+                                                query.length, s.length,
+                                                progname)) +
+                        [format_evalue(hsp.evalue),
+                         format_bit_score(hsp.bit_score),
+                         str(hsp.score), str(ident)]))
+            self.assertTrue(exp_lines)
+            for comments in False, True:
+                fp = StringIO()
+                writer = tabular_writer(fp, columns, program, comments,
+                                        buffer_size=100)
+                writer.consume(query, blast_result_stream(
+                    b, iter(self.sequences)))
+                lines = fp.getvalue().splitlines()
+                if comments:
+                    self.assertEqual(len([l for l in lines
+                                          if l.startswith('# Query: ')]),
+                                     len(self.sequences))
+                self.assertEqual([l for l in lines if not l.startswith('#')],
+                                 exp_lines)
+
+    def test_number_formats(self):
+        # sample values from the blast command line tools' output
+        for evalue, exp in ((0.0, "0.0"), (1e-200, "0.0"), (3e-120, "3e-120"),
+                            (2.5e-30, "2e-30"), (0.00085, "8e-04"),
+                            (0.0123, "0.012"), (0.25, "0.25"), (3.14, "3.1"),
+                            (123.4, "  123")):
+            self.assertEqual(format_evalue(evalue), exp)
+        for bit_score, exp in ((12345.6, "1.235e+04"), (523.7, "523"),
+                               (99.94, "99"), (99.9, "99.9"),
+                               (42.05, "42.0")):
+            self.assertEqual(format_bit_score(bit_score), exp)
+
+
 def suite():
     suite = unittest.TestSuite()
     
     suite.addTest(set_options_tc('test_set_options'))
+    suite.addTest(parallel_blaster_tc('test_blast_many'))
+    suite.addTest(parallel_blaster_tc('test_batched_stream'))
+    suite.addTest(query_cache_tc('test_reuse'))
+    suite.addTest(query_cache_tc('test_default_cache'))
+    suite.addTest(query_cache_tc('test_changed_options'))
+    suite.addTest(results_arrays_tc('test_results_arrays'))
+    suite.addTest(results_view_tc('test_results_view'))
+    suite.addTest(results_view_tc('test_snapshot'))
+    suite.addTest(results_view_tc('test_cigars'))
+    suite.addTest(results_view_tc('test_cigars_decline'))
+    suite.addTest(results_view_tc('test_gap_arrays_copied'))
+    suite.addTest(results_view_tc('test_alignment_stats'))
+    suite.addTest(match_endpoints_tc('test_match_endpoints'))
+    suite.addTest(tabular_writer_tc('test_tabular_writer'))
+    suite.addTest(tabular_writer_tc('test_number_formats'))
     
     suite.addTest(blastn_tc('test_blastn_no_diagonal_n_hits'))
     suite.addTest(blastn_tc('test_blastn_no_diagonal_all_hits'))
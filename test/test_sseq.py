@@ -94,6 +94,191 @@ class sseq_from_fasta_tc(sseq_tc):
                 )))
 
 
+# all sequences have the same id, and each is made after a sequence
+# that is dropped right away, so that the scope pool (which holds at
+# most 3 entries per scope) has to both recycle and replace scopes.
+class sseq_from_str_pooled_tc(sseq_tc):
+    def setUp(self):
+        factory = ncbi_toolkit.blast_sseq_loc_from_str()
+        factory.set_scope_pool(3, 0)
+        self.sseqs = []
+        for i in xrange(M):
+            factory.make(make_seq(N), False, GID_OFFSET, 'dropped',
+                         ncbi_toolkit.strand.plus, 0, 0)
+            t = (make_seq(N),  False, GID_OFFSET, 'title %s' % i,
+                 random.choice(
+                     [ncbi_toolkit.strand.plus, ncbi_toolkit.strand.minus]
+                     ), 0, 0)
+            self.sseqs.append(
+                (t, factory.make(t[0], t[1], t[2], t[3], t[4], t[5], t[6]))
+                )
+
+
+class sseq_from_fasta_pooled_tc(sseq_tc):
+    def setUp(self):
+        factory = ncbi_toolkit.blast_sseq_loc_from_fasta()
+        factory.set_scope_pool(3, 4 * N)
+        self.sseqs = []
+        for i in xrange(M):
+            factory.make('>gi|%s dropped\n%s' % (GID_OFFSET, make_seq(N)),
+                         ncbi_toolkit.strand.plus, 0, 0, False)
+            t = (make_seq(N), False, GID_OFFSET, 'title %s' % i,
+                 random.choice(
+                     [ncbi_toolkit.strand.plus, ncbi_toolkit.strand.minus]
+                     ), 0, 0)
+            self.sseqs.append((t, factory.make(
+                '>gi|%s %s \n%s' % (t[2], t[3], t[0]), t[4], t[5], t[6], False
+                )))
+
+
+class scope_pool_tc(unittest.TestCase):
+    def test_sweep(self):
+        # a, b and c share a scope; making d once b is gone sweeps it
+        # out of that scope, which must leave a and c usable
+        factory = ncbi_toolkit.blast_sseq_loc_from_str()
+        factory.set_scope_pool(3, 0)
+        seqs = [make_seq(N) for _ in xrange(5)]
+        sseqs = [factory.make(seq, False, GID_OFFSET + i, 'title %d' % i,
+                              ncbi_toolkit.strand.plus, 0, 0)
+                 for i, seq in enumerate(seqs[:3])]
+        del sseqs[1]
+        kept = [0, 2]
+        for i in 3, 4:
+            sseqs.append(factory.make(seqs[i], False, GID_OFFSET + i,
+                                      'title %d' % i, ncbi_toolkit.strand.plus,
+                                      0, 0))
+            kept.append(i)
+            for k, s in zip(kept, sseqs):
+                self.assertEqual(s.id, 'gi|%d' % (GID_OFFSET + k))
+                self.assertEqual(s.title, 'title %d' % k)
+                self.assertEqual(s.get_sequence(), seqs[k])
+                self.assertEqual(s[1:5], seqs[k][1:5])
+
+
+class data_loaders_tc(unittest.TestCase):
+    def test_default(self):
+        self.assertTrue(ncbi_toolkit.get_default_data_loaders())
+        ncbi_toolkit.set_default_data_loaders(False)
+        try:
+            for factory in (ncbi_toolkit.blast_sseq_loc_from_str(),
+                            ncbi_toolkit.blast_sseq_loc_from_fasta()):
+                self.assertFalse(factory.use_data_loaders)
+        finally:
+            ncbi_toolkit.set_default_data_loaders(True)
+        self.assertTrue(ncbi_toolkit.blast_sseq_loc_from_str().use_data_loaders)
+
+    def test_local_only(self):
+        seq = make_seq(N)
+        for pool in None, (3, 0):
+            factory = ncbi_toolkit.blast_sseq_loc_from_str()
+            factory.use_data_loaders = False
+            if pool:
+                factory.set_scope_pool(*pool)
+            s = factory.make(seq, False, GID_OFFSET, 'title',
+                             ncbi_toolkit.strand.plus, 0, 0)
+            self.assertEqual(s.id, 'gi|%d' % GID_OFFSET)
+            self.assertEqual(s.title, 'title')
+            self.assertEqual(s.get_sequence(), seq)
+            factory = ncbi_toolkit.blast_sseq_loc_from_fasta()
+            factory.use_data_loaders = False
+            if pool:
+                factory.set_scope_pool(*pool)
+            s = factory.make('>gi|%d title\n%s' % (GID_OFFSET, seq),
+                             ncbi_toolkit.strand.plus, 0, 0, False)
+            self.assertEqual(s.id, 'gi|%d' % GID_OFFSET)
+            self.assertEqual(s.get_sequence(), seq)
+
+
+class make_many_tc(unittest.TestCase):
+    def setUp(self):
+        # two sequences with the same id, which cannot share a scope
+        self.records = [(GID_OFFSET + i % (M - 1), make_seq(N))
+                        for i in xrange(M)]
+
+    def check(self, sseqs, title=None):
+        self.assertEqual(len(sseqs), len(self.records))
+        for (gi, seq), s in zip(self.records, sseqs):
+            self.assertEqual(s.id, 'gi|%d' % gi)
+            self.assertEqual(s.get_sequence(), seq)
+            if title is not None:
+                self.assertEqual(s.title, title)
+
+    def test_str(self):
+        factory = ncbi_toolkit.blast_sseq_loc_from_str()
+        records = ['%d %s' % r for r in self.records]
+        buf = '\n'.join(records) + '\n'
+        for arg in records, buf, bytearray(buf):
+            self.check(factory.make_many(arg, False, 'title',
+                                         ncbi_toolkit.strand.plus), 'title')
+        self.assertEqual(factory.make_many([], False, 'title',
+                                           ncbi_toolkit.strand.plus), [])
+
+    def test_fasta(self):
+        factory = ncbi_toolkit.blast_sseq_loc_from_fasta()
+        records = ['>gi|%d title\n%s' % r for r in self.records]
+        buf = '\n'.join(records)
+        for arg in records, buf, bytearray(buf):
+            self.check(factory.make_many(arg, ncbi_toolkit.strand.plus,
+                                         0, 0, False))
+        self.assertRaises(TypeError, factory.make_many, unicode(buf),
+                          ncbi_toolkit.strand.plus, 0, 0, False)
+
+
+    def test_fasta_all(self):
+        records = [('>gi|%d title\n%s' % (GID_OFFSET + i, seq))
+                   for i, (_, seq) in enumerate(self.records)]
+        fasta = '\n'.join(records) + '\n'
+        factory = ncbi_toolkit.blast_sseq_loc_from_fasta()
+        exp = [(s.id, s.get_sequence()) for s in
+               [factory.make(fasta, i, ncbi_toolkit.strand.plus, 0, 0, False)
+                for i in xrange(len(records))]]
+        self.assertEqual([(s.id, s.get_sequence()) for s in factory.make_all(
+            fasta, ncbi_toolkit.strand.plus, False)], exp)
+        sseqs = factory.iter_all(fasta, ncbi_toolkit.strand.plus, False)
+        self.assertEqual([(s.id, s.get_sequence()) for s in sseqs], exp)
+        # records with the same id do not share a scope
+        fasta = '\n'.join(['>gi|%d title\n%s' % r for r in self.records])
+        self.check(list(factory.iter_all(fasta, ncbi_toolkit.strand.plus,
+                                         False)))
+
+
+    def test_fasta_buffers(self):
+        fasta = '\n'.join(['>gi|%d title\n%s' % (GID_OFFSET + i, seq)
+                           for i, (_, seq) in enumerate(self.records)])
+        factory = ncbi_toolkit.blast_sseq_loc_from_fasta()
+        exp = [(s.id, s.get_sequence()) for s in factory.make_all(
+            fasta, ncbi_toolkit.strand.plus, False)]
+        for buf in bytearray(fasta), buffer(fasta), memoryview(fasta):
+            self.assertEqual([(s.id, s.get_sequence()) for s in
+                              factory.make_all(buf, ncbi_toolkit.strand.plus,
+                                               False)], exp)
+            self.assertEqual([(s.id, s.get_sequence()) for s in
+                              factory.iter_all(buf, ncbi_toolkit.strand.plus,
+                                               False)], exp)
+            s = factory.make(buf, len(exp) - 1, ncbi_toolkit.strand.plus,
+                             0, 0, False)
+            self.assertEqual((s.id, s.get_sequence()), exp[-1])
+        # a buffer object cannot be locked: iter_all reads a copy
+        data = bytearray(fasta)
+        sseqs = factory.iter_all(buffer(data), ncbi_toolkit.strand.plus, False)
+        first = sseqs.next()
+        del data[:]
+        self.assertEqual([(s.id, s.get_sequence()) for s in [first] +
+                          list(sseqs)], exp)
+        # the buffer of a unicode object is not its text
+        self.assertRaises(TypeError, factory.make_all, unicode(fasta),
+                          ncbi_toolkit.strand.plus, False)
+        self.assertRaises(TypeError, factory.iter_all, unicode(fasta),
+                          ncbi_toolkit.strand.plus, False)
+        self.assertRaises(TypeError, factory.make, unicode(fasta), 0,
+                          ncbi_toolkit.strand.plus, 0, 0, False)
+        # a slice, parsed without copying it
+        tail = buffer(fasta, fasta.index('>', 1))
+        self.assertEqual([(s.id, s.get_sequence()) for s in
+                          factory.make_all(tail, ncbi_toolkit.strand.plus,
+                                           False)], exp[1:])
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(sseq_from_str_tc('test_id'))
@@ -111,6 +296,29 @@ def suite():
     suite.addTest(sseq_from_fasta_tc('test_seq'))
     suite.addTest(sseq_from_fasta_tc('test_strand'))
     suite.addTest(sseq_from_fasta_tc('test_slice'))
+    #--
+    suite.addTest(sseq_from_str_pooled_tc('test_id'))
+    suite.addTest(sseq_from_str_pooled_tc('test_title'))
+    suite.addTest(sseq_from_str_pooled_tc('test_len_by_len'))
+    suite.addTest(sseq_from_str_pooled_tc('test_len_by_length'))
+    suite.addTest(sseq_from_str_pooled_tc('test_seq'))
+    suite.addTest(sseq_from_str_pooled_tc('test_strand'))
+    suite.addTest(sseq_from_str_pooled_tc('test_slice'))
+    suite.addTest(sseq_from_fasta_pooled_tc('test_id'))
+    suite.addTest(sseq_from_fasta_pooled_tc('test_title'))
+    suite.addTest(sseq_from_fasta_pooled_tc('test_len_by_len'))
+    suite.addTest(sseq_from_fasta_pooled_tc('test_len_by_length'))
+    suite.addTest(sseq_from_fasta_pooled_tc('test_seq'))
+    suite.addTest(sseq_from_fasta_pooled_tc('test_strand'))
+    suite.addTest(sseq_from_fasta_pooled_tc('test_slice'))
+    #--
+    suite.addTest(scope_pool_tc('test_sweep'))
+    suite.addTest(data_loaders_tc('test_default'))
+    suite.addTest(data_loaders_tc('test_local_only'))
+    suite.addTest(make_many_tc('test_str'))
+    suite.addTest(make_many_tc('test_fasta'))
+    suite.addTest(make_many_tc('test_fasta_all'))
+    suite.addTest(make_many_tc('test_fasta_buffers'))
     #---
     return suite
 
@@ -49,6 +49,22 @@ for i in xrange(NITER):
         )
 print 'sseq construction (str)', (time.time() - start)/NITER
 
+factory_fasta.set_scope_pool(1000, 0)
+start = time.time()
+for i in xrange(NITER):
+    sseq = factory_fasta.make(
+        '>xxxx\n%s' % s, ncbi_toolkit.strand.plus, 0, 0, False
+        )
+print 'sseq construction (Fasta, pooled scopes) ', (time.time() - start)/NITER
+
+factory_str.set_scope_pool(1000, 0)
+start = time.time()
+for i in xrange(NITER):
+    sseq = factory_str.make(
+        s, False, 10022, 'title xxx', ncbi_toolkit.strand.plus, 0, 0
+        )
+print 'sseq construction (str, pooled scopes)', (time.time() - start)/NITER
+
 start = time.time()
 for i in xrange(NITER):
     sseq = factory_fasta.make_dummy(
@@ -19,7 +19,7 @@
 # 
 # END_COPYRIGHT
 
-import itertools, unittest
+import itertools, unittest, os
 from BlastPython import *
 from ncbi_toolkit import *
 
@@ -109,16 +109,426 @@ class streams_tc(unittest.TestCase):
             self.assertEqual(s[:-1], self.sseqs[counter][0])
             counter += 1
     def test_blast_seq_stream(self):
-        FS_OBJ = FS_IO(self.fname, 1000)
-        sf     = seq_factory_from_fasta(strand.unknown)
-        dbEST  = fasta_stream_from_stream(FS_OBJ)
-        seqEST = blast_seq_stream(sf, dbEST)
-        counter = 0
-        for s in seqEST:
-            self.assertEqual(s.get_sequence(), self.sseqs[counter][4])
-            self.assertEqual(s.id, self.sseqs[counter][1])
-            self.assertEqual(s.title, self.sseqs[counter][2])
-            counter += 1
+        for batch_size in 1, 3:
+            FS_OBJ = FS_IO(self.fname, 1000)
+            sf     = seq_factory_from_fasta(strand.unknown)
+            dbEST  = fasta_stream_from_stream(FS_OBJ)
+            seqEST = blast_seq_stream(sf, dbEST, batch_size)
+            counter = 0
+            for s in seqEST:
+                self.assertEqual(s.get_sequence(), self.sseqs[counter][4])
+                self.assertEqual(s.id, self.sseqs[counter][1])
+                self.assertEqual(s.title, self.sseqs[counter][2])
+                counter += 1
+            self.assertEqual(counter, len(self.sseqs))
+
+    def test_process_blast_result_stream(self):
+        spec = query_spec(self.sseqs[0][0], strand.both,
+                          Program=EProgram.eBlastn)
+        b = spec.make_blaster()
+        sf = seq_factory_from_fasta(strand.both)
+        exp_results = []
+        for s in self.sseqs:
+            subject, r = b.blast(sf.make(s[0]))
+            exp_results.append((subject.id, hsp_records(r)))
+        fsff = fasta_stream_from_stream(FS_IO(self.fname, 1000))
+        results = list(process_blast_result_stream(
+            spec, fsff, workers=2, batch_size=3
+            ))
+        self.assertEqual(results, exp_results)
+        # a consumer that stops early does not leave the workers running
+        fsff = fasta_stream_from_stream(FS_IO(self.fname, 1000))
+        stream = process_blast_result_stream(spec, fsff, workers=2,
+                                             batch_size=1)
+        processes = stream.processes[:]
+        for r in stream:
+            self.assertEqual(r, exp_results[0])
+            break
+        del stream
+        for p in processes:
+            self.assertFalse(p.is_alive())
+
+    def test_process_blast_result_stream_errors(self):
+        import signal
+        # a worker that fails reports its traceback
+        spec = query_spec(self.sseqs[0][0], strand.both,
+                          Program=EProgram.eBlastn, NoSuchOption=1)
+        fsff = fasta_stream_from_stream(FS_IO(self.fname, 1000))
+        stream = process_blast_result_stream(spec, fsff, workers=2)
+        self.assertRaises(RuntimeError, list, stream)
+        self.assertEqual(stream.processes, [])
+        # a worker that dies silently does not hang the stream
+        spec = query_spec(self.sseqs[0][0], strand.both,
+                          Program=EProgram.eBlastn)
+        fsff = fasta_stream_from_stream(FS_IO(self.fname, 1000))
+        stream = process_blast_result_stream(spec, fsff, workers=1)
+        os.kill(stream.processes[0].pid, signal.SIGKILL)
+        self.assertRaises(RuntimeError, list, stream)
+        self.assertEqual(stream.processes, [])
+
+    def test_kmer_prefilter(self):
+        sf = seq_factory_from_fasta(strand.both)
+        subjects = [sf.make(s[0]) for s in self.sseqs]
+        query = sf.make(">query\n" + "ACGT" * 50)
+        for q in query, subjects[0]:
+            b = blaster(q, Program=EProgram.eBlastn)
+            pf = kmer_prefilter(b, iter(subjects))
+            passed = list(pf)
+            self.assertEqual(pf.passed, len(passed))
+            self.assertEqual(pf.passed + pf.skipped, len(subjects))
+            for s in subjects:
+                _, r = b.blast(s)
+                if r[0] is not None:
+                    self.assertTrue(s in passed)
+        self.assertTrue(subjects[0] in passed)
+
+    def test_top_k_sink(self):
+        sf = seq_factory_from_fasta(strand.both)
+        subjects = [sf.make(s[0]) for s in self.sseqs]
+        b = blaster(subjects[0], Program=EProgram.eBlastn)
+        all_hsps = []
+        for n, s in enumerate(subjects):
+            _, r = b.blast(s)
+            all_hsps.extend([(hsp.evalue, n, i, s.id)
+                             for i, hsp in enumerate(r.snapshot())])
+        all_hsps.sort()
+        for k in 1, 3, len(all_hsps) + 1:
+            sink = top_k_sink(k).consume(blast_result_stream(b, iter(subjects)))
+            results = sink.get_results()
+            self.assertEqual(len(results), 1)
+            self.assertEqual([(hsp.evalue, subject_id)
+                              for subject_id, hsp in results[0]],
+                             [(e, i) for e, _, _, i in all_hsps[:k]])
+            self.assertTrue(len(sink.metadata) <= k)
+
+    def test_adaptive_top_k_sink(self):
+        sf = seq_factory_from_fasta(strand.both)
+        subjects = [sf.make(s[0]) for s in self.sseqs] * 2
+        for key in 'evalue', 'score':
+            b = blaster(subjects[0], Program=EProgram.eBlastn)
+            threshold = b.get_options()['EvalueThreshold']
+            results = []
+            for adaptive in False, True:
+                sink = top_k_sink(2, key)
+                stats = sink.run(b, iter(subjects), adaptive)
+                self.assertEqual(stats['before']['searches'] +
+                                 stats['after']['searches'], len(subjects))
+                results.append([[(i, hsp.score, hsp.evalue) for i, hsp in q]
+                                for q in sink.get_results()])
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(b.get_options()['EvalueThreshold'], threshold)
+
+    def test_results_io(self):
+        from BlastPython import results_io
+        import numpy
+        sf = seq_factory_from_fasta(strand.both)
+        subjects = [sf.make(s[0]) for s in self.sseqs]
+        query = subjects[0]
+        b = blaster(query, Program=EProgram.eBlastn)
+        exp_rows, exp_ids = [], []
+        for s in subjects:
+            _, r = b.blast(s)
+            rows = results_array(r)
+            exp_rows.append(rows)
+            exp_ids.extend([(query.id, s.id)] * len(rows))
+        exp_rows = numpy.concatenate(exp_rows)
+        fname = 'results_io_test.bin'
+        try:
+            for run in 1, 2:
+                w = results_io.results_writer(fname, chunk_rows=3)
+                w.consume(query, blast_result_stream(b, iter(subjects)))
+                w.close()
+                # an interrupted chunk
+                fp = open(fname, 'ab')
+                fp.write(results_io.CHUNK_HEADER.pack('CHNK', 10, 1, 5))
+                fp.close()
+            reader = results_io.results_reader(fname)
+            self.assertEqual(reader.n_rows, 2 * len(exp_rows))
+            for name in exp_rows.dtype.names:
+                self.assertEqual(reader.column(name).tolist(),
+                                 exp_rows[name].tolist() * 2)
+            ids = []
+            for chunk in reader:
+                ids.extend([(chunk.strings[q], chunk.strings[s]) for q, s in
+                            zip(chunk['query_id'], chunk['subject_id'])])
+            self.assertEqual(ids, exp_ids * 2)
+            reader.close()
+            # a file truncated within the column table
+            from StringIO import StringIO
+            fp = open(fname, 'rb')
+            data = fp.read(results_io.FILE_HEADER.size +
+                           results_io.COLUMN_DESC.size / 2)
+            fp.close()
+            self.assertRaises(ValueError, results_io.read_header,
+                              StringIO(data))
+        finally:
+            os.remove(fname)
+
+    def test_interval_index(self):
+        sf = seq_factory_from_fasta(strand.both)
+        subjects = [sf.make(s[0]) for s in self.sseqs]
+        query = subjects[0]
+        b = blaster(query, Program=EProgram.eBlastn)
+        hsps = []
+        for n, s in enumerate(subjects):
+            _, r = b.blast(s)
+            for e, hsp in zip(match_endpoints(r, EProgram.eBlastn, query, s),
+                              r.snapshot()):
+                hsps.append((min(e[0], e[1]), max(e[0], e[1]), hsp.score))
+        index = interval_index(query).consume(
+            blast_result_stream(b, iter(subjects)))
+        self.assertEqual(len(index), len(hsps))
+        self.assertEqual([index.get_interval(i)[1:] for i in xrange(len(hsps))],
+                         [h[:2] for h in hsps])
+        covered = set()
+        for start, end, _ in hsps:
+            covered.update(xrange(start, end + 1))
+        self.assertEqual(index.coverage(0), len(covered))
+        self.assertEqual(index.coverage(0, 0, 0), 0)
+        self.assertEqual(index.coverage(0, 0, 10),
+                         len([p for p in covered if p <= 10]))
+        self.assertEqual(index.coverage(0, end=10),
+                         len([p for p in covered if p <= 10]))
+        self.assertEqual(index.coverage(0, 10),
+                         len([p for p in covered if p >= 10]))
+        for start, end in (1, 10), (50, 200), (100, 100), (1, query.length):
+            self.assertEqual(
+                index.overlapping(0, start, end),
+                [i for i, h in enumerate(hsps) if h[0] <= end and h[1] >= start])
+            self.assertEqual(
+                index.within(0, start, end),
+                [i for i, h in enumerate(hsps) if h[0] >= start and h[1] <= end])
+            self.assertEqual(
+                index.containing(0, start, end),
+                [i for i, h in enumerate(hsps) if h[0] <= start and h[1] >= end])
+            self.assertEqual(index.coverage(0, start, end),
+                             len([p for p in covered if start <= p <= end]))
+        self.assertEqual(index.overlapping(1, 1, query.length), [])
+        # culling, brute force
+        for limit in 1, 2:
+            kept = []
+            order = sorted(xrange(len(hsps)), key=lambda i: -hsps[i][2])
+            for i in order:
+                n = len([j for j in kept if hsps[j][0] <= hsps[i][0] and
+                         hsps[j][1] >= hsps[i][1]])
+                if n < limit:
+                    kept.append(i)
+            self.assertEqual(index.cull(limit), sorted(kept))
+
+    def test_predicate_filter(self):
+        from BlastPython.blast_filter import parse_predicate
+        sf = seq_factory_from_fasta(strand.both)
+        subjects = [sf.make(s[0]) for s in self.sseqs]
+        b = blaster(subjects[0], Program=EProgram.eBlastn)
+        spec = 'evalue < 1e-5 and bitscore > 40 and pident >= 90'
+        self.assertEqual(parse_predicate(spec), [
+            ('evalue', '<', 1e-5), ('bit_score', '>', 40), ('pident', '>=', 90)])
+        self.assertRaises(ValueError, parse_predicate, 'evalue <')
+        expected = []
+        for s in subjects:
+            _, r = b.blast(s)
+            hsps = [(hsp.score, hsp.evalue) for hsp in r.snapshot()
+                    if hsp.evalue < 1e-5 and hsp.bit_score > 40 and
+                    hsp.alignment_stats[3] >= 90]
+            if hsps:
+                expected.append((s.id, hsps))
+        self.assertTrue(expected)
+        stream = predicate_filter(blast_result_stream(b, iter(subjects)), spec)
+        self.assertEqual([(s.id, [(hsp.score, hsp.evalue) for hsp in r])
+                          for s, r in stream], expected)
+        stream = blast_filter(predicate_filter(
+            blast_result_stream(b, iter(subjects)), spec), max_count=1)
+        self.assertEqual(len(list(stream)), 1)
+
+    def test_all_vs_all(self):
+        from BlastPython.all_vs_all import get_context
+        sf = seq_factory_from_fasta(strand.both)
+        seqs = [sf.make(s[0]) for s in self.sseqs]
+        # a fixed search space makes evalues independent of the tiling
+        opts = {'Program': EProgram.eBlastn, 'EffectiveSearchSpace': 10**8}
+        expected = []
+        for i, q in enumerate(seqs):
+            b = blaster(q, cache=False, **opts)
+            for j, s in enumerate(seqs):
+                _, r = b.blast(s)
+                expected.extend([(i, j) + h[2:14] +
+                                 (get_context(EProgram.eBlastn, i, h[6]),) +
+                                 h[15:] for h in hsp_records(r)])
+            b.close()
+        self.assertTrue(expected)
+        for block_size in 1, 3, len(seqs):
+            ava = all_vs_all(seqs, symmetric=False, skip_diagonal=False,
+                             block_size=block_size, **opts)
+            self.assertEqual(sorted(ava), sorted(expected))
+            ava = all_vs_all(seqs, symmetric=False, block_size=block_size,
+                             **opts)
+            self.assertEqual(sorted(ava),
+                             sorted([r for r in expected if r[0] != r[1]]))
+            # the upper triangle is searched, the lower one is mirrored
+            ava = all_vs_all(seqs, block_size=block_size, **opts)
+            records = list(ava)
+            self.assertEqual(sorted([r for r in records if r[0] < r[1]]),
+                             sorted([r for r in expected if r[0] < r[1]]))
+            self.assertEqual(
+                len([r for r in records if r[0] > r[1]]),
+                len([r for r in records if r[0] < r[1]]))
+
+    def test_all_vs_all_resume(self):
+        from BlastPython.all_vs_all import FILE_HEADER, TILE_HEADER, RECORD
+        sf = seq_factory_from_fasta(strand.both)
+        seqs = [sf.make(s[0]) for s in self.sseqs]
+        def read_tiles(fname):
+            fp = open(fname, 'rb')
+            data = fp.read()
+            fp.close()
+            tiles, pos = [], FILE_HEADER.size
+            while pos < len(data):
+                bi, bj, n = TILE_HEADER.unpack_from(data, pos)
+                tiles.append(((bi, bj), n))
+                pos += TILE_HEADER.size + n * RECORD.size
+            self.assertEqual(pos, len(data))
+            return tiles
+        fname = 'all_vs_all_test.bin'
+        try:
+            ava = all_vs_all(seqs, block_size=2, result_file=fname,
+                             Program=EProgram.eBlastn)
+            expected = list(ava)
+            all_tiles = list(ava.tiles())
+            self.assertEqual(ava.computed_tiles, len(all_tiles))
+            tiles = read_tiles(fname)
+            self.assertEqual([t for t, _ in tiles], all_tiles)
+            size = os.path.getsize(fname)
+            last = TILE_HEADER.size + tiles[-1][1] * RECORD.size
+            for cut, n_computed in (0, 0), (1, 1), (last, 1), (last + 1, 2):
+                # the file is followed by the beginning of a header that
+                # was never completed, or cut short at or within a tile
+                fp = open(fname, 'r+b')
+                if cut:
+                    fp.truncate(size - cut)
+                else:
+                    fp.seek(0, os.SEEK_END)
+                    fp.write(TILE_HEADER.pack(0, 0, 1)[:5])
+                fp.close()
+                ava = all_vs_all(seqs, block_size=2, result_file=fname,
+                                 Program=EProgram.eBlastn)
+                self.assertEqual(list(ava), expected)
+                self.assertEqual(ava.computed_tiles, n_computed)
+                self.assertEqual(read_tiles(fname), tiles)
+                self.assertEqual(os.path.getsize(fname), size)
+            self.assertRaises(ValueError, iter(all_vs_all(
+                seqs, block_size=3, result_file=fname)).next)
+        finally:
+            os.remove(fname)
+
+    def test_mirror_record(self):
+        from BlastPython.all_vs_all import mirror_record
+        # query 2 (length 100) vs subject 5 (length 50), blastn
+        plus = (2, 5, 40, 75.5, 1e-20, 38, 1, 10, 50, 20, 1, 5, 45, 15,
+                4, 40, 2, 0, 95.0)
+        self.assertEqual(mirror_record(plus, 100, 50),
+                         (5, 2, 40, 75.5, 1e-20, 38, 1, 5, 45, 15,
+                          1, 10, 50, 20, 10, 40, 2, 0, 95.0))
+        # on the minus strand, query coordinates are on the reverse
+        # complement: the mirrored match is on the minus strand of the
+        # new query, i.e. the old subject, and its coordinates move
+        # to the other strand accordingly
+        minus = (2, 5, 40, 75.5, 1e-20, 38, -1, 10, 50, 20, 1, 5, 45, 15,
+                 5, 40, 2, 0, 95.0)
+        mirrored = mirror_record(minus, 100, 50)
+        self.assertEqual(mirrored,
+                         (5, 2, 40, 75.5, 1e-20, 38, -1, 5, 45, 34,
+                          1, 50, 90, 79, 11, 40, 2, 0, 95.0))
+        for r in plus, minus:
+            self.assertEqual(mirror_record(mirror_record(r, 100, 50), 50, 100),
+                             r)
+        # tblastx: frames are swapped together with the segments
+        r = (2, 5, 40, 75.5, 1e-20, 12, -2, 3, 16, 5, 3, 1, 14, 3,
+             16, 13, 1, 0, 92.3)
+        mirrored = mirror_record(r, 100, 50, EProgram.eTblastx)
+        self.assertEqual(mirrored,
+                         (5, 2, 40, 75.5, 1e-20, 12, 3, 1, 14, 3,
+                          -2, 3, 16, 5, 32, 13, 1, 0, 92.3))
+        self.assertEqual(mirror_record(mirrored, 50, 100, EProgram.eTblastx),
+                         r)
+
+    def test_cross_search_blocks(self):
+        from BlastPython import cross_search as cs
+        sf = seq_factory_from_fasta(strand.both)
+        seqs = [sf.make(s[0]) for s in self.sseqs]
+        stats = (len(seqs), sum([len(s) for s in seqs]))
+        self.assertEqual(cs.get_stats(cs.get_source(seqs)), stats)
+        # same residues, but many short queries are costly to set up again
+        self.assertEqual(
+            plan_cross_search((1, 20000), (1, 20000), 200000)['outer'],
+            'subject')
+        self.assertEqual(
+            plan_cross_search((1000, 20000), (1, 20000), 200000)['outer'],
+            'query')
+        for budget in 2000, 5000, 20000, 200000, 512*1024*1024:
+            plan = plan_cross_search(stats, stats, budget)
+            if plan['outer'] == 'query':
+                bpr_o = cs.QUERY_BYTES_PER_RESIDUE
+                bpr_i = cs.SUBJECT_BYTES_PER_RESIDUE
+            else:
+                bpr_o = cs.SUBJECT_BYTES_PER_RESIDUE
+                bpr_i = cs.QUERY_BYTES_PER_RESIDUE
+            self.assertTrue(plan['outer_residues'] * bpr_o <=
+                            max(cs.OUTER_FRACTION * budget, bpr_o))
+            self.assertTrue(plan['inner_residues'] * bpr_i <=
+                            max((1 - cs.OUTER_FRACTION) * budget, bpr_i))
+            for max_residues in plan['outer_residues'], plan['inner_residues']:
+                blocks = list(cs.get_blocks(iter(seqs), max_residues))
+                # no sequence dropped or duplicated, order kept
+                self.assertEqual([s for b in blocks for s in b], seqs)
+                for b in blocks:
+                    self.assertTrue(len(b) == 1 or
+                                    sum([len(s) for s in b]) <= max_residues)
+
+    def test_cross_search(self):
+        from BlastPython.cross_search import split_results
+        sf = seq_factory_from_fasta(strand.both)
+        seqs = [sf.make(s[0]) for s in self.sseqs]
+        queries, subjects = seqs[:4], seqs[2:]
+        # a fixed search space makes evalues independent of the blocking
+        opts = {'Program': EProgram.eBlastn, 'EffectiveSearchSpace': 10**8}
+        def get_records(triples):
+            q_index = dict([(id(q), i) for i, q in enumerate(queries)])
+            s_index = dict([(id(s), j) for j, s in enumerate(subjects)])
+            records = []
+            for q, s, hsp_list in triples:
+                head = (q_index[id(q)], s_index[id(s)])
+                records.extend([head + (hsp.score, hsp.bit_score, hsp.evalue,
+                                        hsp.num_ident) + hsp.query +
+                                hsp.subject + hsp.alignment_stats
+                                for hsp in hsp_list])
+            return sorted(records)
+        expected = []
+        for q in queries:
+            b = blaster(q, cache=False, **opts)
+            expected.append(get_records((q, s, r[0][0]) for s, r in
+                                        b.blast_many(subjects) if r[0]))
+            b.close()
+        expected = sorted(sum(expected, []))
+        self.assertTrue(expected)
+        # split_results maps block indices back to the sequences
+        b = blaster(queries, cache=False, **opts)
+        _, results = b.blast(subjects)
+        self.assertEqual(
+            get_records(split_results(queries, subjects, results)), expected)
+        b.close()
+        # either side outer, with one or more blocks on each side (the
+        # query statistics are understated in one case, which only
+        # changes the plan)
+        for budget, query_stats, outer in (
+            (5000, None, 'query'), (10000, None, 'subject'),
+            (512*1024*1024, None, 'query'), (2000, (4, 1), 'subject')):
+            plan = plan_cross_search(
+                query_stats or (len(queries), sum([len(q) for q in queries])),
+                (len(subjects), sum([len(s) for s in subjects])), budget)
+            self.assertEqual(plan['outer'], outer)
+            triples = cross_search(queries, lambda: iter(subjects), budget,
+                                   query_stats=query_stats, **opts)
+            self.assertEqual(get_records(triples), expected)
 
 
 def suite():
@@ -128,6 +538,19 @@ def suite():
     suite.addTest(streams_tc('test_blast_seq_stream'))
     suite.addTest(streams_tc('test_FS_IO'))
     suite.addTest(streams_tc('test_FS_IO_no_newline_at_EOF'))
+    suite.addTest(streams_tc('test_process_blast_result_stream'))
+    suite.addTest(streams_tc('test_process_blast_result_stream_errors'))
+    suite.addTest(streams_tc('test_kmer_prefilter'))
+    suite.addTest(streams_tc('test_top_k_sink'))
+    suite.addTest(streams_tc('test_adaptive_top_k_sink'))
+    suite.addTest(streams_tc('test_results_io'))
+    suite.addTest(streams_tc('test_interval_index'))
+    suite.addTest(streams_tc('test_predicate_filter'))
+    suite.addTest(streams_tc('test_cross_search_blocks'))
+    suite.addTest(streams_tc('test_cross_search'))
+    suite.addTest(streams_tc('test_all_vs_all'))
+    suite.addTest(streams_tc('test_all_vs_all_resume'))
+    suite.addTest(streams_tc('test_mirror_record'))
     return suite
 
 